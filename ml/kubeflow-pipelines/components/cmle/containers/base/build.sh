@@ -16,6 +16,7 @@
 
 mkdir -p ./build
 rsync -arvp "../../deploy"/ ./build/
+rsync -arvp "../../../shared/export_readiness.py" ./build/
 
 docker build -t ml-pipeline-cmle-base .
 rm -rf ./build
@@ -15,11 +15,9 @@
 """Deploy a TF model to CMLE."""
 
 import argparse
-import os
 import subprocess
-import time
 
-from tensorflow.python.lib.io import file_io
+import export_readiness
 
 def main(argv=None):
   parser = argparse.ArgumentParser(description='ML Trainer')
@@ -47,26 +45,23 @@ def main(argv=None):
       default='us-central1'
       )
 
+  parser.add_argument(
+      '--export-wait-secs',
+      help='Seconds to wait for a complete model export.',
+      default=export_readiness.DEFAULT_TIMEOUT_SECS,
+      type=int)
   args = parser.parse_args()
 
-  # Make sure the model dir exists before proceeding, as sometimes it takes a few seconds to become
-  # available after training completes.
-  retries = 0
-  sleeptime = 5
-  while retries < 20:
-    try:
-      model_location = os.path.join(args.gcs_path, file_io.list_directory(args.gcs_path)[-1])
-      print("model location: %s" % model_location)
-      break
-    except Exception as e:
-      print(e)
-      print("Sleeping %s seconds to wait for GCS files..." % sleeptime)
-      time.sleep(sleeptime)
-      retries += 1
-      sleeptime *= 2
-  if retries >=20:
-    print("could not get model location subdir from %s, exiting" % args.gcs_path)
+  # Wait for a model export. The CMLE trainers write no success marker, so
+  # the newest export that is not a temp dir is deployed, as before.
+  try:
+    model_location = export_readiness.wait_for_export(
+        args.gcs_path, timeout_secs=args.export_wait_secs,
+        require_marker=False)
+  except RuntimeError as e:
+    print(e)
     exit(1)
+  print("model location: %s" % model_location)
 
 
   model_create_command = ['gcloud', 'ml-engine', 'models', 'create', args.model_name, '--regions',
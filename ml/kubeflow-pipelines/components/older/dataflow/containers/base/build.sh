@@ -20,6 +20,8 @@ rsync -arvp "../../tfma"/ ./build/
 rsync -arvp "../../taxi_schema"/ ./build/
 rsync -arvp "../../taxi_schema"/ ./build/transform/
 rsync -arvp "../../taxi_schema"/ ./build/analysis/
+rsync -arvp "../../../../shared/export_readiness.py" ./build/
+rsync -arvp "../../../../shared/beam_options.py" ./build/
 
 docker build -t ml-pipeline-dataflow-base .
 rm -rf ./build
@@ -0,0 +1,329 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process slice metrics for the chicago_taxi eval model, without Beam.
+
+The eval SavedModel is loaded once and scores the eval csv in large
+batches. The slices of all the specs are then computed with NumPy group-bys
+over the whole eval set, giving per slice the example count, AUC, label and
+prediction means, and the calibration plot / prediction histogram buckets.
+
+The result is written as JSON to the TFMA output directory and read back
+with load_local_eval_result, whose slicing_metrics are shaped like those of
+tfma.load_eval_result and use the same metric keys as the Beam path with the
+post_export_metrics example_count and auc callbacks.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import csv
+import json
+import os
+
+import numpy as np
+
+from tensorflow.python.lib.io import file_io
+
+from tensorflow_model_analysis.eval_saved_model import load
+
+import taxi_schema.taxi_schema as taxi
+
+# File the local metrics are written to in the TFMA output directory.
+LOCAL_METRICS_FILE = 'local_slice_metrics.json'
+
+DEFAULT_BATCH_SIZE = 4096
+
+# Same bucketing as
+# post_export_metrics.calibration_plot_and_prediction_histogram.
+DEFAULT_NUM_BUCKETS = 10000
+
+# Metric keys of the post_export_metrics callbacks and the estimator head.
+EXAMPLE_COUNT_KEY = 'post_export_metrics/example_count'
+AUC_KEY = 'post_export_metrics/auc'
+LABEL_MEAN_KEY = 'label/mean'
+PREDICTION_MEAN_KEY = 'prediction/mean'
+
+# Prediction keys holding the probability of the positive class.
+PROBABILITY_KEYS = ['logistic', 'probabilities']
+
+LocalEvalResult = collections.namedtuple(
+    'LocalEvalResult', ['slicing_metrics', 'plots'])
+
+
+def _spec_parts(spec):
+  """Returns the sorted columns and feature values of a SingleSliceSpec."""
+  # pylint: disable=protected-access
+  return sorted(spec._columns), sorted(spec._features)
+
+
+def _unwrap(value):
+  """Returns the scalar held by a value fetched from the EvalSavedModel."""
+  while isinstance(value, dict):
+    if 'node' in value:
+      value = value['node']
+    elif len(value) == 1:
+      value = list(value.values())[0]
+    else:
+      # The probability of the positive class of a binary classifier.
+      keys = [key for key in PROBABILITY_KEYS if key in value]
+      if not keys:
+        raise ValueError(
+            'Expected one of the prediction keys %s, got %s' %
+            (PROBABILITY_KEYS, sorted(value)))
+      value = value[keys[0]]
+  return np.asarray(value).reshape(-1)[-1]
+
+
+def _read_csv_records(csv_files):
+  """Yields the text of every record of the csv files, without the header.
+
+  The csv module finds where each record ends, so a quoted value may span
+  several lines.
+  """
+  consumed = []
+
+  def read_lines(f):
+    for line in f:
+      consumed.append(line)
+      yield line
+
+  for path in csv_files:
+    with file_io.FileIO(path, 'r') as f:
+      reader = csv.reader(read_lines(f))
+      next(reader, None)  # skip header line
+      del consumed[:]
+      for _ in reader:
+        record = ''.join(consumed)
+        del consumed[:]
+        if record.strip():
+          yield record
+
+
+def score(eval_model_dir, csv_files, schema, batch_size=DEFAULT_BATCH_SIZE):
+  """Scores the csv files with the eval model.
+
+  Args:
+    eval_model_dir: Directory of the EvalSavedModel.
+    csv_files: List of csv files with a header line, e.g. from
+      taxi.resolve_csv_files.
+    schema: The schema of the raw data.
+    batch_size: Number of examples scored per call of the model.
+
+  Returns:
+    A (columns, predictions, labels) tuple, where columns maps each raw
+    feature name to a NumPy array of its value per example, or None when
+    missing.
+  """
+  eval_model = load.EvalSavedModel(eval_model_dir)
+  csv_coder = taxi.make_csv_coder(schema)
+  proto_coder = taxi.make_proto_coder(schema)
+  names = list(taxi.get_raw_feature_spec(schema))
+  columns = {name: [] for name in names}
+  predictions = []
+  labels = []
+
+  def score_batch(batch):
+    for fpl in eval_model.predict_list(batch):
+      predictions.append(_unwrap(fpl.predictions))
+      labels.append(_unwrap(fpl.labels))
+
+  batch = []
+  for record in _read_csv_records(csv_files):
+    instance = csv_coder.decode(record)
+    for name in names:
+      value = instance[name]
+      if np.ndim(value):
+        # VarLenFeature values are lists, empty when missing.
+        value = value[0] if len(value) else None
+      columns[name].append(value)
+    batch.append(proto_coder.encode(instance))
+    if len(batch) == batch_size:
+      score_batch(batch)
+      batch = []
+  if batch:
+    score_batch(batch)
+
+  return ({name: np.array(values, dtype=object)
+           for name, values in columns.items()},
+          np.array(predictions, dtype=np.float64),
+          np.array(labels, dtype=np.float64))
+
+
+def _group(columns, spec_columns, spec_features):
+  """Returns the slice keys and the slice index of each example, or -1."""
+  num_examples = len(next(iter(columns.values())))
+  selected = np.ones(num_examples, dtype=bool)
+  for name, value in spec_features:
+    selected &= columns[name] == value
+  for name in spec_columns:
+    selected &= np.array([v is not None for v in columns[name]])
+  if not spec_columns:
+    keys = [tuple(spec_features)] if selected.any() else []
+    return keys, np.where(selected, 0, -1)
+
+  selected_indices = np.flatnonzero(selected)
+  key_strings = np.array(
+      ['\0'.join(str(columns[name][i]) for name in spec_columns)
+       for i in selected_indices], dtype=object)
+  _, first_index, inverse = np.unique(
+      key_strings, return_index=True, return_inverse=True)
+  keys = []
+  for i in first_index:
+    example = selected_indices[i]
+    # As in TFMA slice keys, the columns are sorted by name.
+    keys.append(tuple(sorted(
+        [(name, columns[name][example]) for name in spec_columns] +
+        list(spec_features))))
+  slice_ids = np.full(num_examples, -1)
+  slice_ids[selected_indices] = inverse
+  return keys, slice_ids
+
+
+def _auc(predictions, labels):
+  """Returns the ROC AUC, with tied predictions sharing their mean rank."""
+  positives = labels.sum()
+  negatives = len(labels) - positives
+  if not positives or not negatives:
+    return None
+  order = np.argsort(predictions, kind='mergesort')
+  _, inverse, counts = np.unique(predictions[order], return_inverse=True,
+                                 return_counts=True)
+  ends = np.cumsum(counts)
+  mean_ranks = (ends - (counts - 1) / 2.)[inverse]
+  rank_sum = mean_ranks[labels[order] > 0].sum()
+  return float((rank_sum - positives * (positives + 1) / 2.) /
+               (positives * negatives))
+
+
+def compute_slice_metrics(columns, predictions, labels, slice_spec,
+                          num_buckets=DEFAULT_NUM_BUCKETS):
+  """Computes the metrics and plots of every slice of every spec.
+
+  Args:
+    columns: Raw feature columns as returned by score.
+    predictions: Predicted probability of each example.
+    labels: Label of each example.
+    slice_spec: List of tfma.SingleSliceSpec, e.g. ALL_SPECS.
+    num_buckets: Number of prediction buckets of the calibration plot.
+
+  Returns:
+    A LocalEvalResult.
+  """
+  buckets = np.minimum((predictions * num_buckets).astype(np.int64),
+                       num_buckets - 1)
+  slicing_metrics = []
+  plots = []
+  for spec in slice_spec:
+    keys, slice_ids = _group(columns, *_spec_parts(spec))
+    if not keys:
+      continue
+    selected = slice_ids >= 0
+    ids = slice_ids[selected]
+    slice_predictions = predictions[selected]
+    slice_labels = labels[selected]
+    num_slices = len(keys)
+    counts = np.bincount(ids, minlength=num_slices)
+    label_sums = np.bincount(ids, slice_labels, minlength=num_slices)
+    prediction_sums = np.bincount(ids, slice_predictions, minlength=num_slices)
+
+    cells = ids * num_buckets + buckets[selected]
+    cell_counts = np.bincount(cells, minlength=num_slices * num_buckets)
+    cell_labels = np.bincount(cells, slice_labels,
+                              minlength=num_slices * num_buckets)
+    cell_predictions = np.bincount(cells, slice_predictions,
+                                   minlength=num_slices * num_buckets)
+
+    order = np.argsort(ids, kind='mergesort')
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    for i, key in enumerate(keys):
+      members = order[bounds[i]:bounds[i + 1]]
+      slicing_metrics.append((key, {
+          EXAMPLE_COUNT_KEY: int(counts[i]),
+          LABEL_MEAN_KEY: label_sums[i] / counts[i],
+          PREDICTION_MEAN_KEY: prediction_sums[i] / counts[i],
+          AUC_KEY: _auc(slice_predictions[members], slice_labels[members]),
+      }))
+      first = i * num_buckets
+      nonempty = np.flatnonzero(cell_counts[first:first + num_buckets])
+      plots.append((key, {
+          'calibration_histogram_buckets': [{
+              'lower_threshold': bucket / num_buckets,
+              'upper_threshold': (bucket + 1) / num_buckets,
+              'num_weighted_examples': int(cell_counts[first + bucket]),
+              'total_weighted_label': cell_labels[first + bucket],
+              'total_weighted_refined_prediction':
+                  cell_predictions[first + bucket],
+          } for bucket in nonempty],
+      }))
+  return LocalEvalResult(slicing_metrics=slicing_metrics, plots=plots)
+
+
+def _to_json_value(value):
+  if isinstance(value, bytes):
+    return value.decode('utf-8')
+  if isinstance(value, np.generic):
+    return value.item()
+  return value
+
+
+def _key_to_json(key):
+  return [[column, _to_json_value(value)] for column, value in key]
+
+
+def write_local_eval_result(result, output_path):
+  """Writes a LocalEvalResult to the TFMA output directory."""
+  file_io.recursive_create_dir(output_path)
+  file_io.write_string_to_file(
+      os.path.join(output_path, LOCAL_METRICS_FILE),
+      json.dumps({
+          'slicing_metrics': [[_key_to_json(key), metrics]
+                              for key, metrics in result.slicing_metrics],
+          'plots': [[_key_to_json(key), plot] for key, plot in result.plots],
+      }, default=_to_json_value))
+
+
+def load_local_eval_result(output_path):
+  """Loads the LocalEvalResult written to a TFMA output directory."""
+  data = json.loads(file_io.read_file_to_string(
+      os.path.join(output_path, LOCAL_METRICS_FILE)))
+  return LocalEvalResult(
+      slicing_metrics=[(tuple(tuple(part) for part in key), metrics)
+                       for key, metrics in data['slicing_metrics']],
+      plots=[(tuple(tuple(part) for part in key), plot)
+             for key, plot in data['plots']])
+
+
+def run_local_tfma(slice_spec, eval_model_dir, tfma_run_dir, input_csv,
+                   batch_size=DEFAULT_BATCH_SIZE,
+                   num_buckets=DEFAULT_NUM_BUCKETS):
+  """Computes the slice metrics in process and returns a LocalEvalResult.
+
+  Args:
+    slice_spec: List of tfma.SingleSliceSpec, e.g. ALL_SPECS.
+    eval_model_dir: Directory of the EvalSavedModel.
+    tfma_run_dir: TFMA output directory the result is written to.
+    input_csv: Eval csv file, glob of csv shards or their manifest.
+    batch_size: Number of examples scored per call of the model.
+    num_buckets: Number of prediction buckets of the calibration plot.
+  """
+  schema = taxi.get_schema('schema.pbtxt')
+  columns, predictions, labels = score(
+      eval_model_dir, taxi.resolve_csv_files(input_csv), schema, batch_size)
+  result = compute_slice_metrics(columns, predictions, labels, slice_spec,
+                                 num_buckets)
+  write_local_eval_result(result, tfma_run_dir)
+  return result
@@ -0,0 +1,258 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for local_slice_metrics against the Beam TFMA path.
+
+Like model_analysis-taxi.py, this expects the layout of the container, i.e.
+the tft, taxi_schema and shared modules on the PYTHONPATH and schema.pbtxt in
+the working directory or next to the tft modules.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import imp
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_model_analysis as tfma
+
+import taxi_schema.taxi_schema as taxi
+
+import export_readiness
+import local_slice_metrics
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_NUM_ROWS = 400
+
+_FEATURE_KEYS = ['trip_miles', 'fare', 'trip_start_hour']
+
+
+def _schema_dir():
+  for path in [os.getcwd(), _DIR, os.path.join(_DIR, '..', 'tft')]:
+    if os.path.exists(os.path.join(path, 'schema.pbtxt')):
+      return path
+  raise IOError('schema.pbtxt not found')
+
+
+def _load_model_analysis():
+  return imp.load_source('model_analysis_taxi',
+                         os.path.join(_DIR, 'model_analysis-taxi.py'))
+
+
+def _sample_rows():
+  """Returns taxi rows with some optional values missing or quoted."""
+  rng = np.random.RandomState(0)
+  rows = []
+  for i in range(_NUM_ROWS):
+    fare = round(rng.uniform(3., 40.), 2)
+    tips = round(fare * rng.choice([0., 0.1, 0.25, 0.3]), 2)
+    company = ['', 'Flash Cab', '"Taxi Affiliation Services, Inc"'][i % 3]
+    rows.append(','.join(str(value) for value in [
+        rng.randint(1, 78), fare, rng.randint(1, 13), i % 24,
+        rng.randint(1, 8), 1400000000 + 900 * i, 41.88, -87.63,
+        '' if i % 5 else 41.92, '' if i % 5 else -87.66,
+        round(fare / 3., 2), '', '', 'Cash' if i % 2 else 'Credit Card',
+        company, '' if i % 7 else 60 * (i % 40), '', tips]))
+  return rows
+
+
+def _write_csv(path, rows):
+  with open(path, 'w') as f:
+    f.write(','.join(taxi.CSV_COLUMN_NAMES) + '\n')
+    for row in rows:
+      f.write(row + '\n')
+
+
+def _label(tips, fare):
+  return (tips > fare * 0.2).astype(np.int64)
+
+
+def _export_eval_model(schema, rows, model_dir, export_dir_base):
+  """Trains a small classifier on rows and exports it for TFMA."""
+  coder = taxi.make_csv_coder(schema)
+  instances = [coder.decode(row) for row in rows]
+  features = {key: np.array([instance[key] for instance in instances],
+                            dtype=np.float32)
+              for key in _FEATURE_KEYS + ['tips']}
+  labels = _label(features.pop('tips'), features['fare'])
+  estimator = tf.estimator.LinearClassifier(
+      feature_columns=[tf.feature_column.numeric_column(key)
+                       for key in _FEATURE_KEYS],
+      model_dir=model_dir)
+  estimator.train(tf.estimator.inputs.numpy_input_fn(
+      features, labels, batch_size=50, num_epochs=2, shuffle=False))
+
+  def eval_input_receiver_fn():
+    serialized_tf_example = tf.placeholder(
+        dtype=tf.string, shape=[None], name='input_example_tensor')
+    raw_features = tf.parse_example(serialized_tf_example,
+                                    taxi.get_raw_feature_spec(schema))
+    return tfma.export.EvalInputReceiver(
+        features=raw_features,
+        receiver_tensors={'examples': serialized_tf_example},
+        labels=tf.cast(
+            raw_features['tips'] > raw_features['fare'] * 0.2, tf.int64))
+
+  eval_model_dir = tfma.export.export_eval_savedmodel(
+      estimator=estimator, export_dir_base=export_dir_base,
+      eval_input_receiver_fn=eval_input_receiver_fn)
+  if isinstance(eval_model_dir, bytes):
+    eval_model_dir = eval_model_dir.decode('utf-8')
+  export_readiness.write_success_marker(eval_model_dir)
+  return eval_model_dir
+
+
+def _metric_value(value):
+  if isinstance(value, dict):
+    return value.get('doubleValue', value.get('value'))
+  return value
+
+
+def _by_slice(slicing_metrics):
+  return {tuple(tuple(part) for part in key): metrics
+          for key, metrics in slicing_metrics}
+
+
+class LocalSliceMetricsTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls._cwd = os.getcwd()
+    schema_dir = _schema_dir()
+    os.chdir(schema_dir)
+    cls._temp_dir = tempfile.mkdtemp()
+    cls._csv = os.path.join(cls._temp_dir, 'eval.csv')
+    rows = _sample_rows()
+    _write_csv(cls._csv, rows)
+    cls._schema = taxi.read_schema(os.path.join(schema_dir, 'schema.pbtxt'))
+    cls._export_base = os.path.join(cls._temp_dir, 'export')
+    cls._eval_model_dir = _export_eval_model(
+        cls._schema, rows, os.path.join(cls._temp_dir, 'model'),
+        cls._export_base)
+
+  @classmethod
+  def tearDownClass(cls):
+    os.chdir(cls._cwd)
+    shutil.rmtree(cls._temp_dir)
+
+  def test_matches_beam_path(self):
+    model_analysis = _load_model_analysis()
+    slice_spec = [model_analysis.OVERALL_SLICE_SPEC,
+                  model_analysis.FEATURE_COLUMN_SLICE_SPEC,
+                  model_analysis.FEATURE_VALUE_SPEC]
+    beam_dir = os.path.join(self._temp_dir, 'beam')
+    beam_result = model_analysis.run_tfma(
+        slice_spec=slice_spec, eval_model_base_dir=self._export_base,
+        tfma_run_dir=beam_dir, input_csv=self._csv, working_dir=beam_dir,
+        mode='local', project=None, setup_file=None,
+        add_metrics_callbacks=model_analysis.make_metrics_callbacks())
+    local_dir = os.path.join(self._temp_dir, 'local')
+    local_slice_metrics.run_local_tfma(
+        slice_spec, self._eval_model_dir, local_dir, self._csv)
+    local_result = local_slice_metrics.load_local_eval_result(local_dir)
+
+    beam_metrics = _by_slice(beam_result.slicing_metrics)
+    local_metrics = _by_slice(local_result.slicing_metrics)
+    self.assertEqual(sorted(beam_metrics), sorted(local_metrics))
+    # The overall slice and one slice per hour, the FEATURE_VALUE_SPEC slice
+    # having the same key as the hour 12 slice.
+    self.assertEqual(1 + 24, len(local_metrics))
+    for key, metrics in local_metrics.items():
+      beam = beam_metrics[key]
+      self.assertEqual(
+          _metric_value(beam[local_slice_metrics.EXAMPLE_COUNT_KEY]),
+          metrics[local_slice_metrics.EXAMPLE_COUNT_KEY])
+      for metric_key in [local_slice_metrics.LABEL_MEAN_KEY,
+                         local_slice_metrics.PREDICTION_MEAN_KEY]:
+        self.assertAlmostEqual(_metric_value(beam[metric_key]),
+                               metrics[metric_key], places=5, msg=key)
+      if metrics[local_slice_metrics.AUC_KEY] is not None:
+        # TFMA approximates the AUC with 10000 thresholds.
+        self.assertAlmostEqual(
+            _metric_value(beam[local_slice_metrics.AUC_KEY]),
+            metrics[local_slice_metrics.AUC_KEY], places=2, msg=key)
+
+  def test_local_parallel_matches_local(self):
+    model_analysis = _load_model_analysis()
+    slicing_metrics = {}
+    for mode in ['local', 'local-parallel']:
+      run_dir = os.path.join(self._temp_dir, mode)
+      result = model_analysis.run_tfma(
+          slice_spec=model_analysis.ALL_SPECS,
+          eval_model_base_dir=self._export_base, tfma_run_dir=run_dir,
+          input_csv=self._csv, working_dir=run_dir, mode=mode, project=None,
+          setup_file=None, local_workers=2,
+          add_metrics_callbacks=model_analysis.make_metrics_callbacks())
+      slicing_metrics[mode] = _by_slice(result.slicing_metrics)
+    self.assertEqual(sorted(slicing_metrics['local']),
+                     sorted(slicing_metrics['local-parallel']))
+    for key, metrics in slicing_metrics['local'].items():
+      parallel_metrics = slicing_metrics['local-parallel'][key]
+      self.assertEqual(sorted(metrics), sorted(parallel_metrics))
+      for metric_key, value in metrics.items():
+        self.assertAlmostEqual(_metric_value(value),
+                               _metric_value(parallel_metrics[metric_key]),
+                               places=5, msg=(key, metric_key))
+
+  def test_score_labels(self):
+    _, predictions, labels = local_slice_metrics.score(
+        self._eval_model_dir, [self._csv], self._schema)
+    self.assertEqual(_NUM_ROWS, len(predictions))
+    self.assertTrue(((predictions >= 0) & (predictions <= 1)).all())
+    coder = taxi.make_csv_coder(self._schema)
+    instances = [coder.decode(row) for row in _sample_rows()]
+    np.testing.assert_equal(
+        _label(np.array([instance['tips'] for instance in instances],
+                        dtype=np.float32),
+               np.array([instance['fare'] for instance in instances],
+                        dtype=np.float32)),
+        labels)
+
+
+class ReadCsvRecordsTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def test_quoted_newlines(self):
+    path = os.path.join(self._temp_dir, 'eval.csv')
+    with open(path, 'w') as f:
+      f.write('a,b\n1,"two\nlines"\n\n3,4\n5,"""quoted"""')
+    self.assertEqual(['1,"two\nlines"\n', '3,4\n', '5,"""quoted"""'],
+                     list(local_slice_metrics._read_csv_records([path])))  # pylint: disable=protected-access
+
+
+class UnwrapTest(unittest.TestCase):
+
+  def test_probabilities(self):
+    self.assertEqual(0.75, local_slice_metrics._unwrap(  # pylint: disable=protected-access
+        {'probabilities': [0.25, 0.75], 'classes': ['0', '1']}))
+
+  def test_missing_probability(self):
+    with self.assertRaisesRegexp(ValueError, 'logistic'):
+      local_slice_metrics._unwrap({'classes': ['0'], 'class_ids': [0]})  # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -20,9 +20,10 @@ from __future__ import print_function
 
 import argparse
 import datetime
+import hashlib
+import multiprocessing
 import os
 import tempfile
-import time
 import uuid
 
 import apache_beam as beam
@@ -42,6 +43,10 @@ from tensorflow_transform.beam import impl as beam_impl
 
 import taxi_schema.taxi_schema as taxi
 
+import beam_options
+import export_readiness
+import local_slice_metrics
+
 
 # An empty slice spec means the overall slice, that is, the whole dataset.
 OVERALL_SLICE_SPEC = tfma.SingleSliceSpec()
@@ -65,6 +70,12 @@ FEATURE_VALUE_SPEC = tfma.SingleSliceSpec(features=[('trip_start_hour', 12)])
 COLUMN_CROSS_VALUE_SPEC = tfma.SingleSliceSpec(columns=['trip_start_day'],
     features=[('trip_start_hour', 12)])
 
+# Marker written to an example cache entry once its pipeline succeeded.
+EXAMPLE_CACHE_COMPLETE_MARKER = '_SUCCESS'
+
+# File name prefix of the TFRecord shards of an example cache entry.
+EXAMPLE_CACHE_PREFIX = 'examples'
+
 ALL_SPECS = [
     OVERALL_SLICE_SPEC,
     FEATURE_COLUMN_SLICE_SPEC,
@@ -74,38 +85,55 @@ ALL_SPECS = [
     COLUMN_CROSS_VALUE_SPEC
 ]
 
+def make_metrics_callbacks():
+    """Returns the post export metrics computed by the Beam path.
+
+    example_count and auc are also computed by local_slice_metrics, under the
+    same metric keys.
+    """
+    return [post_export_metrics.example_count(),
+            post_export_metrics.auc(),
+            post_export_metrics.calibration_plot_and_prediction_histogram(),
+            post_export_metrics.auc_plots()]
+
+def example_cache_key(csv_files, schema_path):
+    """Returns the key of the cached tf.Examples of csv_files.
+
+    The csv files are fingerprinted by path, size and modification time, the
+    schema by its contents.
+    """
+    key = hashlib.sha256()
+    for path in csv_files:
+      stat = file_io.stat(path)
+      key.update(('%s\0%d\0%d\0' % (path, stat.length, stat.mtime_nsec)
+                 ).encode('utf-8'))
+    key.update(file_io.read_file_to_string(schema_path, binary_mode=True))
+    return key.hexdigest()
+
+
+def find_eval_model_dir(eval_model_base_dir):
+    """Returns the directory of the eval model exported under the base dir."""
+    print("eval model base dir: %s" % eval_model_base_dir)
+    # Wait for the trainer to mark an eval model export as complete.
+    eval_model_dir = export_readiness.wait_for_export(eval_model_base_dir)
+    print("eval model dir: %s" % eval_model_dir)
+    return eval_model_dir
+
+
 def run_tfma(slice_spec, eval_model_base_dir, tfma_run_dir, input_csv,
-             working_dir, mode, project, setup_file, add_metrics_callbacks=None):
+             working_dir, mode, project, setup_file, add_metrics_callbacks=None,
+             local_workers=None, example_cache_dir=None):
     """Does model analysis, using the given spec of how to 'slice', and returns an
     EvalResult that can be used with TFMA visualization functions.
-    """
 
-    print("eval model base dir: %s" % eval_model_base_dir)
-    # Make sure the model dir exists before proceeding, as sometimes it takes a few seconds to become
-    # available after training completes.
-    retries = 0
-    sleeptime = 5
-    while retries < 20:
-      try:
-        eval_model_dir = os.path.join(
-            eval_model_base_dir, file_io.list_directory(eval_model_base_dir)[0])
-        print("eval model dir: %s" % eval_model_dir)
-        if 'temp' not in eval_model_dir:
-          break
-        else:
-          print("Sleeping %s seconds to sync with GCS..." % sleeptime)
-          time.sleep(sleeptime)
-          retries += 1
-          sleeptime *= 2
-      except Exception as e:
-        print(e)
-        print("Sleeping %s seconds to sync with GCS..." % sleeptime)
-        time.sleep(sleeptime)
-        retries += 1
-        sleeptime *= 2
+    If example_cache_dir is set, the serialized tf.Examples of input_csv are
+    cached there as TFRecords by example_cache_key, and later runs over the
+    same csv files and schema read them instead of decoding the csv again.
+    """
 
+    eval_model_dir = find_eval_model_dir(eval_model_base_dir)
 
-    schema = taxi.read_schema('schema.pbtxt')
+    schema = taxi.get_schema('schema.pbtxt')
 
     temp_dir = os.path.join(working_dir, 'tmp')
 
@@ -115,6 +143,16 @@ def run_tfma(slice_spec, eval_model_base_dir, tfma_run_dir, input_csv,
         'project': project}
       pipeline_options = beam.pipeline.PipelineOptions(flags=[], **options)
       runner = 'DirectRunner'
+    elif mode == 'local-parallel':
+      print("mode == local-parallel")
+      # Runs the bundles in local worker processes, one per core by default.
+      options = {
+        'project': project,
+        'direct_num_workers': local_workers or multiprocessing.cpu_count(),
+        'direct_running_mode': 'multi_processing'}
+      pipeline_options = beam.pipeline.PipelineOptions(flags=[], **options)
+      beam_options.check_local_parallel_options(pipeline_options)
+      runner = 'DirectRunner'
     elif mode == 'cloud':
       print("mode == cloud")
       options = {
@@ -131,24 +169,46 @@ def run_tfma(slice_spec, eval_model_base_dir, tfma_run_dir, input_csv,
 
     display_only_data_location = input_csv
 
+    # input_csv may be a manifest of csv shards, a glob or one file.
+    csv_files = taxi.resolve_csv_files(input_csv)
+    example_cache_entry = None
+    write_cache_marker = False
+    if example_cache_dir:
+      example_cache_entry = os.path.join(
+          example_cache_dir, example_cache_key(csv_files, 'schema.pbtxt'))
+
     with beam.Pipeline(runner, options=pipeline_options) as pipeline:
       with beam_impl.Context(temp_dir=temp_dir):
-        csv_coder = taxi.make_csv_coder(schema)
-        raw_data = (
-            pipeline
-            | 'ReadFromText' >> beam.io.ReadFromText(
-                input_csv,
-                # coder=beam.coders.BytesCoder(),
-                skip_header_lines=1)
-            | 'ParseCSV' >> beam.Map(csv_coder.decode))
-
-        # Examples must be in clean tf-example format.
-        coder = taxi.make_proto_coder(schema)
-
-        raw_data = (
-            raw_data
-            # | 'CleanData' >> beam.Map(taxi.clean_raw_data_dict)
-            | 'ToSerializedTFExample' >> beam.Map(coder.encode))
+        if example_cache_entry and file_io.file_exists(
+            os.path.join(example_cache_entry, EXAMPLE_CACHE_COMPLETE_MARKER)):
+          print("Reading cached examples from %s" % example_cache_entry)
+          raw_data = (
+              pipeline
+              | 'ReadCachedExamples' >> beam.io.ReadFromTFRecord(
+                  os.path.join(example_cache_entry, EXAMPLE_CACHE_PREFIX) +
+                  '*'))
+        else:
+          csv_coder = taxi.make_csv_coder(schema)
+          raw_data = (
+              pipeline
+              | 'ListCSVFiles' >> beam.Create(csv_files)
+              | 'ReadFromText' >> beam.io.ReadAllFromText(
+                  # coder=beam.coders.BytesCoder(),
+                  skip_header_lines=1)
+              | 'ParseCSV' >> beam.Map(csv_coder.decode))
+
+          # Examples must be in clean tf-example format.
+          coder = taxi.make_proto_coder(schema)
+
+          raw_data = (
+              raw_data
+              # | 'CleanData' >> beam.Map(taxi.clean_raw_data_dict)
+              | 'ToSerializedTFExample' >> beam.Map(coder.encode))
+
+          if example_cache_entry:
+            _ = raw_data | 'CacheExamples' >> beam.io.WriteToTFRecord(
+                os.path.join(example_cache_entry, EXAMPLE_CACHE_PREFIX))
+            write_cache_marker = True
 
         _ = raw_data | 'EvaluateAndWriteResults' >> tfma.EvaluateAndWriteResults(
             eval_saved_model_path=eval_model_dir,
@@ -157,6 +217,11 @@ def run_tfma(slice_spec, eval_model_base_dir, tfma_run_dir, input_csv,
             add_metrics_callbacks=add_metrics_callbacks,
             display_only_data_location=input_csv)
 
+    if write_cache_marker:
+      # The cache entry is only used once the pipeline writing it succeeded.
+      file_io.write_string_to_file(
+          os.path.join(example_cache_entry, EXAMPLE_CACHE_COMPLETE_MARKER), '')
+
     return tfma.load_eval_result(output_path=tfma_run_dir)
 
 def parse_arguments():
@@ -166,7 +231,8 @@ def parse_arguments():
   parser.add_argument('--input_csv',
                       type=str,
                       required=True,
-                      help='Path to the CSV file to use for eval.')
+                      help=('Path to the CSV file to use for eval, a glob of '
+                            'CSV shards or their .manifest.json.'))
   parser.add_argument('--tfma_run_dir',
                       type=str,
                       required=True,
@@ -176,9 +242,15 @@ def parse_arguments():
                       required=True,
                       help='Path to the model exported for TFMA eval.')
   parser.add_argument('--mode',
-                      choices=['local', 'cloud'],
+                      choices=['local', 'local-parallel', 'cloud'],
                       required=True,
-                      help='whether to run the job locally or in Cloud Dataflow.')
+                      help=('whether to run the job locally, locally on all '
+                            'cores or in Cloud Dataflow.'))
+  parser.add_argument('--local_workers',
+                      type=int,
+                      default=None,
+                      help=('Number of worker processes in local-parallel '
+                            'mode. Defaults to the number of cores.'))
   parser.add_argument('--setup_file',
                       type=str,
                       required=True,
@@ -186,6 +258,17 @@ def parse_arguments():
   parser.add_argument('--project',
                       type=str,
                       help='The GCP project to run the dataflow job, if running in the `cloud` mode.')
+  parser.add_argument('--engine',
+                      choices=['beam', 'local'],
+                      default='beam',
+                      help=('Compute the metrics with a Beam pipeline, or in '
+                            'process with local_slice_metrics for quick '
+                            'iterations.'))
+  parser.add_argument('--example_cache_dir',
+                      type=str,
+                      help=('Directory caching the serialized tf.Examples of '
+                            'the eval CSV for later runs over the same CSV '
+                            'and schema.'))
   return parser.parse_args()
 
 
@@ -193,6 +276,14 @@ def main():
   tf.logging.set_verbosity(tf.logging.INFO)
   args = parse_arguments()
 
+  if args.engine == 'local':
+    local_slice_metrics.run_local_tfma(
+        slice_spec=ALL_SPECS,
+        eval_model_dir=find_eval_model_dir(args.eval_model_dir),
+        tfma_run_dir=args.tfma_run_dir,
+        input_csv=args.input_csv)
+    return
+
   tfma_result = run_tfma(input_csv=args.input_csv,
                          tfma_run_dir=args.tfma_run_dir,
                          eval_model_base_dir=args.eval_model_dir,
@@ -200,10 +291,9 @@ def main():
                          working_dir=args.tfma_run_dir,
                          mode=args.mode, project=args.project,
                          setup_file=args.setup_file,
-                         add_metrics_callbacks=[
-                            post_export_metrics.calibration_plot_and_prediction_histogram(),
-                            post_export_metrics.auc_plots()]
-                         )
+                         local_workers=args.local_workers,
+                         example_cache_dir=args.example_cache_dir,
+                         add_metrics_callbacks=make_metrics_callbacks())
 
 
 if __name__== "__main__":
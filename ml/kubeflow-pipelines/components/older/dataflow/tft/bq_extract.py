@@ -0,0 +1,185 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sources and a local cache for the BigQuery extracts of the taxi data.
+
+ExtractCache stores the rows returned by a query as Avro files, keyed by the
+normalized SQL text and the last modification time of the queried table, so
+that repeated runs on an unchanged table read the files instead of
+BigQuery. The rows are read through a source object, BigQueryExtractSource
+by default or e.g. a LocalTableSource for local runs without BigQuery.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import apache_beam as beam
+
+from tensorflow.python.lib.io import file_io
+
+# Marker written to a cache entry once its pipeline succeeded.
+COMPLETE_MARKER = '_SUCCESS'
+
+# File name prefix of the Avro shards of a cache entry.
+EXTRACT_PREFIX = 'extract'
+
+# Avro types of the columns selected by taxi_preprocess_bq.make_sql.
+EXTRACT_COLUMN_TYPES = [
+    ('pickup_community_area', 'string'),
+    ('dropoff_community_area', 'string'),
+    ('pickup_census_tract', 'string'),
+    ('dropoff_census_tract', 'string'),
+    ('fare', 'double'),
+    ('trip_start_month', 'long'),
+    ('trip_start_hour', 'long'),
+    ('trip_start_day', 'long'),
+    ('trip_start_timestamp', 'long'),
+    ('pickup_latitude', 'double'),
+    ('pickup_longitude', 'double'),
+    ('dropoff_latitude', 'double'),
+    ('dropoff_longitude', 'double'),
+    ('trip_miles', 'double'),
+    ('payment_type', 'string'),
+    ('company', 'string'),
+    ('trip_seconds', 'long'),
+    ('tips', 'double'),
+]
+
+
+def _extract_schema():
+  from avro import schema as avro_schema  # pylint: disable=g-import-not-at-top
+  parse = getattr(avro_schema, 'parse', None) or avro_schema.Parse
+  return parse(json.dumps({
+      'type': 'record',
+      'name': 'TaxiExtract',
+      'fields': [{'name': name, 'type': ['null', avro_type], 'default': None}
+                 for name, avro_type in EXTRACT_COLUMN_TYPES],
+  }))
+
+
+def normalize_sql(query):
+  """Returns query with its whitespace collapsed, for use as a cache key."""
+  return ' '.join(query.split())
+
+
+class BigQueryExtractSource(object):
+  """Reads query results from BigQuery.
+
+  The table snapshot is the last modification time of the table, read with
+  the google-cloud-bigquery client.
+  """
+
+  def __init__(self, project=None):
+    self._project = project
+
+  def table_snapshot(self, table_name):
+    from google.cloud import bigquery  # pylint: disable=g-import-not-at-top
+    client = bigquery.Client(project=self._project)
+    table = client.get_table(bigquery.TableReference.from_string(
+        table_name, default_project=self._project))
+    return table.modified.isoformat()
+
+  def read(self, pipeline, query, label):
+    return pipeline | label >> beam.io.Read(
+        beam.io.BigQuerySource(query=query, use_standard_sql=True))
+
+
+class LocalTableSource(object):
+  """A local stand-in for a BigQuery table, e.g. for tests.
+
+  The table is a file of newline delimited JSON rows holding the columns of
+  EXTRACT_COLUMN_TYPES. The query is not evaluated, every read returns all
+  the rows of the file. The snapshot changes with the file contents.
+  """
+
+  def __init__(self, path):
+    self._path = path
+
+  def table_snapshot(self, table_name):
+    del table_name  # Unused, there is a single local table.
+    return hashlib.sha256(
+        file_io.read_file_to_string(self._path, binary_mode=True)).hexdigest()
+
+  def read(self, pipeline, query, label):
+    del query  # Unused, see the class docstring.
+    return (pipeline
+            | label >> beam.io.ReadFromText(self._path)
+            | label + '-ParseJSON' >> beam.Map(json.loads))
+
+
+class ExtractCache(object):
+  """Reads query results through a source, caching them in a directory.
+
+  A cache entry is only used once the pipeline that wrote it succeeded and
+  commit() was called; until then the rows are read from the source.
+  """
+
+  def __init__(self, cache_dir, source):
+    """Creates the cache.
+
+    Args:
+      cache_dir: Directory holding the cache entries, or None to always read
+        from the source.
+      source: The source to read query results from, e.g. a
+        BigQueryExtractSource.
+    """
+    self._cache_dir = cache_dir
+    self._source = source
+    self._pending = []
+
+  def entry_dir(self, table_name, query):
+    """Returns the directory of the cache entry for query on table_name."""
+    key = hashlib.sha256()
+    for part in (normalize_sql(query), self._source.table_snapshot(table_name)):
+      key.update(part.encode('utf-8'))
+      key.update(b'\0')
+    return os.path.join(self._cache_dir, key.hexdigest())
+
+  def read(self, pipeline, table_name, query, label):
+    """Returns the PCollection of row dicts returned by query on table_name.
+
+    Args:
+      pipeline: The Beam pipeline to read in.
+      table_name: The queried table, identifying its snapshot.
+      query: The SQL query.
+      label: Label of the read step, unique in the pipeline.
+
+    Returns:
+      A PCollection of dicts from column name to value.
+    """
+    if not self._cache_dir:
+      return self._source.read(pipeline, query, label)
+    entry_dir = self.entry_dir(table_name, query)
+    if file_io.file_exists(os.path.join(entry_dir, COMPLETE_MARKER)):
+      print('Reading cached extract from %s' % entry_dir)
+      return pipeline | label + '-FromCache' >> beam.io.ReadFromAvro(
+          os.path.join(entry_dir, EXTRACT_PREFIX) + '*')
+    rows = self._source.read(pipeline, query, label)
+    _ = rows | label + '-WriteCache' >> beam.io.WriteToAvro(
+        os.path.join(entry_dir, EXTRACT_PREFIX), _extract_schema(),
+        file_name_suffix='.avro')
+    self._pending.append(entry_dir)
+    return rows
+
+  def commit(self):
+    """Marks the entries written by a successful pipeline as complete."""
+    for entry_dir in self._pending:
+      file_io.write_string_to_file(
+          os.path.join(entry_dir, COMPLETE_MARKER), '')
+    self._pending = []
@@ -17,6 +17,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import csv
 
 
@@ -25,6 +26,12 @@ import six
 from six import moves
 import tensorflow as tf
 
+try:
+  import pyarrow as pa  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # pyarrow is only needed by CsvCoder.decode_record_batch.
+  pa = None
+
 
 # This is in agreement with Tensorflow conversions for Unicode values for both
 # Python 2 and 3 (and also works for non-Unicode objects). It is also in
@@ -75,6 +82,38 @@ def _make_cast_fn(dtype):
     return _to_string
 
 
+def _make_bytes_cast_fn(dtype):
+  """Return a function to extract the typed value from a bytes feature value.
+
+  This is the counterpart of `_make_cast_fn` for values which are already
+  bytes: numbers are parsed straight from the bytes and string values are
+  kept as they are.
+
+  Args:
+    dtype: The type of the Tensorflow feature.
+  Returns:
+    A function to extract the value field from bytes depending on dtype, or
+    None if the bytes value is to be used as is.
+  """
+
+  def to_boolean(value):
+    if value == b'True':
+      return True
+    elif value == b'False':
+      return False
+    else:
+      raise ValueError('expected "True" or "False" as inputs.')
+
+  if dtype.is_integer:
+    return int
+  elif dtype.is_floating:
+    return float
+  elif dtype.is_bool:
+    return to_boolean
+  else:
+    return None
+
+
 def _decode_with_reader(value, reader):
   """Parse the input value into a list of strings.
 
@@ -93,6 +132,90 @@ def _decode_with_reader(value, reader):
   return result
 
 
+def _decode_column_with_reader(value_strs, cast_fn, reader):
+  """Parses every non-empty multivalent entry of a column into a value list.
+
+  Args:
+    value_strs: A sequence of strings, one per row.
+    cast_fn: The function used to cast each of the split values.
+    reader: The reader used for splitting each non-empty string.
+  Returns:
+    A list with one list of typed values per row.
+  """
+  return [[cast_fn(v) for v in _decode_with_reader(value_str, reader)]
+          if value_str else [] for value_str in value_strs]
+
+
+def _row_splits_from_lengths(lengths):
+  """Returns the int64 row_splits array for the given per-row lengths."""
+  row_splits = np.zeros(len(lengths) + 1, dtype=np.int64)
+  np.cumsum(lengths, out=row_splits[1:])
+  return row_splits
+
+
+def _arrow_array(values, dtype):
+  """Returns a pyarrow array holding the flat values of the given dtype."""
+  if dtype == tf.string:
+    return pa.array(values, type=pa.binary())
+  return pa.array(values, type=pa.from_numpy_dtype(dtype.as_numpy_dtype))
+
+
+def _arrow_list_array(row_splits, values, dtype):
+  """Returns a pyarrow list array with one list of values per row."""
+  return pa.ListArray.from_arrays(
+      pa.array(row_splits.astype(np.int32), type=pa.int32()),
+      _arrow_array(values, dtype))
+
+
+# Columnar output of `CsvCoder.decode_batch` for a single feature.
+#
+# values: The typed values of the feature. For `FixedLenFeature` this has shape
+#   [num_rows] + shape, otherwise it is the flat 1-D array of the values of all
+#   rows.
+# mask: A boolean array of shape [num_rows] which is False for rows where the
+#   value was missing in the CSV input.
+# row_splits: For `VarLenFeature` and `SparseFeature` an int64 array of length
+#   num_rows + 1 such that the values of row i are
+#   values[row_splits[i]:row_splits[i + 1]]. None for `FixedLenFeature`.
+# indices: For `SparseFeature` the flat 1-D int64 array of indices aligned with
+#   values. None otherwise.
+DecodedColumn = collections.namedtuple(
+    'DecodedColumn', ['values', 'mask', 'row_splits', 'indices'])
+
+
+class _InternTable(object):
+  """Maps raw values to shared decoded objects for a low cardinality column.
+
+  Once more than max_size distinct values were seen the table is dropped and
+  every value is decoded again, so a high cardinality column does not keep
+  growing the table.
+  """
+
+  def __init__(self, make_value, max_size):
+    self._make_value = make_value
+    self._max_size = max_size
+    self._table = {}
+
+  def __call__(self, value):
+    table = self._table
+    if table is None:
+      return self._make_value(value)
+    result = table.get(value)
+    if result is None:
+      result = self._make_value(value)
+      if len(table) < self._max_size:
+        table[value] = result
+      else:
+        self._table = None
+    return result
+
+
+def _check_internable(name, dtype, reader):
+  if not dtype == tf.string or reader:
+    raise ValueError('Only string columns which are not multivalent can be '
+                     'interned: %r' % name)
+
+
 class _FixedLenFeatureHandler(object):
   """Handler for `FixedLenFeature` values.
 
@@ -109,6 +232,7 @@ class _FixedLenFeatureHandler(object):
     self._reader = reader
     self._encoder = encoder
     self._dtype = feature_spec.dtype
+    self._np_dtype = feature_spec.dtype.as_numpy_dtype
     self._shape = feature_spec.shape
     self._rank = len(feature_spec.shape)
     self._size = 1
@@ -124,12 +248,22 @@ class _FixedLenFeatureHandler(object):
   def name(self):
     return self._name
 
+  @property
+  def interned(self):
+    return isinstance(self._cast_fn, _InternTable)
+
+  def enable_interning(self, max_size):
+    """Shares the decoded value objects of up to max_size distinct values."""
+    _check_internable(self._name, self._dtype, self._reader)
+    self._cast_fn = _InternTable(self._cast_fn, max_size)
+
   def parse_value(self, string_list):
     """Parse the value of this feature from string list split from CSV line."""
     value_str = string_list[self._index]
     if value_str and self._reader:
-      # NOTE: The default value is ignored when self._reader is set.
-      values = map(self._cast_fn, _decode_with_reader(value_str, self._reader))
+      # NOTE: The default value is only used for an empty value.
+      values = [self._cast_fn(v)
+                for v in _decode_with_reader(value_str, self._reader)]
     elif value_str:
       values = [self._cast_fn(value_str)]
     elif self._default_value is not None:
@@ -156,6 +290,48 @@ class _FixedLenFeatureHandler(object):
     else:
       return np.asarray(values).reshape(self._shape)
 
+  def parse_batch(self, columns):
+    """Parse the values of this feature from the transposed CSV columns."""
+    value_strs = columns[self._index]
+    num_rows = len(value_strs)
+    mask = np.fromiter((bool(v) for v in value_strs), dtype=bool,
+                       count=num_rows)
+
+    if self._reader:
+      # Like parse_value, an empty multivalent entry takes the default value.
+      rows = _decode_column_with_reader(value_strs, self._cast_fn,
+                                        self._reader)
+      if self._default_value is not None and not mask.all():
+        rows = [row if present else [self._default_value]
+                for row, present in moves.zip(rows, mask)]
+      for row in rows:
+        if len(row) != self._size:
+          raise ValueError(
+              'FixedLenFeature %r got wrong number of values. Expected'
+              ' %d but got %d' % (self._name, self._size, len(row)))
+      values = np.array(rows, dtype=self._np_dtype)
+    else:
+      if self._default_value is None and not mask.all():
+        # Without a reader the size is 1, so a missing value is an error.
+        raise ValueError('expected a value on column %r' % self._name)
+      cast_fn = self._cast_fn
+      default_value = self._default_value
+      values = np.array(
+          [cast_fn(v) if v else default_value for v in value_strs],
+          dtype=self._np_dtype)
+
+    values = values.reshape([num_rows] + list(self._shape))
+    return DecodedColumn(values, mask, None, None)
+
+  def to_arrow(self, column):
+    """Returns the (name, array) pairs of the given `DecodedColumn`."""
+    num_rows = len(column.mask)
+    if self._rank == 0:
+      return [(self._name, _arrow_array(column.values, self._dtype))]
+    row_splits = np.arange(num_rows + 1, dtype=np.int64) * self._size
+    return [(self._name, _arrow_list_array(
+        row_splits, column.values.reshape(-1), self._dtype))]
+
   def encode_value(self, string_list, values):
     """Encode the value of this feature into the CSV line."""
 
@@ -190,25 +366,76 @@ class _VarLenFeatureHandler(object):
   def __init__(self, name, feature_spec, index, reader=None, encoder=None):
     self._name = name
     self._cast_fn = _make_cast_fn(feature_spec.dtype)
+    self._dtype = feature_spec.dtype
+    self._np_dtype = feature_spec.dtype.as_numpy_dtype
     self._index = index
     self._reader = reader
     self._encoder = encoder
+    self._array_table = None
 
   @property
   def name(self):
     return self._name
 
+  @property
+  def interned(self):
+    return self._array_table is not None
+
+  def enable_interning(self, max_size):
+    """Shares the decoded value arrays of up to max_size distinct values.
+
+    The shared 1-element arrays are read-only.
+
+    Args:
+      max_size: The maximum number of distinct values to intern.
+    """
+    _check_internable(self._name, self._dtype, self._reader)
+    self._cast_fn = cast_fn = _InternTable(self._cast_fn, max_size)
+
+    def make_array(value_str):
+      array = np.asarray([cast_fn(value_str)])
+      array.flags.writeable = False
+      return array
+
+    self._array_table = _InternTable(make_array, max_size)
+
   def parse_value(self, string_list):
     """Parse the value of this feature from string list split from CSV line."""
     value_str = string_list[self._index]
     if value_str and self._reader:
-      values = map(self._cast_fn, _decode_with_reader(value_str, self._reader))
+      values = [self._cast_fn(v)
+                for v in _decode_with_reader(value_str, self._reader)]
     elif value_str:
+      if self._array_table:
+        return self._array_table(value_str)
       values = [self._cast_fn(value_str)]
     else:
       values = []
     return np.asarray(values)
 
+  def parse_batch(self, columns):
+    """Parse the values of this feature from the transposed CSV columns."""
+    value_strs = columns[self._index]
+    num_rows = len(value_strs)
+    mask = np.fromiter((bool(v) for v in value_strs), dtype=bool,
+                       count=num_rows)
+    if self._reader:
+      rows = _decode_column_with_reader(value_strs, self._cast_fn,
+                                        self._reader)
+      lengths = [len(row) for row in rows]
+      values = np.array([v for row in rows for v in row], dtype=self._np_dtype)
+    else:
+      lengths = mask
+      cast_fn = self._cast_fn
+      values = np.array([cast_fn(v) for v in value_strs if v],
+                        dtype=self._np_dtype)
+    return DecodedColumn(values, mask, _row_splits_from_lengths(lengths), None)
+
+  def to_arrow(self, column):
+    """Returns the (name, array) pairs of the given `DecodedColumn`."""
+    return [(self._name, _arrow_list_array(column.row_splits, column.values,
+                                           self._dtype))]
+
   def encode_value(self, string_list, values):
     """Encode the value of this feature into the CSV line."""
     if self._encoder:
@@ -228,6 +455,8 @@ class _SparseFeatureHandler(object):
                reader=None, encoder=None):
     self._name = name
     self._cast_fn = _make_cast_fn(feature_spec.dtype)
+    self._dtype = feature_spec.dtype
+    self._np_dtype = feature_spec.dtype.as_numpy_dtype
     self._value_index = value_index
     self._value_name = feature_spec.value_key
     self._index_index = index_index
@@ -246,7 +475,8 @@ class _SparseFeatureHandler(object):
     index_str = string_list[self._index_index]
 
     if value_str and self._reader:
-      values = map(self._cast_fn, _decode_with_reader(value_str, self._reader))
+      values = [self._cast_fn(v)
+                for v in _decode_with_reader(value_str, self._reader)]
     elif value_str:
       values = [self._cast_fn(value_str)]
     else:
@@ -255,7 +485,7 @@ class _SparseFeatureHandler(object):
     # In Python 2, if the value is too large to fit into an int, int(..) returns
     # a long, but ints are cheaper to use when possible.
     if index_str and self._reader:
-      indices = map(int, _decode_with_reader(index_str, self._reader))
+      indices = [int(i) for i in _decode_with_reader(index_str, self._reader)]
     elif index_str:
       indices = [int(index_str)]
     else:
@@ -276,6 +506,91 @@ class _SparseFeatureHandler(object):
 
     return (np.asarray(indices), np.asarray(values))
 
+  def parse_batch(self, columns):
+    """Parse the values of this feature from the transposed CSV columns."""
+    value_strs = columns[self._value_index]
+    index_strs = columns[self._index_index]
+    row_splits, indices, values = self.parse_csr(value_strs, index_strs)
+    mask = np.fromiter(
+        (bool(v or i) for v, i in moves.zip(value_strs, index_strs)),
+        dtype=bool, count=len(value_strs))
+    return DecodedColumn(values, mask, row_splits, indices)
+
+  def to_arrow(self, column):
+    """Returns the (name, array) pairs of the given `DecodedColumn`.
+
+    Like in tf.Example, the indices and values are stored as list columns
+    named after the index_key and value_key of the feature.
+    """
+    return [
+        (self._index_name, _arrow_list_array(column.row_splits, column.indices,
+                                             tf.int64)),
+        (self._value_name, _arrow_list_array(column.row_splits, column.values,
+                                             self._dtype)),
+    ]
+
+  def parse_csr(self, value_strs, index_strs):
+    """Parse the values of this feature for a batch of rows.
+
+    The values of all rows are cast and the index ranges and lengths are
+    checked with NumPy for the whole batch at once.
+
+    Args:
+      value_strs: A sequence with the value string of each row.
+      index_strs: A sequence with the index string of each row.
+    Returns:
+      A (row_splits, indices, values) tuple of 1-D arrays, where the indices and
+      values of row i are at [row_splits[i]:row_splits[i + 1]].
+    Raises:
+      ValueError: If a value or an index can not be cast, if an index is out of
+        range, or if the indices and values of a row have different lengths.
+    """
+    flat_values, value_lengths = self._split_column(value_strs)
+    flat_indices, index_lengths = self._split_column(index_strs)
+
+    try:
+      if self._dtype.is_integer or self._dtype.is_floating:
+        values = np.asarray(flat_values).astype(self._np_dtype)
+      else:
+        values = np.array([self._cast_fn(v) for v in flat_values],
+                          dtype=self._np_dtype)
+      indices = np.asarray(flat_indices).astype(np.int64)
+    except OverflowError as e:
+      # Raised by NumPy for integers beyond int64, unlike Python's int().
+      raise ValueError('SparseFeature %r: %s' % (self._name, e))
+
+    # Check that all indices are in range.
+    out_of_range = np.flatnonzero((indices < 0) | (indices >= self._size))
+    if out_of_range.size:
+      raise ValueError('SparseFeature %r has index %d out of range [0, %d)'
+                       % (self._name, indices[out_of_range[0]], self._size))
+
+    row_splits = _row_splits_from_lengths(value_lengths)
+    unaligned = np.flatnonzero(value_lengths != index_lengths)
+    if unaligned.size:
+      row = unaligned[0]
+      index_start = index_lengths[:row].sum()
+      raise ValueError(
+          'SparseFeature %r has indices and values of different lengths: '
+          'values: %r, indices: %r' % (
+              self._name,
+              values[row_splits[row]:row_splits[row + 1]].tolist(),
+              indices[index_start:index_start + index_lengths[row]].tolist()))
+    return (row_splits, indices, values)
+
+  def _split_column(self, value_strs):
+    """Returns the flat list of raw values and the number of values per row."""
+    if self._reader:
+      rows = [_decode_with_reader(value_str, self._reader) if value_str else []
+              for value_str in value_strs]
+      lengths = np.fromiter((len(row) for row in rows), dtype=np.int64,
+                            count=len(rows))
+      return [v for row in rows for v in row], lengths
+    else:
+      lengths = np.fromiter((1 if v else 0 for v in value_strs),
+                            dtype=np.int64, count=len(value_strs))
+      return [v for v in value_strs if v], lengths
+
   def encode_value(self, string_list, sparse_value):
     """Encode the value of this feature into the CSV line."""
     index, value = sparse_value
@@ -294,6 +609,74 @@ class _SparseFeatureHandler(object):
           (self._name, value, index))
 
 
+def _raise_missing_value(name):
+  raise ValueError('expected a value on column %r' % name)
+
+
+def _make_decode_fn(feature_handlers, bytes_input=False):
+  """Generates a decode function specialized for the given feature handlers.
+
+  The generated function takes the list of raw string values of a record and
+  returns the same dictionary as calling `parse_value` on every handler, but
+  without the per-feature method calls and attribute lookups. The cast
+  functions and default values of the scalar `FixedLenFeature` and the
+  `VarLenFeature` handlers without a reader are inlined, every other handler
+  falls back to its `parse_value`.
+
+  Args:
+    feature_handlers: The list of feature handlers of a `CsvCoder`.
+    bytes_input: Whether the raw values are bytes, in which case the inlined
+      features use `_make_bytes_cast_fn` and string values are not copied.
+  Returns:
+    A function mapping a list of raw string values to a dictionary of feature
+    name to value.
+  """
+  namespace = {'np': np, '_raise_missing_value': _raise_missing_value}
+  body = []
+  items = []
+  for i, handler in enumerate(feature_handlers):
+    if bytes_input and not getattr(handler, 'interned', False):
+      cast_fn = _make_bytes_cast_fn(handler._dtype)
+    else:
+      cast_fn = handler._cast_fn
+    value = 'v_%d' % i
+    if cast_fn is None:
+      cast_value = value
+    else:
+      namespace['cast_%d' % i] = cast_fn
+      cast_value = 'cast_%d(%s)' % (i, value)
+    if (isinstance(handler, _FixedLenFeatureHandler) and
+        not handler._reader and handler._rank == 0):
+      if handler._default_value is None:
+        missing = '_raise_missing_value(%r)' % handler.name
+      else:
+        missing = 'default_%d' % i
+        namespace[missing] = (
+            _utf8(handler._default_value)
+            if bytes_input and cast_fn is None else handler._default_value)
+      body.append('  %s = raw_values[%d]' % (value, handler._index))
+      items.append('%s if %s else %s' % (cast_value, value, missing))
+    elif isinstance(handler, _VarLenFeatureHandler) and not handler._reader:
+      body.append('  %s = raw_values[%d]' % (value, handler._index))
+      if handler.interned:
+        namespace['array_%d' % i] = handler._array_table
+        items.append('array_%d(%s) if %s else np.asarray([])' %
+                     (i, value, value))
+      else:
+        items.append('np.asarray([%s] if %s else [])' % (cast_value, value))
+    else:
+      parse_fn = 'parse_%d' % i
+      namespace[parse_fn] = handler.parse_value
+      items.append('%s(raw_values)' % parse_fn)
+
+  source = 'def decode(raw_values):\n%s\n  return {\n%s\n  }\n' % (
+      '\n'.join(body),
+      '\n'.join('      %r: %s,' % (handler.name, item)
+                for handler, item in moves.zip(feature_handlers, items)))
+  exec(compile(source, '<generated decode>', 'exec'), namespace)
+  return namespace['decode']
+
+
 class DecodeError(Exception):
   """Base decode error."""
   pass
@@ -308,29 +691,65 @@ class _LineGenerator(object):
   """A csv line generator that allows feeding lines to a csv.DictReader."""
 
   def __init__(self):
-    self._lines = []
+    self._lines = collections.deque()
 
   def push_line(self, line):
-    # This API currently supports only one line at a time.
+    # The single record API supports only one line at a time.
     assert not self._lines
     self._lines.append(line)
 
+  def push_lines(self, lines):
+    # Be aware that the reader consumes as many lines as a record needs, e.g.
+    # when a quoted value spans several lines.
+    self._lines.extend(lines)
+
+  def clear(self):
+    self._lines.clear()
+
+  def __len__(self):
+    return len(self._lines)
+
   def __iter__(self):
     return self
 
   def next(self):
-    # This API currently supports only one line at a time.
-    # If this ever supports more than one row be aware that DictReader might
-    # attempt to read more than one record if one of the records is empty line
-    line_length = len(self._lines)
-    if line_length == 0:
+    if not self._lines:
       raise DecodeError(
           'Columns do not match specified csv headers: empty line was found')
-    assert line_length == 1, 'Unexpected number of lines %d' % line_length
-    # This doesn't maintain insertion order to the list, which is fine
-    # because the list has only 1 element. If there were more and we wanted
-    # to maintain order and timecomplexity we would switch to deque.popleft.
-    return self._lines.pop()
+    return self._lines.popleft()
+
+  __next__ = next
+
+
+def _split_lines(text):
+  """Splits text on newlines, keeping them so quoted newlines survive."""
+  lines = text.split('\n')
+  result = [line + '\n' for line in lines[:-1]]
+  if lines[-1]:
+    result.append(lines[-1])
+  return result
+
+
+# Status codes of the rows decoded by `CsvCoder.decode_with_status` and
+# `CsvCoder.decode_batch_with_status`.
+DECODE_OK = 0
+# The record could not be split into the expected number of columns.
+DECODE_BAD_RECORD = 1
+# The record was split but some of its values could not be parsed.
+DECODE_BAD_VALUE = 2
+
+# Name standing for the whole record in place of the bad columns of a
+# DECODE_BAD_RECORD row, e.g. when counting failures per column.
+RECORD_ERROR_KEY = '__record__'
+
+# Result of `CsvCoder.decode_with_status`. `instance` is the decoded dictionary
+# if `status` is DECODE_OK and None otherwise. `bad_columns` holds the names of
+# the features which could not be parsed if `status` is DECODE_BAD_VALUE.
+DecodeResult = collections.namedtuple(
+    'DecodeResult', ['status', 'instance', 'bad_columns'])
+
+# Default cap on the number of distinct values interned per column.
+DEFAULT_MAX_INTERNED_VALUES = 10000
 
 
 class CsvCoder(object):
@@ -348,6 +767,27 @@ class CsvCoder(object):
       self._line_generator.push_line(_to_string(x))
       return self._reader.next()
 
+    def read_records(self, x):
+      """Splits a chunk of CSV text holding many records.
+
+      The whole chunk goes through the same reader, so values may contain
+      quoted newlines. The reader must not be used for anything else until the
+      returned generator is exhausted or closed.
+
+      Args:
+        x: A string holding zero or more newline separated records.
+      Yields:
+        The list of raw string values of each record.
+      Raises:
+        DecodeError: If the last record is incomplete.
+      """
+      self._line_generator.push_lines(_split_lines(_to_string(x)))
+      try:
+        while self._line_generator:
+          yield self._reader.next()
+      finally:
+        self._line_generator.clear()
+
     def __getstate__(self):
       return self._state
 
@@ -372,6 +812,11 @@ class CsvCoder(object):
           self._buffer,
           lineterminator='',
           delimiter=delimiter)
+      # Used for writing many rows into the buffer at once.
+      self._batch_writer = csv.writer(
+          self._buffer,
+          lineterminator='\n',
+          delimiter=delimiter)
 
     def encode_record(self, record):
       self._writer.writerow(_to_string(record))
@@ -381,6 +826,15 @@ class CsvCoder(object):
       self._buffer.truncate(0)
       return result
 
+    def encode_records(self, records):
+      """Encodes many records as a single newline separated string."""
+      self._batch_writer.writerows(_to_string(record) for record in records)
+      # Drop the newline after the last row.
+      result = self._buffer.getvalue()[:-1]
+      self._buffer.seek(0)
+      self._buffer.truncate(0)
+      return result
+
     def __getstate__(self):
       return self._state
 
@@ -388,7 +842,9 @@ class CsvCoder(object):
       self.__init__(*state)
 
   def __init__(self, column_names, schema, delimiter=',',
-               secondary_delimiter=None, multivalent_columns=None):
+               secondary_delimiter=None, multivalent_columns=None,
+               interned_columns=None,
+               max_interned_values=DEFAULT_MAX_INTERNED_VALUES):
     """Initializes CsvCoder.
 
     Args:
@@ -399,6 +855,11 @@ class CsvCoder(object):
         the same field.
       multivalent_columns: A list of names for multivalent columns that need
           to be split based on secondary delimiter.
+      interned_columns: A list of names of string `FixedLenFeature` or
+          `VarLenFeature` columns whose decoded values are shared between
+          rows, e.g. low cardinality categorical columns.
+      max_interned_values: The maximum number of distinct values interned per
+          column, interning stops for a column once it has more values.
     Raises:
       ValueError: If `schema` is invalid.
     """
@@ -407,6 +868,8 @@ class CsvCoder(object):
     self._delimiter = delimiter
     self._secondary_delimiter = secondary_delimiter
     self._multivalent_columns = multivalent_columns
+    self._interned_columns = interned_columns
+    self._max_interned_values = max_interned_values
     self._reader = self._ReaderWrapper(delimiter)
     self._encoder = self._WriterWrapper(delimiter)
 
@@ -458,12 +921,30 @@ class CsvCoder(object):
                          'tf.VarLenFeature or tf.SparseFeature: %r was %r' %
                          (name, type(feature_spec)))
 
+    handlers_by_name = {
+        handler.name: handler for handler in self._feature_handlers
+    }
+    for name in interned_columns or []:
+      handler = handlers_by_name.get(name)
+      if not hasattr(handler, 'enable_interning'):
+        raise ValueError('Only string FixedLenFeature or VarLenFeature '
+                         'columns can be interned: %r' % name)
+      handler.enable_interning(max_interned_values)
+
+    # Unpickling goes through __reduce__ and therefore regenerates these.
+    self._decode_fn = _make_decode_fn(self._feature_handlers)
+    self._bytes_decode_fn = _make_decode_fn(self._feature_handlers,
+                                            bytes_input=True)
+    self._delimiter_bytes = _utf8(delimiter)
+
   def __reduce__(self):
     return CsvCoder, (self._column_names,
                       self._schema,
                       self._delimiter,
                       self._secondary_delimiter,
-                      self._multivalent_columns)
+                      self._multivalent_columns,
+                      self._interned_columns,
+                      self._max_interned_values)
 
   def encode(self, instance):
     """Encode a tf.transform encoded dict to a csv-formatted string.
@@ -475,6 +956,26 @@ class CsvCoder(object):
     Returns:
       A csv-formatted string. The order of the columns is given by column_names.
     """
+    return self._encoder.encode_record(self._encode_string_list(instance))
+
+  def encode_batch(self, instances):
+    """Encode a list of tf.transform encoded dicts to a block of csv lines.
+
+    This is the batched counterpart of `encode`, meant to be used after
+    `beam.BatchElements`. All rows are written through a single buffer.
+
+    Args:
+      instances: A list of python dictionaries as taken by `encode`.
+
+    Returns:
+      A string holding one csv-formatted line per instance, separated by
+      newlines and without a trailing newline.
+    """
+    return self._encoder.encode_records(
+        [self._encode_string_list(instance) for instance in instances])
+
+  def _encode_string_list(self, instance):
+    """Returns the list of column strings of the given instance."""
     string_list = [None] * len(self._column_names)
     for feature_handler in self._feature_handlers:
       try:
@@ -483,10 +984,10 @@ class CsvCoder(object):
       except TypeError as e:
         raise TypeError('%s while encoding feature "%s"' %
                         (e, feature_handler.name))
-    return self._encoder.encode_record(string_list)
+    return string_list
 
-  # Please run tensorflow_transform/coders/benchmark_coders_test.py
-  # if you make any changes on these methods.
+  # Please run mcsv_coder_benchmark.py if you make any changes on these
+  # methods.
   def decode(self, csv_string):
     """Decodes the given string record according to the schema.
 
@@ -536,5 +1037,199 @@ class CsvCoder(object):
           'Columns do not match specified csv headers: %s -> %s' % (
               self._column_names, raw_values))
 
-    return {feature_handler.name: feature_handler.parse_value(raw_values)
+    return self._decode_fn(raw_values)
+
+  def decode_bytes(self, csv_bytes):
+    """Decodes a record given as bytes without converting it to a string.
+
+    This is meant for `beam.io.ReadFromText(..., coder=BytesCoder())` output.
+    Records without quotes are split directly on the delimiter, numeric values
+    are parsed from the byte slices and string values are returned as bytes.
+    Records with quoted values, multivalent columns and `SparseFeature`s go
+    through the same path as `decode`. Missing value handling and errors are
+    the same as in `decode`.
+
+    Args:
+      csv_bytes: A `bytes` or `memoryview` object to be decoded.
+
+    Returns:
+      Dictionary of column name to value.
+
+    Raises:
+      DecodeError: If columns do not match specified csv headers.
+      ValueError: If some numeric column has non-numeric data, if a
+          SparseFeature has missing indices but not values or vice versa or
+          multivalent data has the wrong length.
+    """
+    if isinstance(csv_bytes, memoryview):
+      csv_bytes = csv_bytes.tobytes()
+    if b'"' in csv_bytes:
+      return self.decode(csv_bytes)
+
+    raw_values = csv_bytes.split(self._delimiter_bytes)
+    if len(raw_values) != len(self._column_names):
+      raise DecodeError(
+          'Columns do not match specified csv headers: %s -> %s' % (
+              self._column_names, raw_values))
+    return self._bytes_decode_fn(raw_values)
+
+  def decode_batch(self, csv_strings):
+    """Decodes a batch of string records into one column per feature.
+
+    This is the columnar counterpart of `decode`, meant to be used after
+    `beam.BatchElements`. The lines are split in a single reader pass and
+    each feature is parsed into typed NumPy arrays for the whole batch. Missing
+    value handling and multivalent column checks are the same as in `decode`,
+    except that the rows where a value was missing are also reported through
+    the `mask` of the returned column.
+
+    Args:
+      csv_strings: A list of strings to be decoded, one record per string.
+
+    Returns:
+      Dictionary of feature name to `DecodedColumn`.
+
+    Raises:
+      DecodeError: If columns do not match specified csv headers.
+      ValueError: If some numeric column has non-numeric data, if a
+          SparseFeature has missing indices but not values or vice versa or
+          multivalent data has the wrong length.
+    """
+    try:
+      rows = list(self._reader.read_records(
+          ''.join(_to_string(x) + '\n' for x in csv_strings)))
+    except Exception as e:  # pylint: disable=broad-except
+      raise DecodeError('%s: %s' % (e, csv_strings))
+    if len(rows) != len(csv_strings):
+      raise DecodeError(
+          'Expected %d records but got %d, a value may contain an unescaped '
+          'newline' % (len(csv_strings), len(rows)))
+
+    num_columns = len(self._column_names)
+    for i, raw_values in enumerate(rows):
+      # Same as in decode, an empty line is a valid single column record.
+      if not raw_values and num_columns == 1:
+        rows[i] = raw_values = ['']
+      if len(raw_values) != num_columns:
+        raise DecodeError(
+            'Columns do not match specified csv headers: %s -> %s' % (
+                self._column_names, raw_values))
+
+    columns = list(moves.zip(*rows)) if rows else [()] * num_columns
+    return {feature_handler.name: feature_handler.parse_batch(columns)
             for feature_handler in self._feature_handlers}
+
+  def decode_record_batch(self, csv_strings):
+    """Decodes a batch of string records into a `pyarrow.RecordBatch`.
+
+    The records are decoded with `decode_batch`. Scalar `FixedLenFeature`s
+    become primitive arrays, while multivalent `FixedLenFeature`s and
+    `VarLenFeature`s become list arrays. A `SparseFeature` becomes two list
+    arrays named after its index_key and value_key. String values are stored
+    as binary.
+
+    Args:
+      csv_strings: A list of strings to be decoded, one record per string.
+
+    Returns:
+      A `pyarrow.RecordBatch` with one row per record.
+
+    Raises:
+      ImportError: If pyarrow is not installed.
+      DecodeError: If columns do not match specified csv headers.
+      ValueError: If the records can not be decoded, see `decode_batch`.
+    """
+    if pa is None:
+      raise ImportError('pyarrow is required for decode_record_batch')
+    columns = self.decode_batch(csv_strings)
+    names = []
+    arrays = []
+    for feature_handler in self._feature_handlers:
+      for name, array in feature_handler.to_arrow(
+          columns[feature_handler.name]):
+        names.append(name)
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, names)
+
+  def decode_with_status(self, csv_string):
+    """Decodes a record without raising on malformed input.
+
+    This is the error tolerant counterpart of `decode` (or `decode_bytes` for
+    bytes input). Instead of raising, it returns a status code for the record
+    along with its bad columns, which callers may count, e.g. with Beam
+    metrics. No error messages are formatted, so frequent bad records are
+    cheap.
+
+    Args:
+      csv_string: String, bytes or memoryview to be decoded.
+
+    Returns:
+      A `DecodeResult`.
+    """
+    if isinstance(csv_string, memoryview):
+      csv_string = csv_string.tobytes()
+    if isinstance(csv_string, bytes) and b'"' not in csv_string:
+      raw_values = csv_string.split(self._delimiter_bytes)
+      decode_fn = self._bytes_decode_fn
+    else:
+      try:
+        raw_values = self._reader.read_record(csv_string)
+      except Exception:  # pylint: disable=broad-except
+        raw_values = None
+      if raw_values == [] and len(self._column_names) == 1:
+        raw_values = ['']
+      decode_fn = self._decode_fn
+
+    if raw_values is None or len(raw_values) != len(self._column_names):
+      return DecodeResult(DECODE_BAD_RECORD, None, ())
+
+    try:
+      return DecodeResult(DECODE_OK, decode_fn(raw_values), ())
+    except (DecodeError, TypeError, ValueError):
+      pass
+
+    bad_columns = []
+    for feature_handler in self._feature_handlers:
+      try:
+        feature_handler.parse_value(raw_values)
+      except (DecodeError, TypeError, ValueError):
+        bad_columns.append(feature_handler.name)
+    return DecodeResult(DECODE_BAD_VALUE, None, tuple(bad_columns))
+
+  def decode_batch_with_status(self, csv_strings):
+    """Decodes a batch of records without raising on malformed input.
+
+    A batch without bad records is decoded by a single `decode_batch` call.
+    Otherwise the status of each record is determined by decoding it alone
+    with `decode_batch`, so that a record is only dropped if the batch
+    parser fails on it, and the good records are decoded together.
+
+    Args:
+      csv_strings: A list of strings to be decoded, one record per string.
+
+    Returns:
+      A (statuses, columns) tuple, where statuses is a uint8 array with the
+      status code of each record and columns is the `decode_batch` output for
+      the records whose status is DECODE_OK.
+    """
+    try:
+      return (np.zeros(len(csv_strings), dtype=np.uint8),
+              self.decode_batch(csv_strings))
+    except (DecodeError, TypeError, ValueError):
+      pass
+    statuses = np.fromiter(
+        (self._batch_status(x) for x in csv_strings),
+        dtype=np.uint8, count=len(csv_strings))
+    good_strings = [x for x, status in moves.zip(csv_strings, statuses)
+                    if status == DECODE_OK]
+    return statuses, self.decode_batch(good_strings)
+
+  def _batch_status(self, csv_string):
+    """Returns the status of csv_string decoded alone by `decode_batch`."""
+    try:
+      self.decode_batch([csv_string])
+    except DecodeError:
+      return DECODE_BAD_RECORD
+    except (TypeError, ValueError):
+      return DECODE_BAD_VALUE
+    return DECODE_OK
@@ -0,0 +1,318 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the encode/decode paths of mcsv_coder.CsvCoder.
+
+Runs every benchmark over synthetic chicago_taxi rows and writes a JSON
+report with the throughput (rows/sec) and, per row, the memory retained by
+the coder output and the peak memory allocated while producing it, e.g.:
+
+  python mcsv_coder_benchmark.py --sizes 10000,1000000 --output report.json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow_transform.tf_metadata import dataset_schema
+
+try:
+  import tracemalloc  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # tracemalloc is only available on Python 3, peak_bytes_per_row is not
+  # measured on Python 2.
+  tracemalloc = None
+
+import taxi_schema.taxi_schema as taxi
+
+import mcsv_coder
+import taxi_preprocess_bq
+
+DEFAULT_SIZES = [10000, 1000000, 10000000]
+
+# Rows are cycled from a pool of distinct synthetic rows, so generating the
+# data is not part of the measured time.
+_POOL_SIZE = 1000
+
+# Number of rows whose decoded/encoded output is kept to measure memory.
+_MEMORY_SAMPLE_ROWS = 10000
+
+_BATCH_SIZE = 1000
+
+_COMPANIES = ['Taxi Affiliation Services', 'Flash Cab', 'Dispatch Taxi',
+              'Blue Ribbon Taxi Association Inc.', 'Choice Taxi Association',
+              'Chicago Carriage Cab Corp', 'Yellow Cab', 'City Service']
+_PAYMENT_TYPES = ['Cash', 'Credit Card', 'No Charge', 'Unknown', 'Dispute']
+
+# Columns of the synthetic schema used for the multivalent and sparse
+# benchmarks.
+_MULTIVALENT_COLUMN_NAMES = ['fare_history', 'tips_history', 'tract_index',
+                             'tract_value']
+_MULTIVALENT_VALUE_COUNT = 8
+_SPARSE_SIZE = 1000
+_SECONDARY_DELIMITER = '|'
+
+
+def _taxi_value(rng, name):
+  """Returns a random CSV string for the given taxi column."""
+  if name == 'company':
+    return rng.choice(_COMPANIES)
+  elif name == 'payment_type':
+    return rng.choice(_PAYMENT_TYPES)
+  elif name in ('pickup_census_tract', 'dropoff_census_tract'):
+    return str(17031000000 + rng.randint(0, 999999))
+  elif name in ('pickup_community_area', 'dropoff_community_area'):
+    return str(rng.randint(1, 77))
+  elif name == 'trip_start_month':
+    return str(rng.randint(1, 12))
+  elif name == 'trip_start_hour':
+    return str(rng.randint(0, 23))
+  elif name == 'trip_start_day':
+    return str(rng.randint(1, 7))
+  elif name == 'trip_start_timestamp':
+    return str(rng.randint(1356998400, 1514764800))
+  elif name.endswith('latitude'):
+    return '%.9f' % rng.uniform(41.6, 42.1)
+  elif name.endswith('longitude'):
+    return '%.9f' % rng.uniform(-87.9, -87.5)
+  elif name == 'trip_seconds':
+    return str(rng.randint(60, 3600))
+  else:
+    return '%.2f' % rng.uniform(0, 50)
+
+
+def make_taxi_lines(num_lines, seed=0):
+  """Returns synthetic CSV lines following taxi.CSV_COLUMN_NAMES."""
+  rng = random.Random(seed)
+  return [','.join(_taxi_value(rng, name) for name in taxi.CSV_COLUMN_NAMES)
+          for _ in range(num_lines)]
+
+
+def make_multivalent_lines(num_lines, seed=0):
+  """Returns synthetic CSV lines following _MULTIVALENT_COLUMN_NAMES."""
+  rng = random.Random(seed)
+  lines = []
+  for _ in range(num_lines):
+    indices = sorted(rng.sample(range(_SPARSE_SIZE), rng.randint(0, 16)))
+    values = [
+        _SECONDARY_DELIMITER.join(
+            '%.2f' % rng.uniform(0, 50)
+            for _ in range(_MULTIVALENT_VALUE_COUNT)),
+        _SECONDARY_DELIMITER.join(
+            '%.2f' % rng.uniform(0, 10)
+            for _ in range(rng.randint(0, _MULTIVALENT_VALUE_COUNT))),
+        _SECONDARY_DELIMITER.join(str(i) for i in indices),
+        _SECONDARY_DELIMITER.join('%.3f' % rng.random() for _ in indices),
+    ]
+    lines.append(','.join(values))
+  return lines
+
+
+def make_taxi_coder():
+  """Returns the coder used by taxi_preprocess_bq for the taxi schema."""
+  return taxi_preprocess_bq.make_mcsv_coder(taxi.read_schema('schema.pbtxt'))
+
+
+def make_multivalent_coder():
+  """Returns a coder with multivalent FixedLen, VarLen and Sparse features."""
+  feature_spec = {
+      'fare_history': tf.FixedLenFeature([_MULTIVALENT_VALUE_COUNT],
+                                         tf.float32),
+      'tips_history': tf.VarLenFeature(tf.float32),
+      'tract': tf.SparseFeature('tract_index', 'tract_value', tf.float32,
+                                _SPARSE_SIZE),
+  }
+  return mcsv_coder.CsvCoder(
+      _MULTIVALENT_COLUMN_NAMES,
+      dataset_schema.from_feature_spec(feature_spec),
+      secondary_delimiter=_SECONDARY_DELIMITER,
+      multivalent_columns=['fare_history', 'tips_history', 'tract'])
+
+
+def _batches(elements, batch_size):
+  iterator = iter(elements)
+  while True:
+    batch = list(itertools.islice(iterator, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def _run(fn, pool, num_rows, batch_size=None):
+  """Applies fn to num_rows elements cycled from pool, returns the seconds."""
+  elements = itertools.islice(itertools.cycle(pool), num_rows)
+  if batch_size:
+    elements = _batches(elements, batch_size)
+  start = time.time()
+  for element in elements:
+    fn(element)
+  return time.time() - start
+
+
+def _deep_size(obj, seen):
+  """Returns the bytes of obj and the objects it holds not yet in seen.
+
+  Objects shared between rows, e.g. interned values, are counted once.
+  """
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for key, value in obj.items():
+      size += _deep_size(key, seen) + _deep_size(value, seen)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    for item in obj:
+      size += _deep_size(item, seen)
+  elif isinstance(obj, np.ndarray):
+    if obj.base is not None:
+      size += _deep_size(obj.base, seen)
+    if obj.dtype == object:
+      for item in obj.flat:
+        size += _deep_size(item, seen)
+  return size
+
+
+def _memory_sample(pool, batch_size=None):
+  """Returns the _MEMORY_SAMPLE_ROWS elements fn is applied to for memory."""
+  elements = list(itertools.islice(itertools.cycle(pool), _MEMORY_SAMPLE_ROWS))
+  if batch_size:
+    elements = list(_batches(elements, batch_size))
+  return elements
+
+
+def _retained_bytes_per_row(fn, pool, batch_size=None):
+  """Returns the bytes held by the output of fn per row.
+
+  The outputs of _MEMORY_SAMPLE_ROWS rows are measured by walking them with
+  sys.getsizeof, which works on Python 2 where mcsv_coder runs. Temporary
+  objects freed by fn before returning are not counted.
+  """
+  outputs = [fn(element) for element in _memory_sample(pool, batch_size)]
+  return _deep_size(outputs, set()) / _MEMORY_SAMPLE_ROWS
+
+
+def _peak_bytes_per_row(fn, pool, batch_size=None):
+  """Returns the peak bytes allocated per row while fn runs, or None.
+
+  The outputs of _MEMORY_SAMPLE_ROWS rows are kept, so the peak counts them
+  along with the largest temporary allocations of fn. Needs tracemalloc.
+  """
+  if tracemalloc is None:
+    return None
+  elements = _memory_sample(pool, batch_size)
+  tracemalloc.start()
+  try:
+    outputs = [fn(element) for element in elements]
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  del outputs
+  return peak / _MEMORY_SAMPLE_ROWS
+
+
+def run_benchmarks(sizes):
+  """Runs all benchmarks for each of the sizes.
+
+  Args:
+    sizes: List of row counts to run each benchmark with.
+
+  Returns:
+    A list of result dicts, one per benchmark and size.
+  """
+  taxi_coder = make_taxi_coder()
+  taxi_lines = make_taxi_lines(_POOL_SIZE)
+  taxi_instances = [taxi_coder.decode(line) for line in taxi_lines]
+  multivalent_coder = make_multivalent_coder()
+  multivalent_lines = make_multivalent_lines(_POOL_SIZE)
+  multivalent_instances = [multivalent_coder.decode(line)
+                           for line in multivalent_lines]
+  sparse_handlers = [
+      handler for handler in multivalent_coder._feature_handlers  # pylint: disable=protected-access
+      if isinstance(handler, mcsv_coder._SparseFeatureHandler)]  # pylint: disable=protected-access
+  multivalent_rows = [
+      multivalent_coder._reader.read_record(line)  # pylint: disable=protected-access
+      for line in multivalent_lines]
+
+  def parse_sparse(row):
+    return [handler.parse_value(row) for handler in sparse_handlers]
+
+  benchmarks = [
+      ('decode', taxi_coder.decode, taxi_lines, None),
+      ('decode_bytes', taxi_coder.decode_bytes,
+       [line.encode('utf-8') for line in taxi_lines], None),
+      ('decode_batch', taxi_coder.decode_batch, taxi_lines, _BATCH_SIZE),
+      ('encode', taxi_coder.encode, taxi_instances, None),
+      ('encode_batch', taxi_coder.encode_batch, taxi_instances, _BATCH_SIZE),
+      ('multivalent_decode', multivalent_coder.decode, multivalent_lines,
+       None),
+      ('multivalent_encode', multivalent_coder.encode, multivalent_instances,
+       None),
+      ('sparse_parse_value', parse_sparse, multivalent_rows, None),
+  ]
+
+  results = []
+  for name, fn, pool, batch_size in benchmarks:
+    retained_bytes_per_row = _retained_bytes_per_row(fn, pool, batch_size)
+    peak_bytes_per_row = _peak_bytes_per_row(fn, pool, batch_size)
+    for num_rows in sizes:
+      seconds = _run(fn, pool, num_rows, batch_size)
+      result = {
+          'benchmark': name,
+          'rows': num_rows,
+          'batch_size': batch_size,
+          'seconds': seconds,
+          'rows_per_sec': num_rows / seconds if seconds else None,
+          'retained_bytes_per_row': retained_bytes_per_row,
+          'peak_bytes_per_row': peak_bytes_per_row,
+      }
+      print('%s rows=%d seconds=%.3f' % (name, num_rows, seconds),
+            file=sys.stderr)
+      results.append(result)
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--sizes',
+      help='Comma separated row counts to run each benchmark with.',
+      default=','.join(str(size) for size in DEFAULT_SIZES))
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON report. The report is printed if not set.')
+  args = parser.parse_args()
+
+  report = {
+      'python_version': sys.version.split()[0],
+      'results': run_benchmarks([int(size) for size in args.sizes.split(',')]),
+  }
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,388 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for mcsv_coder.
+
+The decoders generated by _make_decode_fn must return the same instances
+as the parse_value methods of the feature handlers they replace.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+import unittest
+
+import numpy as np
+import tensorflow as tf
+from tensorflow_transform.tf_metadata import dataset_schema
+
+import taxi_schema.taxi_schema as taxi
+
+import mcsv_coder
+import taxi_preprocess_bq
+
+_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'schema.pbtxt')
+
+# Rows following taxi.CSV_COLUMN_NAMES, with the optional columns missing in
+# some of them and quoted values holding the delimiter.
+_TAXI_LINES = [
+    '8,12.45,5,19,6,1400269500,41.89,-87.63,41.92,-87.66,2.5,'
+    '17031081700,17031070400,Credit Card,Flash Cab,900,7,2.0',
+    '32,7.25,12,2,1,1418702400,41.88,-87.62,,,0.8,,,Cash,,,,0.0',
+    '76,44.0,3,14,4,1396438200,41.98,-87.91,41.89,-87.63,17.6,'
+    '17031980000,,Credit Card,"Taxi Affiliation Services, Inc",2340,8,8.8',
+    '6,5.65,7,23,7,1436660100,41.94,-87.64,41.94,-87.65,0.0,,,'
+    '"Cash","Blue Ribbon Taxi Association Inc.",240,6,0.0',
+]
+
+_COLUMN_NAMES = ['int_default', 'float_no_default', 'string_default',
+                 'varlen', 'multivalent', 'multivalent_varlen', 'index',
+                 'value']
+
+# Rows following _COLUMN_NAMES, exercising defaults, empty VarLen and sparse
+# values, and quoted multivalent values.
+_LINES = [
+    '1,2.5,a,x,1|2|3,4|5,0|3,0.5|1.5',
+    ',2.5,,,"1|2|3",,,',
+    '7,-1.0,"b,c",y,4|5|6,6,"9",2.5',
+    '0,0.0,"",z,7|8|9,7|8|9,1|2|4,1|2|3',
+]
+
+
+def _spec_coder(**kwargs):
+  feature_spec = {
+      'int_default': tf.FixedLenFeature([], tf.int64, default_value=-1),
+      'float_no_default': tf.FixedLenFeature([], tf.float32),
+      'string_default': tf.FixedLenFeature([], tf.string,
+                                           default_value='missing'),
+      'varlen': tf.VarLenFeature(tf.string),
+      'multivalent': tf.FixedLenFeature([3], tf.int64),
+      'multivalent_varlen': tf.VarLenFeature(tf.float32),
+      'sparse': tf.SparseFeature('index', 'value', tf.float32, 10),
+  }
+  return mcsv_coder.CsvCoder(
+      _COLUMN_NAMES, dataset_schema.from_feature_spec(feature_spec),
+      secondary_delimiter='|',
+      multivalent_columns=['multivalent', 'multivalent_varlen', 'sparse'],
+      **kwargs)
+
+
+def _taxi_coder():
+  return taxi_preprocess_bq.make_mcsv_coder(taxi.read_schema(_SCHEMA_PATH))
+
+
+def _handler_decode(coder, line):
+  """Decodes line with the parse_value method of every feature handler."""
+  raw_values = coder._reader.read_record(line)  # pylint: disable=protected-access
+  return {handler.name: handler.parse_value(raw_values)
+          for handler in coder._feature_handlers}  # pylint: disable=protected-access
+
+
+def _assert_same_values(expected, actual, name):
+  """Compares decode output with decode_batch output of the feature dtype."""
+  if np.issubdtype(actual.dtype, np.floating):
+    # decode returns Python floats, decode_batch the float32 of the spec.
+    np.testing.assert_allclose(np.asarray(expected, dtype=np.float64),
+                               actual, rtol=1e-6, err_msg=name)
+  else:
+    np.testing.assert_equal(expected, actual, name)
+
+
+class GeneratedDecoderTest(unittest.TestCase):
+
+  def _assert_same_as_handlers(self, coder, lines):
+    for line in lines:
+      np.testing.assert_equal(_handler_decode(coder, line), coder.decode(line))
+
+  def test_taxi_schema(self):
+    self._assert_same_as_handlers(_taxi_coder(), _TAXI_LINES)
+
+  def test_defaults_sparse_multivalent_and_quoted_values(self):
+    self._assert_same_as_handlers(_spec_coder(), _LINES)
+
+  def test_interned_columns(self):
+    coder = _spec_coder(interned_columns=['string_default', 'varlen'])
+    self._assert_same_as_handlers(coder, _LINES + _LINES)
+
+  def test_missing_value_without_default(self):
+    coder = _spec_coder()
+    line = '1,,a,x,1|2|3,4|5,0|3,0.5|1.5'
+    with self.assertRaisesRegexp(ValueError, 'float_no_default'):
+      _handler_decode(coder, line)
+    with self.assertRaisesRegexp(ValueError, 'float_no_default'):
+      coder.decode(line)
+
+  def test_decode_bytes(self):
+    for coder, lines in [(_taxi_coder(), _TAXI_LINES), (_spec_coder(), _LINES)]:
+      for line in lines:
+        np.testing.assert_equal(
+            coder.decode(line), coder.decode_bytes(line.encode('utf-8')))
+
+  def _assert_batch_same_as_decode(self, coder, lines):
+    columns = coder.decode_batch(lines)
+    instances = [coder.decode(line) for line in lines]
+    self.assertEqual(sorted(instances[0]), sorted(columns))
+    for name, column in columns.items():
+      self.assertEqual(len(lines), len(column.mask))
+      if column.row_splits is None:
+        _assert_same_values([instance[name] for instance in instances],
+                            column.values, name)
+        continue
+      for i, instance in enumerate(instances):
+        start, end = column.row_splits[i], column.row_splits[i + 1]
+        if column.indices is None:
+          _assert_same_values(instance[name], column.values[start:end], name)
+        else:
+          indices, values = instance[name]
+          np.testing.assert_equal(indices, column.indices[start:end], name)
+          _assert_same_values(values, column.values[start:end], name)
+
+  def test_decode_batch(self):
+    self._assert_batch_same_as_decode(_spec_coder(), _LINES)
+    self._assert_batch_same_as_decode(_taxi_coder(), _TAXI_LINES)
+    self._assert_batch_same_as_decode(
+        _spec_coder(interned_columns=['string_default', 'varlen']), _LINES)
+
+  def test_decode_batch_mask(self):
+    columns = _spec_coder().decode_batch(_LINES)
+    for name in ['int_default', 'varlen', 'multivalent_varlen', 'sparse']:
+      np.testing.assert_equal([True, False, True, True], columns[name].mask,
+                              name)
+    # The quoted empty string of the last line is missing as well.
+    np.testing.assert_equal([True, False, True, False],
+                            columns['string_default'].mask)
+
+
+class ReadRecordsTest(unittest.TestCase):
+
+  def setUp(self):
+    self._reader = mcsv_coder.CsvCoder._ReaderWrapper(',')  # pylint: disable=protected-access
+
+  def test_many_records(self):
+    self.assertEqual(
+        [['a', 'b'], ['c\nd', 'e'], ['', 'f']],
+        list(self._reader.read_records('a,b\n"c\nd",e\n,f')))
+    self.assertEqual([], list(self._reader.read_records('')))
+
+  def test_partial_read_clears_buffer(self):
+    records = self._reader.read_records('a,b\nc,d\n')
+    self.assertEqual(['a', 'b'], next(records))
+    records.close()
+    self.assertEqual(['e', 'f'], self._reader.read_record('e,f'))
+
+  def test_incomplete_record_clears_buffer(self):
+    with self.assertRaises(mcsv_coder.DecodeError):
+      list(self._reader.read_records('a,b\nc,"d\n'))
+    self.assertEqual(['e', 'f'], self._reader.read_record('e,f'))
+
+
+class EncodeBatchTest(unittest.TestCase):
+
+  def test_same_as_encode(self):
+    for coder, lines in [(_taxi_coder(), _TAXI_LINES), (_spec_coder(), _LINES)]:
+      instances = [coder.decode(line) for line in lines]
+      self.assertEqual('\n'.join(coder.encode(instance)
+                                 for instance in instances),
+                       coder.encode_batch(instances))
+    self.assertEqual('', _spec_coder().encode_batch([]))
+
+  def test_quoted_values(self):
+    coder = _spec_coder()
+    instances = [coder.decode(line) for line in _LINES]
+    lines = coder.encode_batch(instances).split('\n')
+    self.assertEqual(len(_LINES), len(lines))
+    # The value holding the delimiter is quoted, and decodes to the original.
+    self.assertIn('"b,c"', lines[2])
+    for instance, line in zip(instances, lines):
+      np.testing.assert_equal(instance, coder.decode(line))
+
+
+class InterningTest(unittest.TestCase):
+
+  def test_equal_values_share_object(self):
+    coder = _spec_coder(interned_columns=['string_default', 'varlen'])
+    # Equal but distinct line strings.
+    first = coder.decode(_LINES[0])
+    second = coder.decode(''.join(list(_LINES[0])))
+    self.assertIs(first['string_default'], second['string_default'])
+    self.assertIs(first['varlen'], second['varlen'])
+    self.assertFalse(first['varlen'].flags.writeable)
+
+  def test_cap_drops_table(self):
+    table = mcsv_coder._InternTable(lambda value: [value], 2)  # pylint: disable=protected-access
+    a = table('a')
+    self.assertIs(a, table('a'))
+    table('b')
+    # A third distinct value exceeds the cap, after which values are decoded
+    # again every time.
+    self.assertEqual(['c'], table('c'))
+    self.assertEqual(a, table('a'))
+    self.assertIsNot(a, table('a'))
+
+  def test_cap_same_values(self):
+    coder = _spec_coder(interned_columns=['string_default', 'varlen'],
+                        max_interned_values=1)
+    uninterned = _spec_coder()
+    for line in _LINES + _LINES:
+      np.testing.assert_equal(uninterned.decode(line), coder.decode(line))
+    columns = coder.decode_batch(_LINES)
+    for name, column in uninterned.decode_batch(_LINES).items():
+      np.testing.assert_equal(column, columns[name])
+
+  def test_only_string_columns(self):
+    with self.assertRaisesRegexp(ValueError, 'int_default'):
+      _spec_coder(interned_columns=['int_default'])
+
+
+@unittest.skipIf(mcsv_coder.pa is None, 'pyarrow is not installed')
+class RecordBatchTest(unittest.TestCase):
+
+  def setUp(self):
+    batch = _spec_coder().decode_record_batch(_LINES)
+    self._columns = {name: batch.column(i)
+                     for i, name in enumerate(batch.schema.names)}
+
+  def test_schema(self):
+    pa = mcsv_coder.pa
+    self.assertEqual(
+        {'int_default': pa.int64(),
+         'float_no_default': pa.float32(),
+         'string_default': pa.binary(),
+         'varlen': pa.list_(pa.binary()),
+         'multivalent': pa.list_(pa.int64()),
+         'multivalent_varlen': pa.list_(pa.float32()),
+         'index': pa.list_(pa.int64()),
+         'value': pa.list_(pa.float32())},
+        {name: column.type for name, column in self._columns.items()})
+
+  def test_missing_values(self):
+    # Missing FixedLenFeature values take their default and are never null,
+    # missing VarLenFeature and SparseFeature values are empty lists.
+    for column in self._columns.values():
+      self.assertEqual(0, column.null_count)
+    self.assertEqual([1, -1, 7, 0], self._columns['int_default'].to_pylist())
+    self.assertEqual([b'a', b'missing', b'b,c', b'missing'],
+                     self._columns['string_default'].to_pylist())
+    self.assertEqual([[b'x'], [], [b'y'], [b'z']],
+                     self._columns['varlen'].to_pylist())
+    self.assertEqual([[1, 2, 3], [1, 2, 3], [4, 5, 6], [7, 8, 9]],
+                     self._columns['multivalent'].to_pylist())
+    self.assertEqual([[4., 5.], [], [6.], [7., 8., 9.]],
+                     self._columns['multivalent_varlen'].to_pylist())
+    self.assertEqual([[0, 3], [], [9], [1, 2, 4]],
+                     self._columns['index'].to_pylist())
+    self.assertEqual([[0.5, 1.5], [], [2.5], [1., 2., 3.]],
+                     self._columns['value'].to_pylist())
+
+
+class SparseFeatureTest(unittest.TestCase):
+  """decode and decode_batch raise the same errors on bad sparse values."""
+
+  def _assert_raises(self, line, regexp):
+    coder = _spec_coder()
+    with self.assertRaisesRegexp(ValueError, regexp):
+      coder.decode(line)
+    with self.assertRaisesRegexp(ValueError, regexp):
+      coder.decode_batch([_LINES[0], line])
+
+  def test_index_out_of_range(self):
+    self._assert_raises('1,2.5,a,x,1|2|3,4|5,0|10,0.5|1.5',
+                        r'index 10 out of range \[0, 10\)')
+
+  def test_different_lengths(self):
+    self._assert_raises('1,2.5,a,x,1|2|3,4|5,0|3,0.5|1.5|2.5',
+                        r'values: \[0.5, 1.5, 2.5\], indices: \[0, 3\]')
+
+  def test_non_numeric_index(self):
+    self._assert_raises('1,2.5,a,x,1|2|3,4|5,0|x,0.5|1.5', 'invalid literal')
+
+  def test_index_overflow(self):
+    self._assert_raises('1,2.5,a,x,1|2|3,4|5,0|99999999999999999999,0.5|1.5',
+                        'sparse')
+
+  def test_decode_dtypes(self):
+    indices, values = _spec_coder().decode(_LINES[0])['sparse']
+    self.assertEqual(np.float64, values.dtype)
+    self.assertEqual([0, 3], indices.tolist())
+    columns = _spec_coder().decode_batch(_LINES)
+    self.assertEqual(np.float32, columns['sparse'].values.dtype)
+    self.assertEqual(np.int64, columns['sparse'].indices.dtype)
+
+
+class MultivalentDefaultTest(unittest.TestCase):
+  """An empty multivalent FixedLenFeature with a default is not an error."""
+
+  def setUp(self):
+    feature_spec = {
+        'history': tf.FixedLenFeature([1], tf.float32, default_value=0.5),
+        'fare': tf.FixedLenFeature([], tf.float32),
+    }
+    self._coder = mcsv_coder.CsvCoder(
+        ['history', 'fare'], dataset_schema.from_feature_spec(feature_spec),
+        secondary_delimiter='|', multivalent_columns=['history'])
+    self._lines = ['1.5,2.0', ',3.0', '2.5,4.0']
+
+  def test_parse_batch_matches_parse_value(self):
+    columns = self._coder.decode_batch(self._lines)
+    np.testing.assert_equal(
+        [self._coder.decode(line)['history'] for line in self._lines],
+        columns['history'].values)
+    np.testing.assert_equal([True, False, True], columns['history'].mask)
+
+  def test_decode_batch_with_status(self):
+    statuses, columns = self._coder.decode_batch_with_status(
+        self._lines + ['1.5,'])
+    np.testing.assert_equal(
+        [mcsv_coder.DECODE_OK] * 3 + [mcsv_coder.DECODE_BAD_VALUE], statuses)
+    np.testing.assert_equal([[1.5], [0.5], [2.5]], columns['history'].values)
+
+  def test_decode_batch_with_status_same_parser(self):
+    # Splitting on the delimiter would parse the second line, the csv reader
+    # of decode_batch reads it as two records.
+    lines = [b'1.5,2.0', b'2.5,\n4.0', b'2.5,4.0']
+    statuses, columns = self._coder.decode_batch_with_status(lines)
+    np.testing.assert_equal(
+        [mcsv_coder.DECODE_OK, mcsv_coder.DECODE_BAD_RECORD,
+         mcsv_coder.DECODE_OK], statuses)
+    np.testing.assert_equal([[1.5], [2.5]], columns['history'].values)
+
+
+class PickleTest(unittest.TestCase):
+
+  def _assert_pickles(self, coder, lines):
+    unpickled = pickle.loads(pickle.dumps(coder))
+    for line in lines:
+      np.testing.assert_equal(coder.decode(line), unpickled.decode(line))
+      np.testing.assert_equal(coder.decode_bytes(line.encode('utf-8')),
+                              unpickled.decode_bytes(line.encode('utf-8')))
+
+  def test_taxi_coder(self):
+    self._assert_pickles(_taxi_coder(), _TAXI_LINES)
+
+  def test_spec_coder(self):
+    self._assert_pickles(
+        _spec_coder(interned_columns=['string_default', 'varlen']), _LINES)
+
+  def test_pickled_coder_regenerates_decoder(self):
+    coder = pickle.loads(pickle.dumps(_spec_coder()))
+    for line in _LINES:
+      np.testing.assert_equal(_handler_decode(coder, line), coder.decode(line))
+
+
+if __name__ == '__main__':
+  unittest.main()
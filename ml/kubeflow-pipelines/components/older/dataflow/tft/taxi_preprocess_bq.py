@@ -19,11 +19,20 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import csv
 import datetime
+import hashlib
+import inspect
+import json
+import math
+import multiprocessing
+import struct
+import sys
 import uuid
 import os
 
 import apache_beam as beam
+from apache_beam.metrics.metric import MetricsFilter
 
 import tensorflow as tf
 import tensorflow_transform as transform
@@ -39,13 +48,138 @@ from tensorflow_transform import coders as tft_coders
 
 import taxi_schema.taxi_schema as taxi
 
+import beam_options
+import bq_extract
 import mcsv_coder
+import window_analysis
+
+try:
+  import pyarrow as pa  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # pyarrow is only needed for --parquet_output.
+  pa = None
+
+# Low cardinality string columns whose decoded values are shared between rows.
+INTERNED_COLUMNS = ['company', 'payment_type', 'pickup_census_tract']
 
 def make_mcsv_coder(schema):
   """Return a coder for tf.transform to read csv files."""
   raw_feature_spec = taxi.get_raw_feature_spec(schema)
   parsing_schema = dataset_schema.from_feature_spec(raw_feature_spec)
-  return mcsv_coder.CsvCoder(taxi.CSV_COLUMN_NAMES, parsing_schema)
+  return mcsv_coder.CsvCoder(taxi.CSV_COLUMN_NAMES, parsing_schema,
+                             interned_columns=INTERNED_COLUMNS)
+
+# Name of the counter of the rows written by materialize_raw_data.
+MATERIALIZED_ROWS_COUNTER = 'rows'
+
+# Tag of the side output holding the CSV lines which could not be decoded.
+BAD_LINES_TAG = 'bad_lines'
+
+
+class DecodeCSVWithDeadLetters(beam.DoFn):
+  """Decodes CSV lines, routing the lines that fail to a side output.
+
+  The number of bad lines is reported per failing column through Beam
+  counters in the 'decode_csv' namespace.
+  """
+
+  def __init__(self, coder):
+    self._coder = coder
+
+  def process(self, line):
+    result = self._coder.decode_with_status(line)
+    if result.status == mcsv_coder.DECODE_OK:
+      yield result.instance
+    else:
+      for column in result.bad_columns or [mcsv_coder.RECORD_ERROR_KEY]:
+        beam.metrics.Metrics.counter('decode_csv', 'bad_' + column).inc()
+      yield beam.pvalue.TaggedOutput(BAD_LINES_TAG, line)
+
+
+def split_fingerprint(key):
+  """Returns a stable unsigned 64-bit fingerprint of a split key."""
+  if not isinstance(key, bytes):
+    key = key.encode('utf-8')
+  return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def is_eval_line(line, key_index=None):
+  """Whether a csv line belongs to the eval split.
+
+  As in make_sql, 1/3 of the keys are used for eval and 2/3 for training.
+
+  Args:
+    line: A csv line of the input.
+    key_index: Index of the column whose value is the split key, or None to
+      use the whole line as the key.
+
+  Returns:
+    True for eval lines, False for training lines.
+  """
+  key = line
+  if key_index is not None:
+    if not isinstance(line, str):
+      line = line.decode('utf-8')
+    key = next(csv.reader([line]))[key_index]
+  return split_fingerprint(key) % 3 == 0
+
+
+def input_snapshot(input_handle, bigquery_source):
+  """Returns a string changing whenever the rows of the input may change.
+
+  Args:
+    input_handle: BigQuery table name or path to the csv input, which may be
+      a manifest or a glob of csv files.
+    bigquery_source: The source BigQuery queries are read from, e.g. a
+      bq_extract.BigQueryExtractSource, providing the table snapshot.
+
+  Returns:
+    The path, size and modification time of each csv file, or the snapshot
+    of the BigQuery table.
+  """
+  if 'csv' not in input_handle.lower():
+    return bigquery_source.table_snapshot(input_handle)
+  parts = []
+  for path in taxi.resolve_csv_files(input_handle):
+    stat = file_io.stat(path)
+    parts.append('%s\0%d\0%d' % (path, stat.length, stat.mtime_nsec))
+  return '\0'.join(parts)
+
+
+def analysis_cache_key(input_handle, snapshot, ts1, ts2, max_rows,
+                       schema_path, preprocessing_source, incremental=False):
+  """Returns the key of the stored analysis for the given preprocessing inputs.
+
+  Args:
+    input_handle: BigQuery table name or path to the csv input.
+    snapshot: The input_snapshot of the input, so that the analysis of
+      changed input is not reused.
+    ts1: Lower bound on 'trip_start_timestamp', if any.
+    ts2: Upper bound on 'trip_start_timestamp', if any.
+    max_rows: Number of rows queried from BigQuery, if any.
+    schema_path: Path to the schema of the raw data.
+    preprocessing_source: Source code of the preprocessing function.
+    incremental: Whether the analysis is merged from per-window statistics.
+
+  Returns:
+    A hex digest identifying the analysis.
+  """
+  key = hashlib.sha256()
+  for part in (input_handle, snapshot, ts1 or '', ts2 or '',
+               str(max_rows or ''), file_io.read_file_to_string(schema_path),
+               preprocessing_source, 'incremental' if incremental else ''):
+    if not isinstance(part, bytes):
+      part = part.encode('utf-8')
+    key.update(part)
+    key.update(b'\0')
+  return key.hexdigest()
+
+
+def _has_transform_fn(transform_dir):
+  """Returns whether the pipeline caching a transform_fn here succeeded."""
+  return file_io.file_exists(
+      os.path.join(transform_dir, bq_extract.COMPLETE_MARKER))
+
 
 def _fill_in_missing(x):
   """Replace missing values in a SparseTensor.
@@ -65,26 +199,30 @@ def _fill_in_missing(x):
                          default_value),
       axis=1)
 
-def make_sql(table_name, ts1, ts2, stage, max_rows=None, for_eval=False):
+def make_sql(table_name, ts1, ts2, stage, max_rows=None, for_eval=False,
+             include_ts1=False):
   """Creates the sql command for pulling data from BigQuery.
 
   Args:
     table_name: BigQuery table name
     max_rows: if set, limits the number of rows pulled from BigQuery
     for_eval: True if this is for evaluation, false otherwise
+    include_ts1: True to also pull rows with 'trip_start_timestamp' equal to
+      ts1, so that adjacent windows do not drop the rows on their boundary
 
   Returns:
     sql command as string
   """
   if ts1 and ts2:
+    ts1_op = '>=' if include_ts1 else '>'
     if stage == 'eval':
       # 1/3 of the dataset used for eval
       where_clause = ('WHERE pickup_latitude is not NULL and MOD(FARM_FINGERPRINT(unique_key), 3) = 0' +
-       " AND UNIX_SECONDS(trip_start_timestamp) > UNIX_SECONDS('%s') AND UNIX_SECONDS(trip_start_timestamp) < UNIX_SECONDS('%s')" % (ts1, ts2))
+       " AND UNIX_SECONDS(trip_start_timestamp) %s UNIX_SECONDS('%s') AND UNIX_SECONDS(trip_start_timestamp) < UNIX_SECONDS('%s')" % (ts1_op, ts1, ts2))
     else:
       # 2/3 of the dataset used for training
       where_clause = ('WHERE pickup_latitude is not NULL and MOD(FARM_FINGERPRINT(unique_key), 3) > 0 ' +
-        " AND UNIX_SECONDS(trip_start_timestamp) > UNIX_SECONDS('%s') AND UNIX_SECONDS(trip_start_timestamp) < UNIX_SECONDS('%s')" % (ts1, ts2))
+        " AND UNIX_SECONDS(trip_start_timestamp) %s UNIX_SECONDS('%s') AND UNIX_SECONDS(trip_start_timestamp) < UNIX_SECONDS('%s')" % (ts1_op, ts1, ts2))
   else:
     if stage == 'eval':
       # 1/3 of the dataset used for eval
@@ -124,29 +262,63 @@ def make_sql(table_name, ts1, ts2, stage, max_rows=None, for_eval=False):
            limit_clause=limit_clause)
 
 
-def transform_data(input_handle,
-                   outfile_prefix,
-                   working_dir,
-                   setup_file, ts1, ts2,
-                   project=None,
-                   max_rows=None,
-                   mode=None,
-                   stage=None,
-                   preprocessing_fn=None):
-  """The main tf.transform method which analyzes and transforms data.
+def default_preprocessing_fn(inputs):
+  """tf.transform's callback function for preprocessing inputs.
 
   Args:
-    input_handle: BigQuery table name to process specified as
-      DATASET.TABLE or path to csv file with input data.
-    outfile_prefix: Filename prefix for emitted transformed examples
-    working_dir: Directory in which transformed examples and transform
-      function will be emitted.
-    max_rows: Number of rows to query from BigQuery
-    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
-      beam pipeline.
+    inputs: map from feature keys to raw not-yet-transformed features.
+
+  Returns:
+    Map from string feature key to transformed feature operations.
+  """
+  outputs = {}
+  for key in taxi.DENSE_FLOAT_FEATURE_KEYS:
+    # Preserve this feature as a dense float, setting nan's to the mean.
+    outputs[taxi.transformed_name(key)] = transform.scale_to_z_score(
+        _fill_in_missing(inputs[key]))
+
+  for key in taxi.VOCAB_FEATURE_KEYS:
+    # Build a vocabulary for this feature.
+    outputs[
+        taxi.transformed_name(key)] = transform.compute_and_apply_vocabulary(
+            _fill_in_missing(inputs[key]),
+            top_k=taxi.VOCAB_SIZE,
+            num_oov_buckets=taxi.OOV_SIZE)
+
+  for key in taxi.BUCKET_FEATURE_KEYS:
+    outputs[taxi.transformed_name(key)] = transform.bucketize(
+        _fill_in_missing(inputs[key]), taxi.FEATURE_BUCKET_COUNT)
+
+  for key in taxi.CATEGORICAL_FEATURE_KEYS:
+    outputs[taxi.transformed_name(key)] = _fill_in_missing(inputs[key])
+
+  # Was this passenger a big tipper?
+  taxi_fare = _fill_in_missing(inputs[taxi.FARE_KEY])
+  tips = _fill_in_missing(inputs[taxi.LABEL_KEY])
+  outputs[taxi.transformed_name(taxi.LABEL_KEY)] = tf.where(
+      tf.is_nan(taxi_fare),
+      tf.cast(tf.zeros_like(taxi_fare), tf.int64),
+      # Test if the tip was > 20% of the fare.
+      tf.cast(
+          tf.greater(tips, tf.multiply(taxi_fare, tf.constant(0.2))),
+          tf.int64))
+
+  return outputs
+
+
+def make_windowed_preprocessing_fn(stats):
+  """Returns the default preprocessing_fn with its analyzers precomputed.
+
+  Args:
+    stats: A window_analysis.WindowStats holding the merged statistics of the
+      analyzed windows.
+
+  Returns:
+    A preprocessing_fn producing the same features as the default one, using
+    the analyzer results held by stats as constants.
   """
 
-  def def_preprocessing_fn(inputs):
+  def preprocessing_fn(inputs):
     """tf.transform's callback function for preprocessing inputs.
 
     Args:
@@ -157,21 +329,24 @@ def transform_data(input_handle,
     """
     outputs = {}
     for key in taxi.DENSE_FLOAT_FEATURE_KEYS:
-      # Preserve this feature as a dense float, setting nan's to the mean.
-      outputs[taxi.transformed_name(key)] = transform.scale_to_z_score(
-          _fill_in_missing(inputs[key]))
+      mean, var = stats.mean_and_var(key)
+      centered = _fill_in_missing(inputs[key]) - mean
+      outputs[taxi.transformed_name(key)] = (
+          centered / math.sqrt(var) if var > 0 else centered)
 
     for key in taxi.VOCAB_FEATURE_KEYS:
-      # Build a vocabulary for this feature.
-      outputs[
-          taxi.transformed_name(key)] = transform.compute_and_apply_vocabulary(
-              _fill_in_missing(inputs[key]),
-              top_k=taxi.VOCAB_SIZE,
-              num_oov_buckets=taxi.OOV_SIZE)
+      vocabulary = stats.vocabulary(key, taxi.VOCAB_SIZE)
+      table = tf.contrib.lookup.index_table_from_tensor(
+          tf.constant(vocabulary or [''], dtype=tf.string),
+          num_oov_buckets=taxi.OOV_SIZE)
+      outputs[taxi.transformed_name(key)] = table.lookup(
+          _fill_in_missing(inputs[key]))
 
     for key in taxi.BUCKET_FEATURE_KEYS:
-      outputs[taxi.transformed_name(key)] = transform.bucketize(
-          _fill_in_missing(inputs[key]), taxi.FEATURE_BUCKET_COUNT)
+      boundaries = stats.quantiles[key].boundaries(taxi.FEATURE_BUCKET_COUNT)
+      outputs[taxi.transformed_name(key)] = transform.apply_buckets(
+          _fill_in_missing(inputs[key]),
+          tf.constant([boundaries], dtype=tf.float32))
 
     for key in taxi.CATEGORICAL_FEATURE_KEYS:
       outputs[taxi.transformed_name(key)] = _fill_in_missing(inputs[key])
@@ -189,29 +364,29 @@ def transform_data(input_handle,
 
     return outputs
 
-  preprocessing_fn = preprocessing_fn or def_preprocessing_fn
-
-  print('ts1 %s, ts2 %s' % (ts1,ts2))
-
-  schema = taxi.read_schema('./schema.pbtxt')
-  raw_feature_spec = taxi.get_raw_feature_spec(schema)
-  raw_schema = dataset_schema.from_feature_spec(raw_feature_spec)
-  raw_data_metadata = dataset_metadata.DatasetMetadata(raw_schema)
-
-  transform_dir = None
+  return preprocessing_fn
 
-  temp_dir = os.path.join(working_dir, 'tmp')
-  if stage is None:
-    stage = 'train'
 
+def _make_pipeline_options(mode, job_name, project, temp_dir, setup_file,
+                           local_workers=None):
+  """Returns the runner and pipeline options for the given mode."""
   if mode == 'local':
     options = {
       'project': project}
     pipeline_options = beam.pipeline.PipelineOptions(flags=[], **options)
     runner = 'DirectRunner'
+  elif mode == 'local-parallel':
+    # Runs the bundles in local worker processes, one per core by default.
+    options = {
+      'project': project,
+      'direct_num_workers': local_workers or multiprocessing.cpu_count(),
+      'direct_running_mode': 'multi_processing'}
+    pipeline_options = beam.pipeline.PipelineOptions(flags=[], **options)
+    beam_options.check_local_parallel_options(pipeline_options)
+    runner = 'DirectRunner'
   elif mode == 'cloud':
     options = {
-      'job_name': 'tft-' + stage + '-' + str(uuid.uuid4()),
+      'job_name': job_name + '-' + str(uuid.uuid4()),
       'temp_location': temp_dir,
       'project': project,
       'save_main_session': True,
@@ -221,42 +396,507 @@ def transform_data(input_handle,
     runner = 'DataFlowRunner'
   else:
     raise ValueError("Invalid mode %s." % mode)
+  return runner, pipeline_options
+
+
+def analyze_windows(input_handle, ts1, ts2, stage, analysis_cache_dir,
+                    schema_path, mode, project, temp_dir, setup_file,
+                    extract_cache, local_workers=None):
+  """Returns the merged statistics of the day windows between ts1 and ts2.
+
+  Only the windows whose statistics are not stored in analysis_cache_dir yet
+  are queried from BigQuery, in a single pipeline.
+
+  Args:
+    input_handle: BigQuery table name specified as DATASET.TABLE.
+    ts1: Lower bound on 'trip_start_timestamp'.
+    ts2: Upper bound on 'trip_start_timestamp'.
+    stage: 'train' or 'eval', selecting the rows as make_sql does.
+    analysis_cache_dir: Directory storing the statistics of each window.
+    schema_path: Path to the schema of the raw data.
+    mode: 'local', 'local-parallel' or 'cloud', as for transform_data.
+    project: The GCP project to run the pipeline in.
+    temp_dir: Temp directory of the pipeline.
+    setup_file: Path to setup.py file for cloud runs.
+    extract_cache: The bq_extract.ExtractCache to query BigQuery through.
+    local_workers: Number of worker processes in 'local-parallel' mode.
+
+  Returns:
+    A window_analysis.WindowStats.
+  """
+  windows = window_analysis.split_window(ts1, ts2)
+  # The first window keeps the exclusive lower bound of make_sql.
+  include_starts = [i > 0 for i in range(len(windows))]
+  paths = [
+      window_analysis.window_stats_path(analysis_cache_dir, input_handle,
+                                        stage, window, schema_path,
+                                        include_start)
+      for window, include_start in zip(windows, include_starts)]
+  missing = [(window, include_start, path)
+             for window, include_start, path
+             in zip(windows, include_starts, paths)
+             if not file_io.file_exists(path)]
+  print('Analyzing %d of %d windows' % (len(missing), len(windows)))
+
+  if missing:
+    clean_batch = taxi.make_raw_data_batch_cleaner(
+        taxi.get_cached_raw_feature_spec(schema_path))
+    runner, pipeline_options = _make_pipeline_options(
+        mode, 'tft-' + stage + '-windows', project, temp_dir, setup_file,
+        local_workers)
+    with beam.Pipeline(runner, options=pipeline_options) as pipeline:
+      for (start, end), include_start, path in missing:
+        query = make_sql(input_handle, start, end, stage,
+                         include_ts1=include_start)
+        label = start.replace(' ', '-').replace(':', '')
+        _ = (
+            extract_cache.read(pipeline, input_handle, query,
+                               'ReadBigQuery-' + label)
+            | 'BatchRows-' + label >> beam.BatchElements()
+            | 'CleanData-' + label >> beam.Map(clean_batch)
+            | 'WindowStats-' + label >> beam.CombineGlobally(
+                window_analysis.WindowStatsCombineFn())
+            | 'WriteWindowStats-' + label >> beam.io.WriteToText(
+                path, num_shards=1, shard_name_template=''))
+    extract_cache.commit()
+
+  return window_analysis.read_window_stats(paths)
+
+
+def _decode_csv_lines(lines, schema, stage, dead_letter_dir, label_suffix=''):
+  """Decodes csv lines into raw data dicts."""
+  # temp tft bug workaround
+  mcsv_coder = make_mcsv_coder(schema)
+  if dead_letter_dir:
+    decoded = (
+        lines
+        | 'ParseCSV' + label_suffix >> beam.ParDo(
+            DecodeCSVWithDeadLetters(mcsv_coder)).with_outputs(
+                BAD_LINES_TAG, main='raw_data'))
+    _ = (
+        decoded[BAD_LINES_TAG]
+        | 'WriteBadLines' + label_suffix >> beam.io.WriteToText(
+            os.path.join(dead_letter_dir, '{}-bad-lines'.format(stage)),
+            coder=beam.coders.BytesCoder()))
+    return decoded.raw_data
+  return lines | 'ParseCSV' + label_suffix >> beam.Map(
+      mcsv_coder.decode_bytes)
+
+
+def _read_csv_lines(pipeline, input_handle):
+  return (
+      pipeline
+      | 'ReadFromText' >> beam.io.ReadFromText(
+          input_handle, skip_header_lines=1,
+          coder=beam.coders.BytesCoder()))
+
+
+def _read_split_csv(pipeline, input_handle, schema, dead_letter_dir,
+                    split_key_column, eval_dir):
+  """Reads and splits the csv input into training and eval raw data dicts.
+
+  The eval lines are also written to eval_dir as eval.csv, for the model
+  analysis.
+
+  Returns:
+    A (train, eval) pair of PCollections of raw data dicts.
+  """
+  key_index = (taxi.CSV_COLUMN_NAMES.index(split_key_column)
+               if split_key_column else None)
+  train_lines, eval_lines = (
+      _read_csv_lines(pipeline, input_handle)
+      | 'SplitCSV' >> beam.Partition(
+          lambda line, _: int(is_eval_line(line, key_index)), 2))
+  delete_matching_files(_csv_shard_pattern(eval_dir, 'eval'))
+  _ = (
+      eval_lines
+      | 'WriteEvalCSV' >> beam.io.WriteToText(
+          os.path.join(eval_dir, 'eval.csv'),
+          header=','.join(taxi.CSV_COLUMN_NAMES),
+          coder=beam.coders.BytesCoder()))
+  return (_decode_csv_lines(train_lines, schema, 'train', dead_letter_dir),
+          _decode_csv_lines(eval_lines, schema, 'eval', dead_letter_dir,
+                            '-eval'))
+
+
+def _read_raw_data(pipeline, input_handle, ts1, ts2, stage, max_rows, schema,
+                   dead_letter_dir, extract_cache):
+  """Reads the BigQuery or csv input into cleaned raw data dicts."""
+  raw_feature_spec = taxi.get_raw_feature_spec(schema)
+  if 'csv' in input_handle.lower():
+  # if input_handle.lower().endswith('csv'):
+    raw_data = _decode_csv_lines(_read_csv_lines(pipeline, input_handle),
+                                 schema, stage, dead_letter_dir)
+  else:
+    query = make_sql(input_handle, ts1, ts2, stage, max_rows=max_rows, for_eval=False)
+    raw_data1 = extract_cache.read(pipeline, input_handle, query,
+                                   'ReadBigQuery')
+    raw_data = (
+        raw_data1
+        | 'BatchRows' >> beam.BatchElements()
+        | 'CleanData' >> beam.Map(
+            taxi.make_raw_data_batch_cleaner(raw_feature_spec))
+        | 'ToInstances' >> beam.FlatMap(taxi.columns_to_dicts))
+  return raw_data
+
+
+def _write_raw_csv(raw_data, schema, working_dir, stage, csv_shards):
+  """Writes the raw data queried from BigQuery as csv for the evaluation.
+
+  Each shard starts with a header line, so shards can be read on their own.
+  The shards of an earlier run are deleted, so that the manifest only lists
+  the shards of this run.
+  """
+  delete_matching_files(_csv_shard_pattern(working_dir, stage))
+  mcsv_coder = make_mcsv_coder(schema)
+  _ = (
+      raw_data
+      | 'BatchRawData' >> beam.BatchElements()
+      | 'EncodeCSV' >> beam.Map(mcsv_coder.encode_batch)
+      | beam.io.WriteToText(os.path.join(working_dir, '{}.csv'.format(stage)),
+                            num_shards=csv_shards,
+                            header=','.join(taxi.CSV_COLUMN_NAMES))
+      )
+
+
+def _csv_shard_pattern(working_dir, stage, num_shards=0):
+  """Returns the glob of the csv shards of a stage, of any count if 0."""
+  return os.path.join(working_dir, '{}.csv'.format(stage)) + (
+      '-*-of-%05d' % num_shards if num_shards else '-*-of-*')
+
+
+def write_raw_csv_manifest(working_dir, stage, csv_shards=0):
+  """Writes the manifest of the csv shards written by _write_raw_csv.
+
+  Args:
+    working_dir: Directory the csv shards were written to.
+    stage: 'train' or 'eval'.
+    csv_shards: Number of shards written, 0 if the runner decided.
+  """
+  csv_prefix = os.path.join(working_dir, '{}.csv'.format(stage))
+  manifest = taxi.write_csv_manifest(
+      _csv_shard_pattern(working_dir, stage, csv_shards),
+      csv_prefix + taxi.CSV_MANIFEST_SUFFIX)
+  print('Wrote %d csv shards with %d rows, %d bytes' %
+        (len(manifest['shards']), manifest['rows'], manifest['bytes']))
+
+
+def delete_matching_files(pattern):
+  """Deletes the files matching pattern, e.g. the shards of an earlier run."""
+  for path in file_io.get_matching_files(pattern):
+    file_io.delete_file(path)
+
+
+def _matching_bytes(pattern):
+  return sum(file_io.stat(path).length
+             for path in file_io.get_matching_files(pattern))
+
+
+def _count_row(element):
+  beam.metrics.Metrics.counter('materialize', MATERIALIZED_ROWS_COUNTER).inc()
+  return element
+
+
+def materialize_raw_data(input_handle, ts1, ts2, stage, max_rows, schema,
+                         working_dir, output_prefix, dead_letter_dir,
+                         csv_shards, extract_cache, runner, pipeline_options):
+  """Decodes and cleans the input once into TFRecords of raw tf.Examples.
+
+  The csv copy of BigQuery input is written from the same pass, so the
+  transform pipeline only reads the materialized records.
+
+  Args:
+    input_handle: BigQuery table name or path to the csv input.
+    ts1: Lower bound on 'trip_start_timestamp', if any.
+    ts2: Upper bound on 'trip_start_timestamp', if any.
+    stage: 'train' or 'eval'.
+    max_rows: Number of rows to query from BigQuery, if any.
+    schema: Schema of the raw data.
+    working_dir: Directory the csv copy of BigQuery input is written to.
+    output_prefix: Path prefix of the materialized TFRecord files. The files
+      left at this prefix by earlier runs are deleted first.
+    dead_letter_dir: If set, csv lines which can not be decoded are written
+      to this directory instead of failing the job.
+    csv_shards: Number of shards of the csv copy of BigQuery input.
+    extract_cache: The bq_extract.ExtractCache to query BigQuery through.
+    runner: Name of the Beam runner.
+    pipeline_options: Options of the Beam pipeline.
+
+  Returns:
+    A dict with the number of 'rows' and the 'materialized_bytes' written,
+    and the 'input_bytes' of csv input or None for BigQuery input.
+  """
+  # The shards are read back by a glob, which would also match the shards of
+  # an earlier run with a different shard count.
+  delete_matching_files(output_prefix + '*')
+  raw_coder = taxi.make_proto_coder(schema)
+  pipeline = beam.Pipeline(runner, options=pipeline_options)
+  raw_data = _read_raw_data(pipeline, input_handle, ts1, ts2, stage, max_rows,
+                            schema, dead_letter_dir, extract_cache)
+  if 'csv' not in input_handle.lower():
+    _write_raw_csv(raw_data, schema, working_dir, stage, csv_shards)
+  _ = (
+      raw_data
+      | 'CountRows' >> beam.Map(_count_row)
+      | 'EncodeRawData' >> beam.Map(raw_coder.encode)
+      | 'WriteRawData' >> beam.io.WriteToTFRecord(
+          output_prefix, file_name_suffix='.gz'))
+  result = pipeline.run()
+  result.wait_until_finish()
+  extract_cache.commit()
+
+  counters = result.metrics().query(
+      MetricsFilter().with_name(MATERIALIZED_ROWS_COUNTER))['counters']
+  return {
+      'rows': sum(counter.committed or 0 for counter in counters),
+      'materialized_bytes': _matching_bytes(output_prefix + '*'),
+      'input_bytes': (_matching_bytes(input_handle)
+                      if 'csv' in input_handle.lower() else None),
+  }
+
+
+def _parquet_schema(transformed_schema):
+  """Returns the pyarrow schema of the transformed features."""
+  fields = []
+  for name, spec in sorted(transformed_schema.as_feature_spec().items()):
+    if spec.dtype == tf.string:
+      arrow_type = pa.binary()
+    elif spec.dtype.is_integer:
+      arrow_type = pa.int64()
+    else:
+      arrow_type = pa.float32()
+    if not (isinstance(spec, tf.FixedLenFeature) and not spec.shape):
+      arrow_type = pa.list_(arrow_type)
+    fields.append(pa.field(name, arrow_type))
+  return pa.schema(fields)
+
+
+def _to_parquet_record(instance):
+  return {name: value.tolist() if hasattr(value, 'tolist') else value
+          for name, value in instance.items()}
+
+
+def _write_transformed_data(transformed_data, transformed_schema,
+                            output_prefix, parquet_output, label_suffix=''):
+  """Writes transformed examples as gzip'ed TFRecords and maybe Parquet.
+
+  Args:
+    transformed_data: PCollection of transformed instance dicts.
+    transformed_schema: Schema of the transformed data.
+    output_prefix: Path prefix of the output shards.
+    parquet_output: If True, the data is also written as Parquet shards with
+      one column per transformed feature.
+    label_suffix: Suffix making the labels of the steps unique.
+  """
+  coder = example_proto_coder.ExampleProtoCoder(transformed_schema)
+  _ = (
+      transformed_data
+      | 'SerializeExamples' + label_suffix >> beam.Map(coder.encode)
+      | 'WriteExamples' + label_suffix >> beam.io.WriteToTFRecord(
+          output_prefix, file_name_suffix='.gz')
+  )
+  if parquet_output:
+    if pa is None or not hasattr(beam.io, 'WriteToParquet'):
+      raise ValueError('Parquet output needs pyarrow and apache-beam>=2.10.')
+    _ = (
+        transformed_data
+        | 'ToParquetRecords' + label_suffix >> beam.Map(_to_parquet_record)
+        | 'WriteParquet' + label_suffix >> beam.io.WriteToParquet(
+            output_prefix, _parquet_schema(transformed_schema),
+            file_name_suffix='.parquet'))
+
+
+def transform_data(input_handle,
+                   outfile_prefix,
+                   working_dir,
+                   setup_file, ts1, ts2,
+                   project=None,
+                   max_rows=None,
+                   mode=None,
+                   stage=None,
+                   preprocessing_fn=None,
+                   dead_letter_dir=None,
+                   transform_dir=None,
+                   analysis_cache_dir=None,
+                   preprocessing_source=None,
+                   incremental_analysis=False,
+                   materialize=False,
+                   csv_shards=1,
+                   local_workers=None,
+                   extract_cache_dir=None,
+                   bigquery_source=None,
+                   split_eval_dir=None,
+                   split_key_column=None,
+                   eval_outfile_prefix=None,
+                   parquet_output=False):
+  """The main tf.transform method which analyzes and transforms data.
+
+  Args:
+    input_handle: BigQuery table name to process specified as
+      DATASET.TABLE or path to csv file with input data.
+    outfile_prefix: Filename prefix for emitted transformed examples
+    working_dir: Directory in which transformed examples and transform
+      function will be emitted.
+    max_rows: Number of rows to query from BigQuery
+    dead_letter_dir: If set, csv lines which can not be decoded are written
+      to this directory instead of failing the job.
+    transform_dir: If set, the transform function previously written to this
+      directory is used instead of analyzing the data, e.g. the train stage
+      working_dir for the eval stage.
+    analysis_cache_dir: If set, the transform function is looked up in this
+      directory by `analysis_cache_key` and analysis is skipped on a hit. The
+      train stage stores its analysis there on a miss, marked complete once
+      its pipeline succeeded.
+    preprocessing_source: Source code of preprocessing_fn used for the cache
+      key. Defaults to the source of this module.
+    incremental_analysis: If True, the analyzers of the default
+      preprocessing_fn are computed from per-day statistics stored in
+      analysis_cache_dir, querying only the days between ts1 and ts2 that
+      were not analyzed before.
+    materialize: If True, the input is read, decoded and cleaned once into
+      TFRecords under working_dir/tmp, which the analysis and the transform
+      read instead of the input.
+    csv_shards: Number of shards of the csv copy of BigQuery input written to
+      working_dir, 0 to let the runner decide. A manifest of the shards is
+      written next to them.
+    local_workers: Number of worker processes in 'local-parallel' mode,
+      defaults to the number of cores.
+    extract_cache_dir: If set, the rows queried from BigQuery are cached in
+      this directory, keyed by the query and the table snapshot, and read
+      from there by later runs.
+    bigquery_source: The source BigQuery queries are read from, defaults to
+      a bq_extract.BigQueryExtractSource.
+    split_eval_dir: If set, the csv input is split into training and eval
+      data in the pass decoding it, as make_sql splits BigQuery input. The
+      training data is processed as the 'train' stage, and the eval data is
+      transformed with the same transform function into this directory,
+      along with its eval.csv lines.
+    split_key_column: Column whose value decides the split of a csv line,
+      defaults to the whole line.
+    eval_outfile_prefix: Filename prefix for the split eval examples,
+      defaults to outfile_prefix.
+    parquet_output: If True, the transformed examples are also written as
+      Parquet shards next to the TFRecord shards, for
+      trainer.model.parquet_input_fn.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+  """
+
+  preprocessing_fn = preprocessing_fn or default_preprocessing_fn
+
+  print('ts1 %s, ts2 %s' % (ts1,ts2))
+
+  schema = taxi.get_schema('./schema.pbtxt')
+  raw_feature_spec = taxi.get_raw_feature_spec(schema)
+  raw_schema = dataset_schema.from_feature_spec(raw_feature_spec)
+  raw_data_metadata = dataset_metadata.DatasetMetadata(raw_schema)
+
+  temp_dir = os.path.join(working_dir, 'tmp')
+  if stage is None:
+    stage = 'train'
+
+  bigquery_source = bigquery_source or bq_extract.BigQueryExtractSource(project)
+  extract_cache = bq_extract.ExtractCache(extract_cache_dir, bigquery_source)
+
+  cache_transform_dir = None
+  if transform_dir is None and analysis_cache_dir:
+    if preprocessing_source is None:
+      preprocessing_source = inspect.getsource(sys.modules[__name__])
+    cache_transform_dir = os.path.join(
+        analysis_cache_dir,
+        analysis_cache_key(input_handle,
+                           input_snapshot(input_handle, bigquery_source), ts1,
+                           ts2, max_rows, './schema.pbtxt',
+                           preprocessing_source, incremental_analysis))
+    if _has_transform_fn(cache_transform_dir):
+      print('Using cached analysis from %s' % cache_transform_dir)
+      transform_dir = cache_transform_dir
+    elif stage != 'train':
+      # Only the analysis of the training data is shared between stages.
+      cache_transform_dir = None
+    elif file_io.file_exists(cache_transform_dir):
+      # Left behind by a pipeline that failed before completing the entry.
+      file_io.delete_recursively(cache_transform_dir)
+
+  if incremental_analysis and transform_dir is None:
+    if (preprocessing_fn is not default_preprocessing_fn or
+        'csv' in input_handle.lower() or not (ts1 and ts2) or max_rows or
+        not analysis_cache_dir):
+      raise ValueError(
+          'Incremental analysis needs the default preprocessing_fn, a '
+          'BigQuery input with ts1 and ts2, no max_rows and an '
+          'analysis_cache_dir.')
+    stats = analyze_windows(input_handle, ts1, ts2, stage,
+                            analysis_cache_dir, './schema.pbtxt', mode,
+                            project, temp_dir, setup_file, extract_cache,
+                            local_workers)
+    preprocessing_fn = make_windowed_preprocessing_fn(stats)
+
+  runner, pipeline_options = _make_pipeline_options(
+      mode, 'tft-' + stage, project, temp_dir, setup_file, local_workers)
+
+  is_csv_input = 'csv' in input_handle.lower()
+  if split_eval_dir and (not is_csv_input or stage != 'train' or materialize):
+    raise ValueError('Splitting needs csv input, the train stage and no '
+                     'materialization.')
+  if materialize:
+    materialized_prefix = os.path.join(temp_dir, 'raw_data', stage)
+    materialize_runner, materialize_options = _make_pipeline_options(
+        mode, 'tft-' + stage + '-materialize', project, temp_dir, setup_file,
+        local_workers)
+    report = materialize_raw_data(
+        input_handle, ts1, ts2, stage, max_rows, schema, working_dir,
+        materialized_prefix, dead_letter_dir, csv_shards, extract_cache,
+        materialize_runner, materialize_options)
+    # Without materialization the input is read by the analysis (unless it
+    # is reused), by the transform and, for BigQuery, by the csv output.
+    saved_reads = (transform_dir is None) + (not is_csv_input)
+    report['saved_reads'] = saved_reads
+    report['saved_rows'] = report['rows'] * saved_reads
+    if report['input_bytes'] is not None:
+      report['saved_bytes'] = report['input_bytes'] * saved_reads
+    print('Materialized raw data: %s' % json.dumps(report, sort_keys=True))
 
   with beam.Pipeline(runner, options=pipeline_options) as pipeline:
     with beam_impl.Context(temp_dir=temp_dir):
-      csv_coder = taxi.make_csv_coder(schema)
-      # temp tft bug workaround
-      mcsv_coder = make_mcsv_coder(schema)
-      if 'csv' in input_handle.lower():
-      # if input_handle.lower().endswith('csv'):
+      if materialize:
+        raw_coder = taxi.make_proto_coder(schema)
         raw_data = (
             pipeline
-            | 'ReadFromText' >> beam.io.ReadFromText(
-                input_handle, skip_header_lines=1)
-            | 'ParseCSV' >> beam.Map(csv_coder.decode))
+            | 'ReadRawData' >> beam.io.ReadFromTFRecord(
+                materialized_prefix + '*')
+            | 'DecodeRawData' >> beam.Map(raw_coder.decode))
+      elif split_eval_dir:
+        raw_data, eval_raw_data = _read_split_csv(
+            pipeline, input_handle, schema, dead_letter_dir, split_key_column,
+            split_eval_dir)
       else:
-        query = make_sql(input_handle, ts1, ts2, stage, max_rows=max_rows, for_eval=False)
-        raw_data1 = (
-            pipeline
-            | 'ReadBigQuery' >> beam.io.Read(
-                beam.io.BigQuerySource(query=query, use_standard_sql=True)))
-        raw_data = (
-            raw_data1
-            | 'CleanData' >> beam.Map(
-                lambda x: (taxi.clean_raw_data_dict(x, raw_feature_spec))))
+        raw_data = _read_raw_data(pipeline, input_handle, ts1, ts2, stage,
+                                  max_rows, schema, dead_letter_dir,
+                                  extract_cache)
+        if not is_csv_input:
+          _write_raw_csv(raw_data, schema, working_dir, stage, csv_shards)
 
       if transform_dir is None:
         transform_fn = (
             (raw_data, raw_data_metadata)
             | ('Analyze' >> beam_impl.AnalyzeDataset(preprocessing_fn)))
 
-        _ = (
-            transform_fn
-            | ('WriteTransformFn' >>
-               transform_fn_io.WriteTransformFn(working_dir)))
+        if cache_transform_dir:
+          _ = (
+              transform_fn
+              | ('CacheTransformFn' >>
+                 transform_fn_io.WriteTransformFn(cache_transform_dir)))
       else:
         transform_fn = pipeline | transform_fn_io.ReadTransformFn(transform_dir)
 
+      # The trainer reads the transform function from the working_dir, also
+      # when it was not computed by this pipeline.
+      _ = (
+          transform_fn
+          | ('WriteTransformFn' >>
+             transform_fn_io.WriteTransformFn(working_dir)))
+
       # Shuffling the data before materialization will improve Training
       # effectiveness downstream.
       shuffled_data = raw_data | 'RandomizeData' >> beam.transforms.Reshuffle()
@@ -265,20 +905,33 @@ def transform_data(input_handle,
           ((shuffled_data, raw_data_metadata), transform_fn)
           | 'Transform' >> beam_impl.TransformDataset())
 
-      if 'csv' not in input_handle.lower():  # if querying BQ
+      _write_transformed_data(
+          transformed_data, transformed_metadata.schema,
+          os.path.join(working_dir, outfile_prefix), parquet_output)
+
+      if split_eval_dir:
         _ = (
-            raw_data
-            | beam.Map(mcsv_coder.encode)
-            | beam.io.WriteToText(os.path.join(working_dir, '{}.csv'.format(stage)), num_shards=1)
-            )
+            transform_fn
+            | ('WriteEvalTransformFn' >>
+               transform_fn_io.WriteTransformFn(split_eval_dir)))
+        (eval_transformed_data, _) = (
+            ((eval_raw_data, raw_data_metadata), transform_fn)
+            | 'TransformEval' >> beam_impl.TransformDataset())
+        _write_transformed_data(
+            eval_transformed_data, transformed_metadata.schema,
+            os.path.join(split_eval_dir,
+                         eval_outfile_prefix or outfile_prefix),
+            parquet_output, label_suffix='-eval')
 
-      coder = example_proto_coder.ExampleProtoCoder(transformed_metadata.schema)
-      _ = (
-          transformed_data
-          | 'SerializeExamples' >> beam.Map(coder.encode)
-          | 'WriteExamples' >> beam.io.WriteToTFRecord(
-              os.path.join(working_dir, outfile_prefix), file_name_suffix='.gz')
-      )
+  extract_cache.commit()
+  if cache_transform_dir and transform_dir is None:
+    # The cached analysis is only used once the pipeline writing it succeeded.
+    file_io.write_string_to_file(
+        os.path.join(cache_transform_dir, bq_extract.COMPLETE_MARKER), '')
+  if not is_csv_input:
+    write_raw_csv_manifest(working_dir, stage, csv_shards)
+  elif split_eval_dir:
+    write_raw_csv_manifest(split_eval_dir, 'eval')
 
 
 def main():
@@ -305,8 +958,14 @@ def main():
                       required=True,
                       help='The GCP project in which to run the dataflow job.')
   parser.add_argument('--mode',
-                      choices=['local', 'cloud'],
-                      help='whether to run the job locally or in Cloud Dataflow.')
+                      choices=['local', 'local-parallel', 'cloud'],
+                      help=('whether to run the job locally, locally on all '
+                            'cores or in Cloud Dataflow.'))
+  parser.add_argument('--local_workers',
+                      type=int,
+                      default=None,
+                      help=('Number of worker processes in local-parallel '
+                            'mode. Defaults to the number of cores.'))
   parser.add_argument('--stage',
                       choices=['train', 'eval'],
                       required=True,
@@ -332,16 +991,79 @@ def main():
       help='Number of rows to query from BigQuery',
       default=None,
       type=int)
+  parser.add_argument(
+      '--transform_dir',
+      help=('Directory holding a previously computed transform function to '
+            'use instead of analyzing the data, e.g. the working_dir of the '
+            'train stage.'),
+      default=None)
+  parser.add_argument(
+      '--analysis_cache_dir',
+      help=('Directory caching transform functions by input, ts1/ts2 window, '
+            'schema and preprocessing module.'),
+      default=None)
+  parser.add_argument(
+      '--dead_letter_dir',
+      help=('Directory to write csv lines which can not be decoded to. If not '
+            'set, a bad line fails the job.'),
+      default=None)
+
+  parser.add_argument(
+      '--extract_cache_dir',
+      help=('Directory caching the rows queried from BigQuery by query and '
+            'table snapshot, e.g. <working_dir>/extract_cache.'),
+      default=None)
+  parser.add_argument(
+      '--split_eval_dir',
+      help=('Split csv input into training and eval data in one pass, '
+            'writing the eval examples, eval.csv and the transform function '
+            'to this directory. Needs --stage train.'),
+      default=None)
+  parser.add_argument(
+      '--split_key_column',
+      help=('Column whose value decides the split of a csv line. Defaults '
+            'to the whole line.'),
+      default=None)
+  parser.add_argument(
+      '--eval_outfile_prefix',
+      help=('Filename prefix for the split eval examples. Defaults to '
+            '--outfile_prefix.'),
+      default=None)
+  parser.add_argument(
+      '--parquet_output',
+      action='store_true',
+      help=('Also write the transformed examples as Parquet shards with the '
+            'transformed schema, named <outfile_prefix>-*.parquet.'))
+  parser.add_argument(
+      '--csv_shards',
+      help=('Number of shards of the csv copy of BigQuery input, 0 to let '
+            'the runner decide. The shards are listed in '
+            '<stage>.csv.manifest.json in the working_dir.'),
+      default=1,
+      type=int)
+  parser.add_argument(
+      '--materialize',
+      action='store_true',
+      help=('Decode and clean the input once into a TFRecord copy under '
+            'working_dir/tmp read by the analysis and the transform.'))
+  parser.add_argument(
+      '--incremental_analysis',
+      action='store_true',
+      help=('Analyze the ts1/ts2 window from per-day statistics stored in '
+            'the analysis_cache_dir, only querying the days not analyzed '
+            'yet. Needs the default preprocessing.'))
 
   known_args, pipeline_args = parser.parse_known_args()
 
   preprocessing_fcn = None
+  preprocessing_source = None
   if known_args.preprocessing_module:
     module_dir = os.path.abspath(os.path.dirname(__file__))
     preprocessing_module_path = os.path.join(module_dir, 'preprocessing.py')
+    preprocessing_source = file_io.read_file_to_string(
+        known_args.preprocessing_module)
     with open(preprocessing_module_path, 'w+') as preprocessing_file:
-      preprocessing_file.write(
-          file_io.read_file_to_string(known_args.preprocessing_module))
+      preprocessing_file.write(preprocessing_source)
     import preprocessing
 
     def wrapped_preprocessing_fn(inputs):
@@ -364,7 +1086,20 @@ def main():
       max_rows=known_args.max_rows,
       mode=known_args.mode,
       stage=known_args.stage,
-      preprocessing_fn=preprocessing_fcn)
+      preprocessing_fn=preprocessing_fcn,
+      dead_letter_dir=known_args.dead_letter_dir,
+      transform_dir=known_args.transform_dir,
+      analysis_cache_dir=known_args.analysis_cache_dir,
+      preprocessing_source=preprocessing_source,
+      incremental_analysis=known_args.incremental_analysis,
+      materialize=known_args.materialize,
+      csv_shards=known_args.csv_shards,
+      local_workers=known_args.local_workers,
+      extract_cache_dir=known_args.extract_cache_dir,
+      split_eval_dir=known_args.split_eval_dir,
+      split_key_column=known_args.split_key_column,
+      eval_outfile_prefix=known_args.eval_outfile_prefix,
+      parquet_output=known_args.parquet_output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that the local-parallel mode of transform_data matches the local one.
+
+Run from this directory, which holds the schema.pbtxt that transform_data
+reads.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+from tensorflow_transform.beam.tft_beam_io import transform_fn_io
+
+import taxi_schema.taxi_schema as taxi
+
+import bq_extract
+import taxi_preprocess_bq
+
+_NUM_ROWS = 300
+
+
+def _write_sample_csv(path):
+  """Writes taxi rows with some optional values missing or quoted."""
+  rng = np.random.RandomState(0)
+  with open(path, 'w') as f:
+    f.write(','.join(taxi.CSV_COLUMN_NAMES) + '\n')
+    for i in range(_NUM_ROWS):
+      fare = round(rng.uniform(3., 40.), 2)
+      company = ['', 'Flash Cab', '"Taxi Affiliation Services, Inc"'][i % 3]
+      f.write(','.join(str(value) for value in [
+          rng.randint(1, 78), fare, rng.randint(1, 13), i % 24,
+          rng.randint(1, 8), 1400000000 + 900 * i, 41.88, -87.63,
+          '' if i % 5 else 41.92, '' if i % 5 else -87.66,
+          round(fare / 3., 2), '' if i % 4 else 17031081700, '',
+          'Cash' if i % 2 else 'Credit Card', company,
+          '' if i % 7 else 60 * (i % 40), '',
+          round(fare * rng.choice([0., 0.1, 0.25]), 2)]) + '\n')
+
+
+def _read_examples(pattern):
+  """Returns the sorted serialized examples of the gzip'ed TFRecord shards."""
+  options = tf.python_io.TFRecordOptions(
+      tf.python_io.TFRecordCompressionType.GZIP)
+  return sorted(record for path in glob.glob(pattern)
+                for record in tf.python_io.tf_record_iterator(path, options))
+
+
+def _read_assets(working_dir):
+  assets_dir = os.path.join(working_dir, transform_fn_io.TRANSFORM_FN_DIR,
+                            'assets')
+  assets = {}
+  for name in os.listdir(assets_dir):
+    with open(os.path.join(assets_dir, name), 'rb') as f:
+      assets[name] = f.read()
+  return assets
+
+
+class LocalParallelTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._csv = os.path.join(self._temp_dir, 'train.csv')
+    _write_sample_csv(self._csv)
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def _transform(self, mode, **kwargs):
+    working_dir = os.path.join(self._temp_dir, mode)
+    taxi_preprocess_bq.transform_data(
+        input_handle=self._csv, outfile_prefix='train_transformed',
+        working_dir=working_dir, setup_file=None, ts1=None, ts2=None,
+        mode=mode, stage='train', **kwargs)
+    return working_dir
+
+  def test_same_output_as_local(self):
+    local_dir = self._transform('local')
+    parallel_dir = self._transform('local-parallel', local_workers=2)
+    local_examples = _read_examples(
+        os.path.join(local_dir, 'train_transformed*'))
+    self.assertEqual(_NUM_ROWS, len(local_examples))
+    self.assertEqual(local_examples, _read_examples(
+        os.path.join(parallel_dir, 'train_transformed*')))
+    self.assertEqual(_read_assets(local_dir), _read_assets(parallel_dir))
+
+  def test_local_parallel_options(self):
+    _, pipeline_options = taxi_preprocess_bq._make_pipeline_options(  # pylint: disable=protected-access
+        'local-parallel', 'tft-train', None, self._temp_dir, None,
+        local_workers=3)
+    options = pipeline_options.get_all_options()
+    self.assertEqual(3, options['direct_num_workers'])
+    self.assertEqual('multi_processing', options['direct_running_mode'])
+
+
+class AnalysisCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._csv = os.path.join(self._temp_dir, 'train.csv')
+    _write_sample_csv(self._csv)
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def _key(self):
+    return taxi_preprocess_bq.analysis_cache_key(
+        self._csv, taxi_preprocess_bq.input_snapshot(self._csv, None), None,
+        None, None, 'schema.pbtxt', 'source')
+
+  def test_key_changes_with_input(self):
+    key = self._key()
+    self.assertEqual(key, self._key())
+    with open(self._csv, 'a') as f:
+      f.write('\n')
+    self.assertNotEqual(key, self._key())
+
+  def test_incomplete_entry_not_used(self):
+    working_dir = os.path.join(self._temp_dir, 'train')
+    cache_dir = os.path.join(self._temp_dir, 'cache')
+    taxi_preprocess_bq.transform_data(
+        input_handle=self._csv, outfile_prefix='train_transformed',
+        working_dir=working_dir, setup_file=None, ts1=None, ts2=None,
+        mode='local', stage='train', analysis_cache_dir=cache_dir)
+    entry_dir = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    self.assertTrue(taxi_preprocess_bq._has_transform_fn(entry_dir))  # pylint: disable=protected-access
+    os.remove(os.path.join(entry_dir, bq_extract.COMPLETE_MARKER))
+    self.assertFalse(taxi_preprocess_bq._has_transform_fn(entry_dir))  # pylint: disable=protected-access
+
+
+class DeleteMatchingFilesTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def test_deletes_stale_shards(self):
+    for name in ['train-00000-of-00003.gz', 'train-00002-of-00003.gz',
+                 'eval-00000-of-00001.gz']:
+      open(os.path.join(self._temp_dir, name), 'w').close()
+    taxi_preprocess_bq.delete_matching_files(
+        os.path.join(self._temp_dir, 'train*'))
+    self.assertEqual(['eval-00000-of-00001.gz'], os.listdir(self._temp_dir))
+
+
+class CsvManifestTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def test_lists_shards_of_this_run(self):
+    # The 3 shards of an earlier run and the 2 shards of this one.
+    for name in ['train.csv-00002-of-00003', 'train.csv-00000-of-00002',
+                 'train.csv-00001-of-00002']:
+      with open(os.path.join(self._temp_dir, name), 'w') as f:
+        f.write('header\nrow\n')
+    taxi_preprocess_bq.write_raw_csv_manifest(self._temp_dir, 'train', 2)
+    self.assertEqual(
+        [os.path.join(self._temp_dir, 'train.csv-0000%d-of-00002' % i)
+         for i in range(2)],
+        taxi.resolve_csv_files(os.path.join(
+            self._temp_dir, 'train.csv' + taxi.CSV_MANIFEST_SUFFIX)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,279 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental, time-windowed analysis of the chicago_taxi data.
+
+The statistics needed by the analyzers of the default preprocessing_fn
+(mean and variance for scale_to_z_score, value counts for
+compute_and_apply_vocabulary and for the quantiles of bucketize) are computed
+per window of 'trip_start_timestamp' and stored as JSON. Stored windows are
+merged instead of being queried again, so extending the analyzed range by a
+day only reads the rows of the new day.
+
+The merged statistics do not depend on how the rows are split into windows
+or on the merge order. Means, variances and vocabularies match those of
+tf.transform. The bucket boundaries are exact quantiles, while the quantiles
+analyzer of tf.transform is approximate, so a boundary may differ from it by
+its epsilon in rank.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import bisect
+import collections
+import datetime
+import hashlib
+import json
+import math
+import os
+
+import apache_beam as beam
+
+from tensorflow.python.lib.io import file_io
+
+import taxi_schema.taxi_schema as taxi
+
+# Format of the ts1/ts2 bounds, e.g. '2016-02-01 00:00:00'.
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+WINDOW_SIZE = datetime.timedelta(days=1)
+
+# Maximum number of distinct values counted per bucketized feature.
+MAX_QUANTILE_VALUES = 1000000
+
+# Version of the stored statistics, part of the window keys so that
+# statistics stored in another format are not read.
+WINDOW_STATS_VERSION = 2
+
+# Subdirectory of the analysis cache holding the per-window statistics.
+WINDOW_STATS_DIR = 'window_stats'
+
+
+def split_window(ts1, ts2):
+  """Splits the range between two timestamps into day windows.
+
+  Windows are aligned to midnight, so the windows of two overlapping ranges
+  share their full days.
+
+  Args:
+    ts1: Lower bound on 'trip_start_timestamp', in TIMESTAMP_FORMAT.
+    ts2: Upper bound on 'trip_start_timestamp', in TIMESTAMP_FORMAT.
+
+  Returns:
+    A list of (start, end) timestamp string pairs covering [ts1, ts2).
+  """
+  start = datetime.datetime.strptime(ts1, TIMESTAMP_FORMAT)
+  end = datetime.datetime.strptime(ts2, TIMESTAMP_FORMAT)
+  windows = []
+  while start < end:
+    window_end = min(
+        datetime.datetime.combine(start.date(), datetime.time()) +
+        WINDOW_SIZE, end)
+    windows.append((start.strftime(TIMESTAMP_FORMAT),
+                    window_end.strftime(TIMESTAMP_FORMAT)))
+    start = window_end
+  return windows
+
+
+def window_stats_path(analysis_cache_dir, input_handle, stage, window,
+                      schema_path, include_start=True):
+  """Returns the path of the stored statistics of one window and stage.
+
+  Args:
+    analysis_cache_dir: Directory storing the statistics of each window.
+    input_handle: BigQuery table name the window is queried from.
+    stage: 'train' or 'eval'.
+    window: A (start, end) pair as returned by split_window.
+    schema_path: Path to the schema of the raw data.
+    include_start: Whether the rows at the start of the window are included,
+      as the window statistics of [start, end) and (start, end) differ.
+
+  Returns:
+    The path of the JSON statistics of the window.
+  """
+  key = hashlib.sha256()
+  for part in (str(WINDOW_STATS_VERSION), input_handle, stage,
+               '[' if include_start else '(', window[0], window[1],
+               file_io.read_file_to_string(schema_path)):
+    if not isinstance(part, bytes):
+      part = part.encode('utf-8')
+    key.update(part)
+    key.update(b'\0')
+  return os.path.join(analysis_cache_dir, WINDOW_STATS_DIR,
+                      key.hexdigest() + '.json')
+
+
+class QuantileHistogram(object):
+  """The exact, mergeable distribution of a feature, for its quantiles.
+
+  The histogram holds the count of every distinct value. Merging the
+  histograms of some windows in any order gives the histogram of all their
+  rows.
+  """
+
+  def __init__(self, counts=None):
+    self.counts = collections.Counter(counts or {})
+
+  def add_values(self, values):
+    self.counts.update(values)
+    self._check_size()
+
+  def merge(self, other):
+    self.counts.update(other.counts)
+    self._check_size()
+
+  def _check_size(self):
+    if len(self.counts) > MAX_QUANTILE_VALUES:
+      raise ValueError(
+          'More than %d distinct values to bucketize, too many for the '
+          'incremental analysis.' % MAX_QUANTILE_VALUES)
+
+  def boundaries(self, num_buckets):
+    """Returns the num_buckets - 1 boundaries between equal count buckets.
+
+    The i-th boundary is the smallest value with at least i / num_buckets of
+    the rows at or below it.
+    """
+    if not self.counts:
+      return [0.] * (num_buckets - 1)
+    values = sorted(self.counts)
+    cumulative = []
+    total = 0
+    for value in values:
+      total += self.counts[value]
+      cumulative.append(total)
+    result = []
+    for i in range(1, num_buckets):
+      index = bisect.bisect_left(cumulative, total * i / num_buckets)
+      result.append(values[min(index, len(values) - 1)])
+    return result
+
+
+def _merge_moments(a, b):
+  """Merges two [count, mean, sum of squared deviations] triples.
+
+  This is the pairwise update of Chan et al., which unlike sums of squares
+  does not lose the variance of large values to cancellation.
+  """
+  count = a[0] + b[0]
+  if not count:
+    return [0, 0., 0.]
+  delta = b[1] - a[1]
+  return [count,
+          a[1] + delta * b[0] / count,
+          a[2] + b[2] + delta * delta * a[0] * b[0] / count]
+
+
+class WindowStats(object):
+  """The analyzer statistics of the default preprocessing_fn for some rows.
+
+  Missing values are counted as the '' or 0 they are filled in with by the
+  preprocessing_fn.
+  """
+
+  def __init__(self):
+    # The count, mean and sum of squared deviations from the mean.
+    self.moments = {key: [0, 0., 0.] for key in taxi.DENSE_FLOAT_FEATURE_KEYS}
+    self.vocab_counts = {
+        key: collections.Counter() for key in taxi.VOCAB_FEATURE_KEYS}
+    self.quantiles = {
+        key: QuantileHistogram() for key in taxi.BUCKET_FEATURE_KEYS}
+
+  def add_columns(self, columns):
+    """Adds a cleaned batch as produced by make_raw_data_batch_cleaner."""
+    for key in self.moments:
+      values = [float(value[0]) if value else 0. for value in columns[key]]
+      if values:
+        mean = math.fsum(values) / len(values)
+        self.moments[key] = _merge_moments(
+            self.moments[key],
+            [len(values), mean,
+             math.fsum((value - mean) ** 2 for value in values)])
+    for key, counts in self.vocab_counts.items():
+      counts.update(value[0] if value else '' for value in columns[key])
+    for key, histogram in self.quantiles.items():
+      histogram.add_values(float(value[0]) if value else 0.
+                           for value in columns[key])
+
+  def merge(self, other):
+    for key in self.moments:
+      self.moments[key] = _merge_moments(self.moments[key],
+                                         other.moments[key])
+    for key, counts in self.vocab_counts.items():
+      counts.update(other.vocab_counts[key])
+    for key, histogram in self.quantiles.items():
+      histogram.merge(other.quantiles[key])
+
+  def mean_and_var(self, key):
+    count, mean, squared_deviations = self.moments[key]
+    if not count:
+      return 0., 0.
+    return mean, squared_deviations / count
+
+  def vocabulary(self, key, top_k):
+    """Returns the top_k most frequent values, ordered as tf.transform does."""
+    ordered = sorted(((count, value)
+                      for value, count in self.vocab_counts[key].items()),
+                     reverse=True)
+    return [value for _, value in ordered[:top_k]]
+
+  def to_json(self):
+    return json.dumps({
+        'moments': self.moments,
+        'vocab_counts': {key: dict(counts)
+                         for key, counts in self.vocab_counts.items()},
+        'quantiles': {key: sorted(histogram.counts.items())
+                      for key, histogram in self.quantiles.items()},
+    }, sort_keys=True)
+
+  @classmethod
+  def from_json(cls, text):
+    data = json.loads(text)
+    stats = cls()
+    stats.moments = data['moments']
+    stats.vocab_counts = {key: collections.Counter(counts)
+                          for key, counts in data['vocab_counts'].items()}
+    stats.quantiles = {key: QuantileHistogram(dict(counts))
+                       for key, counts in data['quantiles'].items()}
+    return stats
+
+
+class WindowStatsCombineFn(beam.CombineFn):
+  """Combines cleaned column-oriented batches into their WindowStats."""
+
+  def create_accumulator(self):
+    return WindowStats()
+
+  def add_input(self, accumulator, element):
+    accumulator.add_columns(element)
+    return accumulator
+
+  def merge_accumulators(self, accumulators):
+    result = WindowStats()
+    for accumulator in accumulators:
+      result.merge(accumulator)
+    return result
+
+  def extract_output(self, accumulator):
+    return accumulator.to_json()
+
+
+def read_window_stats(paths):
+  """Reads and merges the stored statistics of the given windows."""
+  result = WindowStats()
+  for path in paths:
+    result.merge(WindowStats.from_json(file_io.read_file_to_string(path)))
+  return result
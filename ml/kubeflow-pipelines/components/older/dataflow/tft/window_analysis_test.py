@@ -0,0 +1,253 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the day windows of the incremental analysis."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+from tensorflow_transform.beam import impl as beam_impl
+from tensorflow_transform.coders import example_proto_coder
+from tensorflow_transform.tf_metadata import dataset_metadata
+from tensorflow_transform.tf_metadata import dataset_schema
+
+import taxi_schema.taxi_schema as taxi
+
+import taxi_preprocess_bq
+import window_analysis
+
+_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'schema.pbtxt')
+
+_NUM_ROWS = 600
+
+# Rows per batch of the cleaned input, as after beam.BatchElements.
+_BATCH_SIZE = 64
+
+# Default epsilon of tft.bucketize for less than 100 buckets.
+_QUANTILES_EPSILON = 0.01
+
+# Output passing the timestamp through, to match the rows of two transforms.
+_ID_KEY = 'id'
+
+
+def _sample_rows():
+  """Returns BigQuery-like rows, with some optional values missing."""
+  rng = np.random.RandomState(0)
+  rows = []
+  for i in range(_NUM_ROWS):
+    fare = float(np.round(rng.uniform(3., 40.), 2))
+    rows.append({
+        'pickup_community_area': int(rng.randint(1, 78)),
+        'fare': fare,
+        'trip_start_month': int(rng.randint(1, 13)),
+        'trip_start_hour': i % 24,
+        'trip_start_day': int(rng.randint(1, 8)),
+        'trip_start_timestamp': 1400000000 + 900 * i,
+        'pickup_latitude': float(rng.uniform(41.6, 42.1)),
+        'pickup_longitude': float(rng.uniform(-87.9, -87.5)),
+        'dropoff_latitude': None if i % 5 == 0 else float(
+            rng.uniform(41.6, 42.1)),
+        'dropoff_longitude': None if i % 5 == 0 else float(
+            rng.uniform(-87.9, -87.5)),
+        'trip_miles': fare / 3.,
+        'pickup_census_tract': None if i % 4 else '17031081700',
+        'dropoff_census_tract': None,
+        'payment_type': 'Cash' if i % 2 else 'Credit Card',
+        'company': ['', 'Flash Cab', 'Taxi Affiliation Services'][i % 3],
+        'trip_seconds': None if i % 7 else 60. * (i % 40),
+        'dropoff_community_area': None,
+        'tips': float(np.round(fare * rng.choice([0., 0.1, 0.25]), 2)),
+    })
+  return rows
+
+
+def _window_stats(rows, clean_batch):
+  stats = window_analysis.WindowStats()
+  for i in range(0, len(rows), _BATCH_SIZE):
+    stats.add_columns(clean_batch(rows[i:i + _BATCH_SIZE]))
+  return stats
+
+
+def _with_id(preprocessing_fn):
+
+  def wrapped_preprocessing_fn(inputs):
+    outputs = preprocessing_fn(inputs)
+    outputs[_ID_KEY] = inputs['trip_start_timestamp']
+    return outputs
+
+  return wrapped_preprocessing_fn
+
+
+class SplitWindowTest(unittest.TestCase):
+
+  def test_aligned_to_midnight(self):
+    self.assertEqual(
+        [('2016-02-01 12:00:00', '2016-02-02 00:00:00'),
+         ('2016-02-02 00:00:00', '2016-02-03 00:00:00'),
+         ('2016-02-03 00:00:00', '2016-02-03 06:00:00')],
+        window_analysis.split_window('2016-02-01 12:00:00',
+                                     '2016-02-03 06:00:00'))
+
+
+class WindowStatsPathTest(unittest.TestCase):
+
+  def _path(self, window, include_start):
+    return window_analysis.window_stats_path(
+        '/cache', 'dataset.table', 'train', window, _SCHEMA_PATH,
+        include_start)
+
+  def test_inclusive_start_in_key(self):
+    window = ('2016-02-02 00:00:00', '2016-02-03 00:00:00')
+    self.assertNotEqual(self._path(window, True), self._path(window, False))
+    self.assertEqual(self._path(window, True), self._path(window, True))
+
+
+class WindowStatsTest(unittest.TestCase):
+
+  def setUp(self):
+    self._schema = taxi.read_schema(_SCHEMA_PATH)
+    self._clean_batch = taxi.make_raw_data_batch_cleaner(
+        taxi.get_raw_feature_spec(self._schema))
+    self._rows = _sample_rows()
+
+  def _merged_windows(self, bounds):
+    """Merges the stored stats of the windows of rows split at bounds."""
+    bounds = [0] + bounds + [len(self._rows)]
+    windows = [_window_stats(self._rows[start:end], self._clean_batch)
+               for start, end in zip(bounds[:-1], bounds[1:])]
+    merged = window_analysis.WindowStats()
+    for stats in reversed(windows):
+      merged.merge(window_analysis.WindowStats.from_json(stats.to_json()))
+    return merged
+
+  def test_merge_independent_of_windows(self):
+    whole = _window_stats(self._rows, self._clean_batch)
+    for bounds in [[100], [7, 300, 301], [250, 500]]:
+      merged = self._merged_windows(bounds)
+      for key in taxi.DENSE_FLOAT_FEATURE_KEYS:
+        np.testing.assert_allclose(whole.mean_and_var(key),
+                                   merged.mean_and_var(key), rtol=1e-9)
+      for key in taxi.VOCAB_FEATURE_KEYS:
+        self.assertEqual(whole.vocabulary(key, taxi.VOCAB_SIZE),
+                         merged.vocabulary(key, taxi.VOCAB_SIZE))
+      for key in taxi.BUCKET_FEATURE_KEYS:
+        self.assertEqual(
+            whole.quantiles[key].boundaries(taxi.FEATURE_BUCKET_COUNT),
+            merged.quantiles[key].boundaries(taxi.FEATURE_BUCKET_COUNT))
+
+  def test_variance_of_large_values(self):
+    for row in self._rows:
+      row['fare'] += 1e9
+    merged = self._merged_windows([100, 400])
+    fares = np.array([row['fare'] for row in self._rows])
+    mean, var = merged.mean_and_var('fare')
+    self.assertAlmostEqual(fares.mean(), mean, places=3)
+    self.assertAlmostEqual(1., var / fares.var(), places=6)
+
+  def test_exact_quantiles(self):
+    values = [float(v) for v in range(1, 101)]
+    histogram = window_analysis.QuantileHistogram()
+    histogram.add_values(values[50:])
+    histogram.merge(window_analysis.QuantileHistogram(
+        dict((value, 1) for value in values[:50])))
+    self.assertEqual([25., 50., 75.], histogram.boundaries(4))
+
+
+class AnalyzeDatasetEquivalenceTest(unittest.TestCase):
+  """Compares the windowed analysis with a single AnalyzeDataset."""
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._schema = taxi.read_schema(_SCHEMA_PATH)
+    raw_feature_spec = taxi.get_raw_feature_spec(self._schema)
+    self._metadata = dataset_metadata.DatasetMetadata(
+        dataset_schema.from_feature_spec(raw_feature_spec))
+    self._clean_batch = taxi.make_raw_data_batch_cleaner(raw_feature_spec)
+    self._rows = _sample_rows()
+
+  def tearDown(self):
+    shutil.rmtree(self._temp_dir)
+
+  def _transform(self, preprocessing_fn, name):
+    """Returns the transformed features of the rows, by row id."""
+    raw_data = list(taxi.columns_to_dicts(self._clean_batch(self._rows)))
+    output_prefix = os.path.join(self._temp_dir, name)
+    with beam.Pipeline('DirectRunner') as pipeline:
+      with beam_impl.Context(temp_dir=os.path.join(self._temp_dir, 'tmp')):
+        transformed_data, transformed_metadata = (
+            (pipeline | 'Create' >> beam.Create(raw_data), self._metadata)
+            | beam_impl.AnalyzeAndTransformDataset(
+                _with_id(preprocessing_fn)))
+        coder = example_proto_coder.ExampleProtoCoder(
+            transformed_metadata.schema)
+        _ = (transformed_data
+             | beam.Map(coder.encode)
+             | beam.io.WriteToTFRecord(output_prefix))
+    features = {}
+    for path in glob.glob(output_prefix + '*'):
+      for record in tf.python_io.tf_record_iterator(path):
+        example = tf.train.Example.FromString(record).features.feature
+        values = {}
+        for key, feature in example.items():
+          kind = feature.WhichOneof('kind')
+          values[key] = list(getattr(feature, kind).value)[0]
+        features[values.pop(_ID_KEY)] = values
+    return features
+
+  def test_same_transform_as_analyze_dataset(self):
+    stats = window_analysis.WindowStats()
+    for start in range(0, _NUM_ROWS, 150):
+      stats.merge(window_analysis.WindowStats.from_json(_window_stats(
+          self._rows[start:start + 150], self._clean_batch).to_json()))
+    expected = self._transform(
+        taxi_preprocess_bq.default_preprocessing_fn, 'analyzed')
+    actual = self._transform(
+        taxi_preprocess_bq.make_windowed_preprocessing_fn(stats), 'windowed')
+    self.assertEqual(sorted(expected), sorted(actual))
+
+    bucket_keys = set(taxi.transformed_names(taxi.BUCKET_FEATURE_KEYS))
+    float_keys = set(taxi.transformed_names(taxi.DENSE_FLOAT_FEATURE_KEYS))
+    moved = dict((key, 0) for key in bucket_keys)
+    for row_id, expected_values in expected.items():
+      for key, value in expected_values.items():
+        if key in bucket_keys:
+          # A row may only move to a neighbouring bucket.
+          self.assertLessEqual(abs(value - actual[row_id][key]), 1)
+          moved[key] += value != actual[row_id][key]
+        elif key in float_keys:
+          self.assertAlmostEqual(value, actual[row_id][key], places=4)
+        else:
+          self.assertEqual(value, actual[row_id][key], (row_id, key))
+    # The boundaries of tft.quantiles are within epsilon of the exact ones
+    # in rank, moving at most that many rows per boundary.
+    max_moved = (taxi.FEATURE_BUCKET_COUNT - 1) * int(
+        math.ceil(_QUANTILES_EPSILON * _NUM_ROWS))
+    for key, count in moved.items():
+      self.assertLessEqual(count, max_moved, key)
+
+
+if __name__ == '__main__':
+  unittest.main()
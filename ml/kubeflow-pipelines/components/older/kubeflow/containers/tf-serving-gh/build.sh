@@ -23,6 +23,7 @@ fi
 
 mkdir -p ./build
 rsync -arvp "../../tf-serving-gh"/ ./build/
+rsync -arvp "../../../../shared/export_readiness.py" ./build/
 
 docker build -t ml-pipeline-kubeflow-tfserve .
 rm -rf ./build
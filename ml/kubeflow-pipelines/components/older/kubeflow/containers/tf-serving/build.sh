@@ -23,6 +23,7 @@ fi
 
 mkdir -p ./build
 rsync -arvp "../../tf-serving"/ ./build/
+rsync -arvp "../../../../shared/export_readiness.py" ./build/
 
 docker build -t ml-pipeline-kubeflow-tfserve-taxi .
 rm -rf ./build
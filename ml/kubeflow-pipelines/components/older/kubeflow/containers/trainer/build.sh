@@ -23,6 +23,7 @@ fi
 
 mkdir -p ./build
 rsync -arvp "../../taxi_model"/ ./build/
+rsync -arvp "../../../../shared/export_readiness.py" ./build/trainer/
 
 docker build -f Dockerfile -t ml-pipeline-kubeflow-trainer-taxi .
 rm -rf ./build
@@ -0,0 +1,221 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the input functions of the trainer on transformed data.
+
+Reads batches from the gzip'ed TFRecord and the Parquet shards written by
+the preprocessing and writes a JSON report with the throughput (rows/sec)
+of each input function, e.g.:
+
+  python input_benchmark.py --files-dir gs://.../tft-train \\
+      --files-prefix train_transformed --tf-transform-dir gs://.../tft-train
+
+The tf.data pipeline ('tfrecord') is tuned with the same flags as in
+task.py, and compared with the former queue based reader
+('tfrecord-queue'). With --synthetic-files, local shards of random examples
+following the transformed schema are written to --files-dir first, e.g.:
+
+  python input_benchmark.py --files-dir /tmp/shards \\
+      --files-prefix train_transformed --tf-transform-dir gs://.../tft-train \\
+      --synthetic-files 8 --input-formats tfrecord,tfrecord-queue
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import task
+import taxi
+
+import tensorflow as tf
+from tensorflow.python.lib.io import file_io
+from tensorflow_transform.beam.tft_beam_io import transform_fn_io
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_NUM_BATCHES = 500
+DEFAULT_SYNTHETIC_ROWS_PER_FILE = 10000
+
+# Batches read before the timing starts, e.g. to fill the queues.
+_WARMUP_BATCHES = 10
+
+
+def _list_files(files_dir, files_prefix, input_format):
+  is_parquet = input_format == 'parquet'
+  return [os.path.join(files_dir, name)
+          for name in file_io.list_directory(files_dir)
+          if (files_prefix in name and
+              name.endswith(task.PARQUET_SUFFIX) == is_parquet)]
+
+
+def _synthetic_feature(spec):
+  if spec.dtype == tf.string:
+    value = tf.compat.as_bytes(str(random.randint(0, taxi.VOCAB_SIZE)))
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+  if spec.dtype == tf.int64:
+    return tf.train.Feature(int64_list=tf.train.Int64List(
+        value=[random.randint(0, taxi.FEATURE_BUCKET_COUNT - 1)]))
+  return tf.train.Feature(
+      float_list=tf.train.FloatList(value=[random.gauss(0., 1.)]))
+
+
+def write_synthetic_shards(files_dir, files_prefix, tf_transform_dir,
+                           num_files, rows_per_file):
+  """Writes gzip'ed TFRecord shards of random transformed examples.
+
+  Returns:
+    The list of written files.
+  """
+  metadata_dir = os.path.join(tf_transform_dir,
+                              transform_fn_io.TRANSFORMED_METADATA_DIR)
+  feature_spec = taxi.get_transformed_feature_spec(metadata_dir)
+  options = tf.python_io.TFRecordOptions(
+      compression_type=tf.python_io.TFRecordCompressionType.GZIP)
+  file_io.recursive_create_dir(files_dir)
+  filenames = []
+  for i in range(num_files):
+    filename = os.path.join(files_dir, '%s-%05d-of-%05d.gz' % (
+        files_prefix, i, num_files))
+    with tf.python_io.TFRecordWriter(filename, options=options) as writer:
+      for _ in range(rows_per_file):
+        example = tf.train.Example(features=tf.train.Features(feature={
+            name: _synthetic_feature(spec)
+            for name, spec in feature_spec.items()}))
+        writer.write(example.SerializeToString())
+    filenames.append(filename)
+  return filenames
+
+
+def benchmark_input_fn(input_fn, num_batches):
+  """Returns the seconds input_fn takes to produce num_batches batches."""
+  with tf.Graph().as_default():
+    features, labels = input_fn()
+    with tf.Session() as sess:
+      sess.run(tf.local_variables_initializer())
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      try:
+        for _ in range(_WARMUP_BATCHES):
+          sess.run((features, labels))
+        start = time.time()
+        for _ in range(num_batches):
+          sess.run((features, labels))
+        return time.time() - start
+      finally:
+        coord.request_stop()
+        coord.join(threads)
+
+
+def run_benchmarks(args, input_formats):
+  """Runs the benchmark of each input format.
+
+  Args:
+    args: The parsed flags, holding the files, batch size, number of batches
+      and the input pipeline flags of task.py.
+    input_formats: List of task.INPUT_FNS keys to benchmark.
+
+  Returns:
+    A list of result dicts, one per input format.
+  """
+  results = []
+  batch_size = args.batch_size
+  for input_format in input_formats:
+    filenames = _list_files(args.files_dir, args.files_prefix, input_format)
+    if not filenames:
+      print('No %s files, skipped' % input_format, file=sys.stderr)
+      continue
+    hparams = argparse.Namespace(**dict(vars(args),
+                                        input_format=input_format))
+    seconds = benchmark_input_fn(
+        task.make_input_fn(hparams, filenames, batch_size, 'benchmark'),
+        args.num_batches)
+    rows = batch_size * args.num_batches
+    print('%s rows=%d seconds=%.3f' % (input_format, rows, seconds),
+          file=sys.stderr)
+    results.append({
+        'input_format': input_format,
+        'files': len(filenames),
+        'bytes': sum(file_io.stat(f).length for f in filenames),
+        'rows': rows,
+        'batch_size': batch_size,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else None,
+    })
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--files-dir',
+      help='Directory holding the transformed examples.',
+      required=True)
+  parser.add_argument(
+      '--files-prefix',
+      help='Prefix of the transformed example files.',
+      required=True)
+  parser.add_argument(
+      '--tf-transform-dir',
+      help='Tf-transform directory with model from preprocessing step',
+      required=True)
+  parser.add_argument(
+      '--batch-size', default=DEFAULT_BATCH_SIZE, type=int)
+  parser.add_argument(
+      '--num-batches', default=DEFAULT_NUM_BATCHES, type=int)
+  parser.add_argument(
+      '--input-formats',
+      help='Comma separated input formats to benchmark.',
+      default=','.join(sorted(task.INPUT_FNS)))
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON report. The report is printed if not set.')
+  parser.add_argument(
+      '--synthetic-files',
+      help='Number of synthetic TFRecord shards to write to --files-dir.',
+      type=int)
+  parser.add_argument(
+      '--synthetic-rows-per-file',
+      default=DEFAULT_SYNTHETIC_ROWS_PER_FILE,
+      type=int)
+  task.add_input_pipeline_arguments(parser)
+  args = parser.parse_args()
+
+  if args.synthetic_files:
+    write_synthetic_shards(args.files_dir, args.files_prefix,
+                           args.tf_transform_dir, args.synthetic_files,
+                           args.synthetic_rows_per_file)
+  report = {
+      'tensorflow_version': tf.__version__,
+      'input_pipeline': {
+          'input_cycle_length': args.input_cycle_length,
+          'shuffle_buffer_size': args.shuffle_buffer_size,
+          'parse_parallel_calls': args.parse_parallel_calls,
+          'prefetch_buffer_size': args.prefetch_buffer_size,
+          'input_cache': args.input_cache,
+      },
+      'results': run_benchmarks(args, args.input_formats.split(',')),
+  }
+  if args.output:
+    file_io.write_string_to_file(args.output, json.dumps(report, indent=2))
+  else:
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+  main()
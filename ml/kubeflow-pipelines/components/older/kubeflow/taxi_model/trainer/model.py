@@ -16,13 +16,26 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import random
 import taxi
 import tensorflow as tf
+from tensorflow.python.lib.io import file_io
 
 import tensorflow_model_analysis as tfma
 from tensorflow_transform.beam.tft_beam_io import transform_fn_io
 from tensorflow_transform.saved import saved_transform_io
-from tensorflow_transform.tf_metadata import metadata_io
+
+try:
+  import pyarrow.parquet as pq  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # pyarrow is only needed by parquet_input_fn.
+  pq = None
+
+# Defaults of the tf.data pipeline of input_fn.
+DEFAULT_CYCLE_LENGTH = 4
+DEFAULT_SHUFFLE_BUFFER_SIZE = 10000
+DEFAULT_NUM_PARALLEL_CALLS = 4
+DEFAULT_PREFETCH_BUFFER_SIZE = 2
 
 
 def build_estimator(tf_transform_dir, config, hidden_units=None):
@@ -40,8 +53,7 @@ def build_estimator(tf_transform_dir, config, hidden_units=None):
   """
   metadata_dir = os.path.join(tf_transform_dir,
                               transform_fn_io.TRANSFORMED_METADATA_DIR)
-  transformed_metadata = metadata_io.read_metadata(metadata_dir)
-  transformed_feature_spec = transformed_metadata.schema.as_feature_spec()
+  transformed_feature_spec = taxi.get_transformed_feature_spec(metadata_dir)
 
   transformed_feature_spec.pop(taxi.transformed_name(taxi.LABEL_KEY))
 
@@ -152,11 +164,14 @@ def _gzip_reader_fn():
           compression_type=tf.python_io.TFRecordCompressionType.GZIP))
 
 
-def input_fn(filenames, tf_transform_dir, batch_size=200):
-  """Generates features and labels for training or evaluation.
+def queue_input_fn(filenames, tf_transform_dir, batch_size=200):
+  """Generates features and labels with the queue based reader.
+
+  This is the reader input_fn used before the tf.data pipeline, kept to
+  compare their throughput with input_benchmark.py.
 
   Args:
-    filenames: [str] list of CSV files to read data from.
+    filenames: [str] list of gzip'ed TFRecord files to read data from.
     tf_transform_dir: directory in which the tf-transform model was written
       during the preprocessing step.
     batch_size: int First dimension size of the Tensors returned by input_fn
@@ -167,8 +182,7 @@ def input_fn(filenames, tf_transform_dir, batch_size=200):
   """
   metadata_dir = os.path.join(tf_transform_dir,
                               transform_fn_io.TRANSFORMED_METADATA_DIR)
-  transformed_metadata = metadata_io.read_metadata(metadata_dir)
-  transformed_feature_spec = transformed_metadata.schema.as_feature_spec()
+  transformed_feature_spec = taxi.get_transformed_feature_spec(metadata_dir)
 
   transformed_features = tf.contrib.learn.io.read_batch_features(
       filenames, batch_size, transformed_feature_spec, reader=_gzip_reader_fn)
@@ -177,3 +191,122 @@ def input_fn(filenames, tf_transform_dir, batch_size=200):
   # training.
   return transformed_features, transformed_features.pop(
       taxi.transformed_name(taxi.LABEL_KEY))
+
+
+def input_fn(filenames, tf_transform_dir, batch_size=200, num_epochs=None,
+             shuffle=True, cycle_length=DEFAULT_CYCLE_LENGTH,
+             shuffle_buffer_size=DEFAULT_SHUFFLE_BUFFER_SIZE,
+             num_parallel_calls=DEFAULT_NUM_PARALLEL_CALLS,
+             prefetch_buffer_size=DEFAULT_PREFETCH_BUFFER_SIZE,
+             cache=None, num_record_shards=1, record_shard_index=0):
+  """Generates features and labels for training or evaluation.
+
+  The gzip'ed TFRecord files are read cycle_length at a time in parallel,
+  and whole batches of records are parsed at once with parse_example.
+
+  Args:
+    filenames: [str] list of gzip'ed TFRecord files to read data from.
+    tf_transform_dir: directory in which the tf-transform model was written
+      during the preprocessing step.
+    batch_size: int First dimension size of the Tensors returned by input_fn
+    num_epochs: int Number of passes over the files, None to repeat forever.
+    shuffle: bool Whether to shuffle the files and records.
+    cycle_length: int Number of files read in parallel.
+    shuffle_buffer_size: int Number of records the shuffling draws from.
+    num_parallel_calls: int Number of batches parsed in parallel.
+    prefetch_buffer_size: int Number of parsed batches read ahead.
+    cache: Where to cache the serialized records after the first epoch: ''
+      for memory, a file name prefix for files, or None to not cache them.
+      The files are only read, in shuffled order, in the first epoch. Later
+      epochs replay the cached records in that order, shuffled only by the
+      shuffle_buffer_size buffer.
+    num_record_shards: int Number of readers splitting the records of each
+      file, see task.shard_files.
+    record_shard_index: int Index of this reader among them.
+
+  Returns:
+    A (features, indices) tuple where features is a dictionary of
+      Tensors, and indices is a single Tensor of label indices.
+  """
+  metadata_dir = os.path.join(tf_transform_dir,
+                              transform_fn_io.TRANSFORMED_METADATA_DIR)
+  transformed_feature_spec = taxi.get_transformed_feature_spec(metadata_dir)
+
+  files = tf.data.Dataset.from_tensor_slices(list(filenames))
+  if shuffle:
+    files = files.shuffle(len(filenames))
+  dataset = files.apply(tf.contrib.data.parallel_interleave(
+      lambda filename: tf.data.TFRecordDataset(
+          filename, compression_type='GZIP').shard(
+              num_record_shards, record_shard_index),
+      cycle_length=min(cycle_length, len(filenames)),
+      sloppy=shuffle))
+  if cache is not None:
+    # Fixes the file order of all epochs to that of the first one.
+    dataset = dataset.cache(cache)
+  dataset = dataset.repeat(num_epochs)
+  if shuffle:
+    dataset = dataset.shuffle(shuffle_buffer_size)
+  dataset = dataset.batch(batch_size)
+  dataset = dataset.map(
+      lambda records: tf.parse_example(records, transformed_feature_spec),
+      num_parallel_calls=num_parallel_calls)
+  dataset = dataset.prefetch(prefetch_buffer_size)
+  transformed_features = dataset.make_one_shot_iterator().get_next()
+
+  # We pop the label because we do not want to use it as a feature while we're
+  # training.
+  return transformed_features, transformed_features.pop(
+      taxi.transformed_name(taxi.LABEL_KEY))
+
+
+def parquet_input_fn(filenames, tf_transform_dir, batch_size=200,
+                     num_epochs=None):
+  """Generates features and labels from Parquet shards of transformed data.
+
+  The shards are written by the preprocessing with --parquet_output. Their
+  columns are read as whole batches, so no per-example parsing is needed.
+  The file order is shuffled for each epoch; the rows themselves were
+  shuffled by the preprocessing. All transformed features must be scalars,
+  as they are for the taxi data.
+
+  Args:
+    filenames: [str] list of Parquet files to read data from.
+    tf_transform_dir: directory in which the tf-transform model was written
+      during the preprocessing step.
+    batch_size: int First dimension size of the Tensors returned by input_fn
+    num_epochs: int Number of passes over the files, None to repeat forever.
+
+  Returns:
+    A (features, indices) tuple where features is a dictionary of
+      Tensors, and indices is a single Tensor of label indices.
+  """
+  if pq is None:
+    raise ImportError('parquet_input_fn needs pyarrow.')
+  metadata_dir = os.path.join(tf_transform_dir,
+                              transform_fn_io.TRANSFORMED_METADATA_DIR)
+  transformed_feature_spec = taxi.get_transformed_feature_spec(metadata_dir)
+  names = sorted(transformed_feature_spec)
+
+  def generate_batches():
+    shuffled = list(filenames)
+    random.shuffle(shuffled)
+    for filename in shuffled:
+      with file_io.FileIO(filename, 'rb') as f:
+        table = pq.read_table(f, columns=names)
+      for batch in table.to_batches(max_chunksize=batch_size):
+        yield tuple(batch.column(i).to_numpy(zero_copy_only=False)
+                    for i in range(batch.num_columns))
+
+  dataset = tf.data.Dataset.from_generator(
+      generate_batches,
+      tuple(transformed_feature_spec[name].dtype for name in names),
+      tuple(tf.TensorShape([None]) for _ in names))
+  dataset = dataset.repeat(num_epochs).prefetch(1)
+  transformed_features = dict(
+      zip(names, dataset.make_one_shot_iterator().get_next()))
+
+  # We pop the label because we do not want to use it as a feature while we're
+  # training.
+  return transformed_features, transformed_features.pop(
+      taxi.transformed_name(taxi.LABEL_KEY))
@@ -15,8 +15,10 @@
 """Trainer for the chicago_taxi demo."""
 
 import argparse
+import json
 import os
 
+import export_readiness
 import model
 import taxi
 
@@ -29,38 +31,169 @@ import tensorflow_model_analysis as tfma
 
 SERVING_MODEL_DIR = 'serving_model_dir'
 EVAL_MODEL_DIR = 'eval_model_dir'
+EXPORTER_NAME = 'chicago-taxi'
 
 TRAIN_BATCH_SIZE = 40
 EVAL_BATCH_SIZE = 40
 
+# Input function and file suffix for each --input-format. 'tfrecord-queue'
+# reads the same files as 'tfrecord' with the former queue based reader.
+INPUT_FNS = {
+    'tfrecord': model.input_fn,
+    'tfrecord-queue': model.queue_input_fn,
+    'parquet': model.parquet_input_fn,
+}
+PARQUET_SUFFIX = '.parquet'
+
+# TF_CONFIG task types of the replicas reading training data, in the order
+# the training files are assigned to them.
+READER_TASK_TYPES = ['chief', 'master', 'worker']
+
 # Number of nodes in the first layer of the DNN
 FIRST_DNN_LAYER_SIZE = 100
 NUM_DNN_LAYERS = 4
 DNN_DECAY_FACTOR = 0.7
 
 
-def train_and_maybe_evaluate(train_files, eval_files, hparams):
+def _load_tf_config(tf_config):
+  if tf_config is None:
+    tf_config = json.loads(os.environ.get('TF_CONFIG') or '{}')
+  return tf_config
+
+
+def task_name(tf_config=None):
+  """Returns a name of this replica unique in the cluster, e.g. 'worker-1'.
+
+  Args:
+    tf_config: The cluster spec as set by the TFJob operator, read from the
+      TF_CONFIG environment variable if None.
+  """
+  task = _load_tf_config(tf_config).get('task', {})
+  if 'type' not in task:
+    return 'local'
+  return '%s-%d' % (task['type'], task.get('index', 0))
+
+
+def worker_shard(tf_config=None):
+  """Returns the number of training data readers and the index of this one.
+
+  Args:
+    tf_config: The cluster spec as set by the TFJob operator, read from the
+      TF_CONFIG environment variable if None.
+
+  Returns:
+    A (num_readers, reader_index) tuple, (1, 0) when not running in a
+    cluster or on a replica not reading training data.
+  """
+  tf_config = _load_tf_config(tf_config)
+  cluster = tf_config.get('cluster', {})
+  task = tf_config.get('task', {})
+  readers = [(task_type, index)
+             for task_type in READER_TASK_TYPES
+             for index in range(len(cluster.get(task_type, [])))]
+  this_reader = (task.get('type'), task.get('index', 0))
+  if this_reader not in readers:
+    return 1, 0
+  return len(readers), readers.index(this_reader)
+
+
+def shard_files(filenames, num_readers, reader_index):
+  """Assigns a disjoint part of the training data to one reader.
+
+  With at least as many files as readers, the sorted files are dealt out
+  round-robin, so the readers get numbers of files differing by at most
+  one. With fewer files, each file is read by several readers which split
+  its records between them.
+
+  Args:
+    filenames: [str] list of all the training files.
+    num_readers: int Number of readers, see worker_shard.
+    reader_index: int Index of this reader.
+
+  Returns:
+    A (filenames, num_record_shards, record_shard_index) tuple: the files of
+    this reader, and how their records are split between the readers
+    sharing them.
+  """
+  filenames = sorted(filenames)
+  if not filenames or len(filenames) >= num_readers:
+    return filenames[reader_index::num_readers], 1, 0
+  num_files = len(filenames)
+  sharing = list(range(reader_index % num_files, num_readers, num_files))
+  return ([filenames[reader_index % num_files]], len(sharing),
+          sharing.index(reader_index))
+
+
+def make_input_fn(hparams, filenames, batch_size, name, record_shard=(1, 0),
+                  shuffle=True):
+  """Returns the input function of --input-format reading filenames.
+
+  Args:
+    hparams: Holds the input flags.
+    filenames: [str] list of input files.
+    batch_size: int First dimension size of the Tensors returned.
+    name: Name of the input, e.g. 'train', keeping its cache files apart.
+    record_shard: (num_record_shards, record_shard_index) splitting the
+      records of the files between readers, as returned by shard_files.
+    shuffle: bool Whether --input-format=tfrecord shuffles the files and
+      records, and interleaves the files nondeterministically.
+
+  Raises:
+    ValueError: if the records must be split but --input-format can not
+      split the records of a file.
+  """
+  input_fn = INPUT_FNS[hparams.input_format]
+  kwargs = {}
+  if hparams.input_format == 'tfrecord':
+    kwargs = dict(
+        cycle_length=hparams.input_cycle_length,
+        shuffle=shuffle,
+        shuffle_buffer_size=hparams.shuffle_buffer_size,
+        num_parallel_calls=hparams.parse_parallel_calls,
+        prefetch_buffer_size=hparams.prefetch_buffer_size,
+        cache=input_cache(hparams.input_cache, name),
+        num_record_shards=record_shard[0],
+        record_shard_index=record_shard[1])
+  elif record_shard[0] > 1:
+    raise ValueError(
+        '--input-format=%s can not split the records of a file between %d '
+        'readers; use at least as many files as readers, or '
+        '--input-format=tfrecord.' % (hparams.input_format, record_shard[0]))
+  return lambda: input_fn(
+      filenames, hparams.tf_transform_dir, batch_size=batch_size, **kwargs)
+
+
+def input_cache(flag_value, name, tf_config=None):
+  """Returns the cache argument of model.input_fn for --input-cache.
+
+  Cache files are suffixed with the input name and the replica, as the
+  replicas of a cluster read different files.
+  """
+  if not flag_value:
+    return None
+  if flag_value == 'memory':
+    return ''
+  return '%s-%s-%s' % (flag_value, name, task_name(tf_config))
+
+
+def train_and_maybe_evaluate(train_files, eval_files, hparams,
+                             train_record_shard=(1, 0)):
   """Run the training and evaluate using the high level API.
 
   Args:
     hparams: Holds hyperparameters used to train the model as name/value pairs.
+    train_record_shard: Split of the records of train_files, see
+      make_input_fn.
 
   Returns:
     The estimator that was used for training (and maybe eval)
   """
-  schema = taxi.read_schema('schema.pbtxt')
+  schema = taxi.get_schema('schema.pbtxt')
 
-  train_input = lambda: model.input_fn(
-      train_files,
-      hparams.tf_transform_dir,
-      batch_size=TRAIN_BATCH_SIZE
-  )
-
-  eval_input = lambda: model.input_fn(
-      eval_files,
-      hparams.tf_transform_dir,
-      batch_size=EVAL_BATCH_SIZE
-  )
+  train_input = make_input_fn(hparams, train_files, TRAIN_BATCH_SIZE, 'train',
+                              record_shard=train_record_shard)
+  eval_input = make_input_fn(hparams, eval_files, EVAL_BATCH_SIZE, 'eval',
+                             shuffle=False)
 
   train_spec = tf.estimator.TrainSpec(
       train_input, max_steps=hparams.train_steps)
@@ -68,7 +201,7 @@ def train_and_maybe_evaluate(train_files, eval_files, hparams):
   serving_receiver_fn = lambda: model.example_serving_receiver_fn(
       hparams.tf_transform_dir, schema)
 
-  exporter = tf.estimator.FinalExporter('chicago-taxi', serving_receiver_fn)
+  exporter = tf.estimator.FinalExporter(EXPORTER_NAME, serving_receiver_fn)
   eval_spec = tf.estimator.EvalSpec(
       eval_input,
       steps=hparams.eval_steps,
@@ -93,17 +226,26 @@ def train_and_maybe_evaluate(train_files, eval_files, hparams):
 
   tf.estimator.train_and_evaluate(estimator, train_spec, eval_spec)
 
+  # The final export is written by the chief once training is done.
+  if run_config.is_chief:
+    export_readiness.mark_latest_export(
+        os.path.join(serving_model_dir, 'export', EXPORTER_NAME))
+
   return estimator
 
 
-def run_experiment(train_files, eval_files, hparams):
+def run_experiment(train_files, eval_files, hparams,
+                   train_record_shard=(1, 0)):
   """Train the model then export it for tf.model_analysis evaluation.
 
   Args:
     hparams: Holds hyperparameters used to train the model as name/value pairs.
+    train_record_shard: Split of the records of train_files, see
+      make_input_fn.
   """
-  estimator = train_and_maybe_evaluate(train_files, eval_files, hparams)
-  schema = taxi.read_schema('schema.pbtxt')
+  estimator = train_and_maybe_evaluate(train_files, eval_files, hparams,
+                                       train_record_shard)
+  schema = taxi.get_schema('schema.pbtxt')
 
 
   # Save a model for tfma eval
@@ -111,10 +253,39 @@ def run_experiment(train_files, eval_files, hparams):
   receiver_fn = lambda: model.eval_input_receiver_fn(  # pylint: disable=g-long-lambda
       hparams.tf_transform_dir, schema)
 
-  tfma.export.export_eval_savedmodel(
+  export_dir = tfma.export.export_eval_savedmodel(
       estimator=estimator,
       export_dir_base=eval_model_dir,
       eval_input_receiver_fn=receiver_fn)
+  export_readiness.write_success_marker(tf.compat.as_str(export_dir))
+
+
+def add_input_pipeline_arguments(parser):
+  """Adds the flags tuning the tf.data pipeline of --input-format=tfrecord."""
+  parser.add_argument(
+      '--input-cycle-length',
+      help='Number of input files read in parallel.',
+      default=model.DEFAULT_CYCLE_LENGTH,
+      type=int)
+  parser.add_argument(
+      '--shuffle-buffer-size',
+      help='Number of records the input shuffling draws from.',
+      default=model.DEFAULT_SHUFFLE_BUFFER_SIZE,
+      type=int)
+  parser.add_argument(
+      '--parse-parallel-calls',
+      help='Number of input batches parsed in parallel.',
+      default=model.DEFAULT_NUM_PARALLEL_CALLS,
+      type=int)
+  parser.add_argument(
+      '--prefetch-buffer-size',
+      help='Number of parsed input batches read ahead.',
+      default=model.DEFAULT_PREFETCH_BUFFER_SIZE,
+      type=int)
+  parser.add_argument(
+      '--input-cache',
+      help=('Caches the input records after the first epoch: \'memory\', or '
+            'a file name prefix to cache them in files.'))
 
 
 if __name__ == '__main__':
@@ -174,6 +345,13 @@ if __name__ == '__main__':
       help='Number of steps to run evalution for at each checkpoint',
       default=100,
       type=int)
+  parser.add_argument(
+      '--input-format',
+      help=('Format of the transformed input files: gzip\'ed TFRecords or '
+            'the Parquet shards written with --parquet_output.'),
+      choices=sorted(INPUT_FNS),
+      default='tfrecord')
+  add_input_pipeline_arguments(parser)
   args = parser.parse_args()
 
   # Set python level verbosity
@@ -182,20 +360,30 @@ if __name__ == '__main__':
   os.environ['TF_CPP_MIN_LOG_LEVEL'] = str(
       tf.logging.__dict__[args.verbosity] / 10)
 
+  is_parquet = args.input_format == 'parquet'
   train_files = []
   tflist = file_io.list_directory(args.train_files_dir)
   for x in tflist:
-    if args.train_files_prefix in x:
+    if (args.train_files_prefix in x and
+        x.endswith(PARQUET_SUFFIX) == is_parquet):
       train_files.append(os.path.join(args.train_files_dir, x))
-  print("train files list: %s" % train_files)
+  # Each replica reading training data gets a disjoint part of it.
+  num_readers, reader_index = worker_shard()
+  train_files, num_record_shards, record_shard_index = shard_files(
+      train_files, num_readers, reader_index)
+  print("train files list: %s (reader %d of %d, record shard %d of %d)" % (
+      train_files, reader_index, num_readers, record_shard_index,
+      num_record_shards))
 
   eval_files = []
   eflist = file_io.list_directory(args.eval_files_dir)
   for x in eflist:
-    if args.eval_files_prefix in x:
+    if (args.eval_files_prefix in x and
+        x.endswith(PARQUET_SUFFIX) == is_parquet):
       eval_files.append(os.path.join(args.eval_files_dir, x))
   print("eval files list: %s" % eval_files)
 
   # Run the training job
   hparams = tf.contrib.training.HParams(**args.__dict__)
-  run_experiment(train_files, eval_files, hparams)
+  run_experiment(train_files, eval_files, hparams,
+                 (num_record_shards, record_shard_index))
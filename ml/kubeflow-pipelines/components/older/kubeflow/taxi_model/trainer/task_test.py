@@ -0,0 +1,142 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the sharding of the training data between replicas."""
+
+import argparse
+import unittest
+
+import task
+
+# Number of records simulated per file.
+_RECORDS_PER_FILE = 12
+
+
+def _tf_config(num_workers, task_type, index):
+  return {
+      'cluster': {
+          'master': ['master-0:2222'],
+          'worker': ['worker-%d:2222' % i for i in range(num_workers)],
+          'ps': ['ps-0:2222'],
+      },
+      'task': {'type': task_type, 'index': index},
+  }
+
+
+def _reader_tasks(num_workers):
+  return [('master', 0)] + [('worker', i) for i in range(num_workers)]
+
+
+class WorkerShardTest(unittest.TestCase):
+
+  def test_no_cluster(self):
+    self.assertEqual((1, 0), task.worker_shard({}))
+
+  def test_readers(self):
+    shards = [task.worker_shard(_tf_config(3, task_type, index))
+              for task_type, index in _reader_tasks(3)]
+    self.assertEqual([(4, 0), (4, 1), (4, 2), (4, 3)], shards)
+
+  def test_ps_reads_no_training_data(self):
+    self.assertEqual((1, 0), task.worker_shard(_tf_config(3, 'ps', 0)))
+
+
+class ShardFilesTest(unittest.TestCase):
+
+  def _simulate(self, num_files, num_workers):
+    """Returns the (file, record) pairs read by each simulated reader."""
+    filenames = ['train-%05d.gz' % i for i in range(num_files)]
+    reads = []
+    for task_type, index in _reader_tasks(num_workers):
+      num_readers, reader_index = task.worker_shard(
+          _tf_config(num_workers, task_type, index))
+      files, num_record_shards, record_shard_index = task.shard_files(
+          filenames, num_readers, reader_index)
+      # Dataset.shard keeps every num_record_shards-th record.
+      reads.append([(f, record) for f in files
+                    for record in range(_RECORDS_PER_FILE)
+                    if record % num_record_shards == record_shard_index])
+    return filenames, reads
+
+  def _assert_disjoint_cover(self, num_files, num_workers):
+    filenames, reads = self._simulate(num_files, num_workers)
+    all_reads = [read for reader_reads in reads for read in reader_reads]
+    self.assertEqual(len(all_reads), len(set(all_reads)),
+                     'overlap with %d files' % num_files)
+    self.assertEqual(
+        set((f, record) for f in filenames
+            for record in range(_RECORDS_PER_FILE)),
+        set(all_reads))
+    return reads
+
+  def test_even_files(self):
+    reads = self._assert_disjoint_cover(8, 3)
+    self.assertEqual([2 * _RECORDS_PER_FILE] * 4,
+                     [len(reader_reads) for reader_reads in reads])
+
+  def test_uneven_files(self):
+    reads = self._assert_disjoint_cover(10, 3)
+    # 10 files on 4 readers: 3, 3, 2 and 2 files.
+    self.assertEqual([3, 3, 2, 2],
+                     [len(reader_reads) // _RECORDS_PER_FILE
+                      for reader_reads in reads])
+
+  def test_fewer_files_than_readers(self):
+    reads = self._assert_disjoint_cover(3, 6)
+    self.assertTrue(all(reads))
+
+  def test_all_cluster_sizes(self):
+    for num_workers in range(6):
+      for num_files in range(1, 12):
+        self._assert_disjoint_cover(num_files, num_workers)
+
+  def test_single_reader_reads_all_files(self):
+    self.assertEqual((['a', 'b'], 1, 0), task.shard_files(['b', 'a'], 1, 0))
+
+
+class MakeInputFnTest(unittest.TestCase):
+
+  def test_parquet_can_not_split_records(self):
+    hparams = argparse.Namespace(input_format='parquet',
+                                 tf_transform_dir='/tmp/tft')
+    with self.assertRaises(ValueError):
+      task.make_input_fn(hparams, ['a.parquet'], 10, 'train',
+                         record_shard=(2, 0))
+
+  def test_shuffle(self):
+    hparams = argparse.Namespace(
+        input_format='tfrecord', tf_transform_dir='/tmp/tft',
+        input_cycle_length=2, shuffle_buffer_size=10, parse_parallel_calls=2,
+        prefetch_buffer_size=1, input_cache=None)
+    calls = []
+    input_fn = task.INPUT_FNS['tfrecord']
+    task.INPUT_FNS['tfrecord'] = lambda *args, **kwargs: calls.append(kwargs)
+    try:
+      task.make_input_fn(hparams, ['a.gz'], 10, 'train')()
+      task.make_input_fn(hparams, ['a.gz'], 10, 'eval', shuffle=False)()
+    finally:
+      task.INPUT_FNS['tfrecord'] = input_fn
+    self.assertEqual([True, False], [kwargs['shuffle'] for kwargs in calls])
+
+  def test_input_cache_per_replica(self):
+    caches = set(task.input_cache('/tmp/cache', 'train',
+                                  _tf_config(2, task_type, index))
+                 for task_type, index in _reader_tasks(2))
+    self.assertEqual(3, len(caches))
+    self.assertEqual('', task.input_cache('memory', 'train'))
+    self.assertIsNone(task.input_cache(None, 'train'))
+
+
+if __name__ == '__main__':
+  unittest.main()
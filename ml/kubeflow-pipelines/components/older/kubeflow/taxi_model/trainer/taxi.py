@@ -15,8 +15,14 @@
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
+import json
+import os
+import threading
+
 from tensorflow_transform import coders as tft_coders
 from tensorflow_transform.tf_metadata import dataset_schema
+from tensorflow_transform.tf_metadata import metadata_io
 from tensorflow_transform.tf_metadata import schema_utils
 
 from google.protobuf import text_format
@@ -78,6 +84,18 @@ CSV_COLUMN_NAMES = [
 ]
 
 
+# Process-wide cache of parsed schemas and metadata, from (kind, path) to a
+# (stamp, value) pair. See get_schema.
+_SCHEMA_REGISTRY = {}
+_SCHEMA_REGISTRY_LOCK = threading.Lock()
+
+# Suffix of the manifest describing the shards of a csv output.
+CSV_MANIFEST_SUFFIX = '.manifest.json'
+
+# Size of the chunks shards are read in to count their rows and checksum them.
+_MANIFEST_READ_CHUNK_SIZE = 1 << 20
+
+
 def transformed_name(key):
   return key + '_xf'
 
@@ -116,6 +134,39 @@ def clean_raw_data_dict(input_dict, raw_feature_spec):
   return output_dict
 
 
+def make_raw_data_batch_cleaner(raw_feature_spec):
+  """Returns a batch variant of clean_raw_data_dict.
+
+  The returned function takes a list of raw data dicts, e.g. BigQuery rows,
+  and returns the cleaned data column-oriented, as a dict from feature key to
+  the list of the cleaned values of each row. Empty values are cleaned as in
+  clean_raw_data_dict.
+
+  Args:
+    raw_feature_spec: The raw feature spec, whose keys are the columns.
+
+  Returns:
+    The batch cleaning function.
+  """
+  keys = list(raw_feature_spec)
+
+  def clean_batch(input_dicts):
+    columns = {}
+    for key in keys:
+      columns[key] = [[value] if value else []
+                      for value in (d.get(key) for d in input_dicts)]
+    return columns
+
+  return clean_batch
+
+
+def columns_to_dicts(columns):
+  """Yields the row dicts of column-oriented data, e.g. a cleaned batch."""
+  keys = list(columns)
+  for values in zip(*[columns[key] for key in keys]):
+    yield dict(zip(keys, values))
+
+
 def make_sql(table_name, max_rows=None, for_eval=False):
   """Creates the sql command for pulling data from BigQuery.
 
@@ -176,4 +227,164 @@ def read_schema(path):
   result = schema_pb2.Schema()
   contents = file_io.read_file_to_string(path)
   text_format.Parse(contents, result)
-  return result
\ No newline at end of file
+  return result
+
+
+def _file_stamp(path):
+  """Returns the modification time and size of a file, or of a directory."""
+  if file_io.is_directory(path):
+    return tuple(sorted(
+        (os.path.join(dirname, filename), _file_stamp(
+            os.path.join(dirname, filename)))
+        for dirname, _, filenames in file_io.walk(path)
+        for filename in filenames))
+  stat = file_io.stat(path)
+  return stat.mtime_nsec, stat.length
+
+
+def _registered(kind, path, load):
+  """Returns the cached load(path), loading it again if path changed."""
+  key = (kind, path)
+  stamp = _file_stamp(path)
+  with _SCHEMA_REGISTRY_LOCK:
+    entry = _SCHEMA_REGISTRY.get(key)
+  if entry is not None and entry[0] == stamp:
+    return entry[1]
+  value = load(path)
+  with _SCHEMA_REGISTRY_LOCK:
+    _SCHEMA_REGISTRY[key] = (stamp, value)
+  return value
+
+
+def get_schema(path):
+  """Returns the Schema at path, as read_schema does, parsing it only once.
+
+  Parsed schemas are cached for the process by path and revalidated with the
+  file's modification time and size, so an edited file is parsed again.
+
+  Args:
+    path: The location of the file holding a serialized Schema proto.
+
+  Returns:
+    A copy of the cached Schema, which the caller may modify.
+  """
+  result = schema_pb2.Schema()
+  result.CopyFrom(_registered('schema', path, read_schema))
+  return result
+
+
+def get_cached_raw_feature_spec(path):
+  """Returns a copy of the raw feature spec of the Schema at path, cached."""
+  return dict(_registered(
+      'raw_feature_spec', path,
+      lambda p: get_raw_feature_spec(_registered('schema', p, read_schema))))
+
+
+def get_transformed_metadata(metadata_dir):
+  """Returns the DatasetMetadata in metadata_dir, cached as get_schema does.
+
+  Args:
+    metadata_dir: Directory of the metadata, e.g. the
+      transform_fn_io.TRANSFORMED_METADATA_DIR of the transform output.
+
+  Returns:
+    The cached DatasetMetadata, which must not be modified.
+  """
+  return _registered('metadata', metadata_dir, metadata_io.read_metadata)
+
+
+def get_transformed_feature_spec(metadata_dir):
+  """Returns a copy of the feature spec of the metadata in metadata_dir."""
+  return dict(_registered(
+      'transformed_feature_spec', metadata_dir,
+      lambda p: get_transformed_metadata(p).schema.as_feature_spec()))
+
+
+def invalidate_schema_cache(path=None):
+  """Drops the cached schemas and metadata of path, or all of them if None."""
+  with _SCHEMA_REGISTRY_LOCK:
+    for key in list(_SCHEMA_REGISTRY):
+      if path is None or key[1] == path:
+        del _SCHEMA_REGISTRY[key]
+
+
+def _describe_shard(path, skip_header_lines):
+  """Returns the manifest entry of one csv shard."""
+  checksum = hashlib.sha256()
+  lines = 0
+  last = b'\n'
+  with file_io.FileIO(path, 'rb') as f:
+    while True:
+      chunk = f.read(_MANIFEST_READ_CHUNK_SIZE)
+      if not chunk:
+        break
+      checksum.update(chunk)
+      lines += chunk.count(b'\n')
+      last = chunk[-1:]
+  if last != b'\n':
+    lines += 1
+  return {
+      'path': path,
+      'rows': max(lines - skip_header_lines, 0),
+      'bytes': file_io.stat(path).length,
+      'sha256': checksum.hexdigest(),
+  }
+
+
+def write_csv_manifest(file_pattern, manifest_path, skip_header_lines=1):
+  """Writes the manifest of the csv shards matching file_pattern.
+
+  Args:
+    file_pattern: Glob matching the shards, e.g. a sharded WriteToText output.
+    manifest_path: Path of the manifest, ending with CSV_MANIFEST_SUFFIX.
+    skip_header_lines: Number of header lines in each shard, not counted as
+      rows.
+
+  Returns:
+    The manifest as a dict with the 'shards' list and the total 'rows' and
+    'bytes'. Each shard has its 'path', 'rows', 'bytes' and 'sha256'.
+  """
+  shards = [_describe_shard(path, skip_header_lines)
+            for path in sorted(file_io.get_matching_files(file_pattern))]
+  manifest = {
+      'shards': shards,
+      'rows': sum(shard['rows'] for shard in shards),
+      'bytes': sum(shard['bytes'] for shard in shards),
+  }
+  file_io.write_string_to_file(manifest_path,
+                               json.dumps(manifest, indent=2, sort_keys=True))
+  return manifest
+
+
+def resolve_csv_files(csv_path, verify=False):
+  """Returns the csv files of a manifest, a glob or a single file.
+
+  Args:
+    csv_path: Path to a manifest written by write_csv_manifest, identified by
+      CSV_MANIFEST_SUFFIX, or a glob of csv files.
+    verify: If True, the size and checksum of each shard of a manifest are
+      checked.
+
+  Returns:
+    The list of csv file paths.
+
+  Raises:
+    ValueError: If no file matches csv_path, or a shard does not match its
+      manifest entry.
+  """
+  if csv_path.endswith(CSV_MANIFEST_SUFFIX):
+    manifest = json.loads(file_io.read_file_to_string(csv_path))
+    paths = []
+    for shard in manifest['shards']:
+      if verify:
+        actual = _describe_shard(shard['path'], 0)
+        if (actual['bytes'] != shard['bytes'] or
+            actual['sha256'] != shard['sha256']):
+          raise ValueError('Shard %s does not match the manifest %s' %
+                           (shard['path'], csv_path))
+      paths.append(shard['path'])
+    return paths
+  paths = sorted(file_io.get_matching_files(csv_path))
+  if not paths:
+    raise ValueError('No csv file matches %s' % csv_path)
+  return paths
\ No newline at end of file
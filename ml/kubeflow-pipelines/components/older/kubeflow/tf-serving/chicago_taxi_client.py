@@ -79,8 +79,9 @@ def _do_inference(model_handle, examples_file, num_examples, schema, model_name)
   Args:
     model_handle: handle to the model. This can be either
      "mlengine:model:version" or "host:port"
-    examples_file: path to csv file containing examples, with the first line
-      assumed to have the column headers
+    examples_file: path to csv file containing examples, a glob of csv
+      shards or their manifest. The first line of each file is assumed to
+      have the column headers
     num_examples: number of requests to send to the server
     schema: a Schema describing the input data
 
@@ -96,19 +97,22 @@ def _do_inference(model_handle, examples_file, num_examples, schema, model_name)
   csv_coder = taxi.make_csv_coder(schema)
   proto_coder = taxi.make_proto_coder(schema)
 
-  input_file = open(examples_file, 'r')
-  input_file.readline()  # skip header line
-
   serialized_examples = []
-  for _ in range(num_examples):
-    one_line = input_file.readline()
-    if not one_line:
-      print('End of example file reached')
+  for input_path in taxi.resolve_csv_files(examples_file):
+    with file_io.FileIO(input_path, 'r') as input_file:
+      input_file.readline()  # skip header line
+      while len(serialized_examples) < num_examples:
+        one_line = input_file.readline()
+        if not one_line:
+          break
+        one_example = csv_coder.decode(one_line)
+
+        serialized_example = proto_coder.encode(one_example)
+        serialized_examples.append(serialized_example)
+    if len(serialized_examples) == num_examples:
       break
-    one_example = csv_coder.decode(one_line)
-
-    serialized_example = proto_coder.encode(one_example)
-    serialized_examples.append(serialized_example)
+  else:
+    print('End of example file reached')
 
   parsed_model_handle = model_handle.split(':')
   if parsed_model_handle[0] == 'mlengine':
@@ -140,7 +144,8 @@ def main(_):
 
   parser.add_argument(
       '--examples_file',
-      help=('Path to csv file containing examples.'),
+      help=('Path to csv file containing examples, a glob of csv shards or '
+            'their .manifest.json.'),
       required=True)
   parser.add_argument(
       '--model_name',
@@ -153,7 +158,7 @@ def main(_):
   known_args, _ = parser.parse_known_args()
   _do_inference(known_args.server,
                 known_args.examples_file, known_args.num_examples,
-                taxi.read_schema(known_args.schema_file),
+                taxi.get_schema(known_args.schema_file),
                 known_args.model_name)
 
 
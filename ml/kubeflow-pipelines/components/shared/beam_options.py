@@ -0,0 +1,41 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks of the Beam pipeline options shared by the pipeline steps.
+
+The build scripts of the containers using this module copy it into their
+image next to the scripts importing it.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import apache_beam as beam
+
+# DirectRunner options of the 'local-parallel' mode, which older Beam releases
+# do not know and would silently ignore.
+LOCAL_PARALLEL_OPTIONS = ['direct_num_workers', 'direct_running_mode']
+
+
+def check_local_parallel_options(pipeline_options):
+  """Raises a ValueError if Beam does not know the local-parallel options."""
+  known_options = pipeline_options.get_all_options()
+  unknown = [name for name in LOCAL_PARALLEL_OPTIONS
+             if name not in known_options]
+  if unknown:
+    raise ValueError(
+        'apache-beam %s does not support the DirectRunner options %s of the '
+        'local-parallel mode, use the local mode or a newer apache-beam.' %
+        (beam.__version__, ', '.join(unknown)))
@@ -0,0 +1,48 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for beam_options."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import beam_options
+
+
+class _FakeOptions(object):
+
+  def __init__(self, names):
+    self._names = names
+
+  def get_all_options(self):
+    return dict.fromkeys(self._names)
+
+
+class CheckLocalParallelOptionsTest(unittest.TestCase):
+
+  def test_known_options(self):
+    beam_options.check_local_parallel_options(
+        _FakeOptions(['project'] + beam_options.LOCAL_PARALLEL_OPTIONS))
+
+  def test_unknown_options(self):
+    with self.assertRaisesRegexp(ValueError, 'direct_running_mode'):
+      beam_options.check_local_parallel_options(
+          _FakeOptions(['project', 'direct_num_workers']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Completion markers for exported models, and waiting for them.
+
+The trainer writes a _SUCCESS marker into each export dir once the model is
+fully written. Steps consuming the model (TFMA, the serving deployments)
+call wait_for_export, which polls the export base dir until an export dir
+holding the marker shows up and returns the newest such dir.
+
+The build scripts of the containers using this module copy it into their
+image next to the scripts importing it.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import time
+import uuid
+
+from tensorflow.python.lib.io import file_io
+
+# Marker written to an export dir once the model is complete.
+SUCCESS_MARKER = '_SUCCESS'
+
+# Prefix of the dirs exporters write to before renaming them.
+TEMP_PREFIX = 'temp'
+
+DEFAULT_TIMEOUT_SECS = 30 * 60
+DEFAULT_POLL_SECS = 2.
+MAX_POLL_SECS = 30.
+
+# Relative jitter applied to each poll interval, so that waiters started
+# together do not list the bucket in lockstep.
+POLL_JITTER = 0.25
+
+
+def write_success_marker(export_dir):
+  """Marks export_dir as complete.
+
+  The marker is written to a temporary name first and renamed, so a waiter
+  never sees a partially written marker.
+  """
+  marker = os.path.join(export_dir, SUCCESS_MARKER)
+  temp_marker = '%s.%s.tmp' % (marker, uuid.uuid4().hex)
+  file_io.write_string_to_file(temp_marker, '')
+  file_io.rename(temp_marker, marker, overwrite=True)
+
+
+def is_ready(export_dir):
+  return file_io.file_exists(os.path.join(export_dir, SUCCESS_MARKER))
+
+
+def _sort_key(name):
+  # Export dirs are named by their timestamp; others sort before them.
+  return (name.isdigit(), int(name) if name.isdigit() else 0, name)
+
+
+def export_dirs(export_base_dir):
+  """Returns the export dirs under export_base_dir, newest first.
+
+  Dirs still being written by an exporter (temp-*) are left out.
+  """
+  if not file_io.is_directory(export_base_dir):
+    return []
+  names = [name.rstrip('/')
+           for name in file_io.list_directory(export_base_dir)]
+  names = [name for name in names
+           if not name.startswith(TEMP_PREFIX) and
+           file_io.is_directory(os.path.join(export_base_dir, name))]
+  return [os.path.join(export_base_dir, name)
+          for name in sorted(names, key=_sort_key, reverse=True)]
+
+
+def latest_ready_export(export_base_dir, require_marker=True):
+  """Returns the newest export dir holding the marker, or None.
+
+  With require_marker False, the newest export dir is returned whether it
+  holds the marker or not, for exports by producers writing no markers.
+  """
+  for export_dir in export_dirs(export_base_dir):
+    if not require_marker or is_ready(export_dir):
+      return export_dir
+  return None
+
+
+def mark_latest_export(export_base_dir):
+  """Marks the newest export dir under export_base_dir as complete.
+
+  Returns:
+    The marked export dir, or None if there is none.
+  """
+  dirs = export_dirs(export_base_dir)
+  if not dirs:
+    return None
+  write_success_marker(dirs[0])
+  return dirs[0]
+
+
+def wait_for_export(export_base_dir, timeout_secs=DEFAULT_TIMEOUT_SECS,
+                    poll_secs=DEFAULT_POLL_SECS, max_poll_secs=MAX_POLL_SECS,
+                    require_marker=True):
+  """Waits for a complete export under export_base_dir.
+
+  The base dir is listed every poll_secs, the interval growing by half up
+  to max_poll_secs, with POLL_JITTER applied to each interval.
+
+  Args:
+    export_base_dir: Directory the exporter writes timestamped dirs to.
+    timeout_secs: Seconds to wait before giving up.
+    poll_secs: Initial seconds between two listings.
+    max_poll_secs: Maximum seconds between two listings.
+    require_marker: If False, wait for any export dir other than the temp
+      ones, for exports by producers writing no markers.
+
+  Returns:
+    The newest export dir holding the marker, or the newest export dir if
+    require_marker is False.
+
+  Raises:
+    RuntimeError: if no export is complete after timeout_secs.
+  """
+  deadline = time.time() + timeout_secs
+  interval = poll_secs
+  while True:
+    export_dir = latest_ready_export(export_base_dir, require_marker)
+    if export_dir:
+      return export_dir
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      raise RuntimeError('No complete export under %s after %d seconds' %
+                         (export_base_dir, timeout_secs))
+    sleeptime = min(
+        interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER),
+        remaining)
+    print('Waiting %.1f seconds for an export under %s...' %
+          (sleeptime, export_base_dir))
+    time.sleep(sleeptime)
+    interval = min(interval * 1.5, max_poll_secs)
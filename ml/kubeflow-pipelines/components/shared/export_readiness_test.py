@@ -0,0 +1,80 @@
+# Copyright 2018 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for export_readiness on the local filesystem."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import export_readiness
+
+
+class ExportReadinessTest(unittest.TestCase):
+
+  def setUp(self):
+    self._base_dir = tempfile.mkdtemp()
+    for name in ['100', '200', 'temp-300']:
+      os.makedirs(os.path.join(self._base_dir, name))
+
+  def tearDown(self):
+    shutil.rmtree(self._base_dir)
+
+  def _path(self, name):
+    return os.path.join(self._base_dir, name)
+
+  def test_export_dirs_skip_temp_dirs(self):
+    self.assertEqual([self._path('200'), self._path('100')],
+                     export_readiness.export_dirs(self._base_dir))
+
+  def test_write_success_marker(self):
+    export_readiness.write_success_marker(self._path('100'))
+    self.assertEqual([export_readiness.SUCCESS_MARKER],
+                     os.listdir(self._path('100')))
+    self.assertTrue(export_readiness.is_ready(self._path('100')))
+
+  def test_latest_ready_export(self):
+    self.assertIsNone(export_readiness.latest_ready_export(self._base_dir))
+    export_readiness.write_success_marker(self._path('100'))
+    self.assertEqual(self._path('100'),
+                     export_readiness.latest_ready_export(self._base_dir))
+    self.assertEqual(self._path('200'),
+                     export_readiness.latest_ready_export(
+                         self._base_dir, require_marker=False))
+
+  def test_wait_for_export_sees_new_marker(self):
+    timer = threading.Timer(
+        0.2, export_readiness.mark_latest_export, [self._base_dir])
+    timer.start()
+    try:
+      self.assertEqual(self._path('200'),
+                       export_readiness.wait_for_export(
+                           self._base_dir, timeout_secs=10, poll_secs=0.05))
+    finally:
+      timer.cancel()
+
+  def test_wait_for_export_times_out(self):
+    with self.assertRaises(RuntimeError):
+      export_readiness.wait_for_export(
+          self._path('missing'), timeout_secs=0.2, poll_secs=0.05)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -23,6 +23,7 @@ import tensorflow as tf
 import pathlib2
 
 import bwmodel.model as bwmodel
+import export_readiness
 
 DEVELOP_MODE = False
 NBUCKETS = 5 # for embeddings
@@ -164,6 +165,7 @@ def main():
   try:
     logging.info("exporting model....")
     tf.saved_model.save(model, export_dir)
+    export_readiness.write_success_marker(export_dir)
     logging.info("train_output_path: %s", args.train_output_path)
     export_path = '{}/export/bikesw'.format(OUTPUT_DIR)
     logging.info('export path: %s', export_path)
@@ -174,6 +176,7 @@ def main():
     time.sleep(10)
     logging.info("again ... exporting model....")
     tf.saved_model.save(model, export_dir)
+    export_readiness.write_success_marker(export_dir)
     export_path = '{}/export/bikesw'.format(OUTPUT_DIR)
     pathlib2.Path(args.train_output_path).write_text(export_path)
 
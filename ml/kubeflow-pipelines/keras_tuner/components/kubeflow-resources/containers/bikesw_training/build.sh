@@ -23,6 +23,7 @@ fi
 
 mkdir -p ./build
 rsync -arvp "../../bikesw_training"/ ./build/
+rsync -arvp "../../../../../components/shared/export_readiness.py" ./build/
 
 docker build -t bw-pl-bikes-train .
 rm -rf ./build
@@ -15,3 +15,4 @@
 
 mkdir -p ./build
 cp -pr ../../bikesw_training/* ./build/
+cp -p ../../../../../components/shared/export_readiness.py ./build/
@@ -15,5 +15,6 @@
 
 mkdir -p ./build
 cp -pr ../../tf-serving/* ./build/
+cp -p ../../../../../components/shared/export_readiness.py ./build/
 
 
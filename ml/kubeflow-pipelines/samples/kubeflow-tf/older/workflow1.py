@@ -53,6 +53,7 @@ def workflow1(
           "--ts1", ts1,
           "--ts2", ts2,
           "--stage", "eval",
+          "--transform_dir", '%s/%s/tft-train' % (working_dir, '{{workflow.name}}'),
           "--preprocessing-module", preprocessing_module1]
       # file_outputs = {'transformed': '/output.txt'}
       ).apply(gcp.use_gcp_secret('user-gcp-sa'))
@@ -82,6 +83,7 @@ def workflow1(
           "--ts1", ts1,
           "--ts2", ts2,
           "--stage", "eval",
+          "--transform_dir", '%s/%s/tft-train2' % (working_dir, '{{workflow.name}}'),
           "--preprocessing_module", preprocessing_module2]
       ).apply(gcp.use_gcp_secret('user-gcp-sa'))
   tfttrain2 = dsl.ContainerOp(
@@ -99,6 +101,10 @@ def workflow1(
           "--preprocessing_module", preprocessing_module2]
       ).apply(gcp.use_gcp_secret('user-gcp-sa'))
 
+  # The eval stages reuse the analysis of the corresponding train stage.
+  tfteval.after(tfttrain)
+  tfteval2.after(tfttrain2)
+
   train = dsl.ContainerOp(
       name = 'train',
       image = 'gcr.io/google-samples/ml-pipeline-kubeflow-tf-taxi',
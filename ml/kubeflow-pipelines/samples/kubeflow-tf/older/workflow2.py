@@ -141,7 +141,7 @@ def workflow2(
   analyze = dsl.ContainerOp(
       name = 'analyze',
       image = 'gcr.io/google-samples/ml-pipeline-dataflow-tfma-taxi',
-      arguments = ["--input_csv", '%s/%s/tft-eval/eval.csv-00000-of-00001' % (working_dir, '{{workflow.name}}'),
+      arguments = ["--input_csv", '%s/%s/tft-eval/eval.csv.manifest.json' % (working_dir, '{{workflow.name}}'),
           "--tfma_run_dir", '%s/%s/tfma/output' % (working_dir, '{{workflow.name}}'),
           "--eval_model_dir", '%s/%s/tf/eval_model_dir' % (working_dir, '{{workflow.name}}'),
           "--mode", tfma_mode,
@@ -151,7 +151,7 @@ def workflow2(
   analyze2 = dsl.ContainerOp(
       name = 'analyze2',
       image = 'gcr.io/google-samples/ml-pipeline-dataflow-tfma-taxi',
-      arguments = ["--input_csv", '%s/%s/tft-eval/eval.csv-00000-of-00001' % (working_dir, '{{workflow.name}}'),
+      arguments = ["--input_csv", '%s/%s/tft-eval/eval.csv.manifest.json' % (working_dir, '{{workflow.name}}'),
           "--tfma_run_dir", '%s/%s/tfma2/output' % (working_dir, '{{workflow.name}}'),
           "--eval_model_dir", '%s/%s/tf2/eval_model_dir' % (working_dir, '{{workflow.name}}'),
           "--mode", tfma_mode,
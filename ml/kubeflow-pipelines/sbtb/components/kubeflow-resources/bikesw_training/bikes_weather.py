@@ -28,6 +28,8 @@ import numpy as np
 import pathlib2
 import tensorflow as tf
 
+import export_readiness
+
 DEVELOP_MODE = False
 NBUCKETS = 5 # for embeddings
 NUM_EXAMPLES = 1000*1000 * 20 # assume 20 million examples
@@ -238,6 +240,7 @@ def main():
   try:
     logging.info("exporting model....")
     tf.saved_model.save(model, export_dir)
+    export_readiness.write_success_marker(export_dir)
     if args.train_output_path:
       logging.info("train_output_path: %s", args.train_output_path)
       pathlib2.Path(args.train_output_path).parent.mkdir(parents=True)
@@ -250,6 +253,7 @@ def main():
     time.sleep(10)
     logging.info("again ... exporting model....")
     tf.saved_model.save(model, export_dir)
+    export_readiness.write_success_marker(export_dir)
     if args.train_output_path:
       logging.info("train_output_path: %s", args.train_output_path)
       pathlib2.Path(args.train_output_path).parent.mkdir(parents=True)
@@ -23,6 +23,7 @@ fi
 
 mkdir -p ./build
 rsync -arvp "../../tf-serving"/ ./build/
+rsync -arvp "../../../../../components/shared/export_readiness.py" ./build/
 
 docker build -t ml-pipeline-tfserve .
 rm -rf ./build
@@ -20,7 +20,7 @@ import logging
 import subprocess
 import requests
 
-from tensorflow.python.lib.io import file_io  #pylint: disable=no-name-in-module
+import export_readiness
 
 
 def main():
@@ -40,28 +40,24 @@ def main():
                            'If not set, assuming this runs in a GKE container and current ' +
                            'cluster is used.')
   parser.add_argument('--zone', type=str, help='zone of the kubeflow cluster.')
+  parser.add_argument(
+      '--export_wait_secs',
+      help='Seconds to wait for a complete model export.',
+      default=export_readiness.DEFAULT_TIMEOUT_SECS,
+      type=int)
   args = parser.parse_args()
 
   KUBEFLOW_NAMESPACE = 'kubeflow'
   ts = str(int(time.time()))
 
-  # Make sure model dir exists before proceeding
-  retries = 0
-  sleeptime = 5
-  while retries < 20:
-    try:
-      model_dir = os.path.join(args.model_path, file_io.list_directory(args.model_path)[-1])
-      print("model subdir: %s" % model_dir)
-      break
-    except Exception as e:  #pylint: disable=broad-except
-      print(e)
-      print("Sleeping %s seconds to sync with GCS..." % sleeptime)
-      time.sleep(sleeptime)
-      retries += 1
-      sleeptime *= 2
-  if retries >= 20:
-    print("could not get model subdir from %s, exiting" % args.model_path)
+  # Wait for the trainer to mark an export as complete before proceeding.
+  try:
+    model_dir = export_readiness.wait_for_export(
+        args.model_path, timeout_secs=args.export_wait_secs)
+  except RuntimeError as e:
+    print(e)
     exit(1)
+  print("model subdir: %s" % model_dir)
 
   logging.getLogger().setLevel(logging.INFO)
   args_dict = vars(args)